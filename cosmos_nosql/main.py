@@ -21,7 +21,7 @@ import uuid
 
 from docopt import docopt
 
-from pysrc.nosqlbundle import Bytes, Cosmos, Counter, Env, FS, OpenAIClient, Storage, System
+from pysrc.nosqlbundle import Bytes, Cosmos, Counter, EmbeddingsSidecar, Env, FS, OpenAIClient, Storage, System
 
 import matplotlib
 import openai
@@ -48,6 +48,27 @@ def check_env():
 def wrangled_embeddings_file():
     return '../data/wrangled/documents_with_embeddings.json'
 
+def wrangled_embeddings_sidecar():
+    return EmbeddingsSidecar('../data/wrangled/documents_with_embeddings')
+
+def read_wrangled_documents():
+    """
+    Return the wrangled documents and their memory-mapped EmbeddingsSidecar,
+    or the documents of the wrangled json file and None if the sidecar files
+    don't exist; see 'python bb_wrangle.py write_embeddings_sidecar'.
+    """
+    sidecar = wrangled_embeddings_sidecar()
+    if sidecar.exists():
+        print(f'reading the embeddings sidecar: {sidecar.basename}')
+        return sidecar.load().read_documents(), sidecar
+    return FS.read_json(wrangled_embeddings_file()), None
+
+def document_embeddings(doc, sidecar):
+    """ Return the embeddings of the given doc, setting them from the sidecar if given. """
+    if sidecar is not None:
+        doc['embeddings'] = sidecar.vector_list(doc['playerID'])
+    return doc['embeddings']
+
 def load_nosql_baseballplayers():
     opts = dict()
     opts['url'] = Env.var('AZURE_COSMOSDB_NOSQL_URI')
@@ -56,13 +77,13 @@ def load_nosql_baseballplayers():
     c.set_db('dev')
     c.set_container('baseballplayers')
 
-    documents = FS.read_json(wrangled_embeddings_file())
+    documents, sidecar = read_wrangled_documents()
     player_ids = sorted(documents.keys())
 
     for idx, pid in enumerate(player_ids):
         try:
             doc = documents[pid]
-            embeddings = doc['embeddings']
+            embeddings = document_embeddings(doc, sidecar)
             if idx < 100_000:
                 if len(embeddings) == EXPECTED_EMBEDDINGS_ARRAY_LENGTH:
                     id = str(uuid.uuid4())
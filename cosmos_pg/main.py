@@ -6,6 +6,7 @@ Usage:
   -
   python main.py load_baseball_players <envname> <dbname>
   python main.py load_baseball_players cosmos citus
+  python main.py load_baseball_players cosmos citus --float16
   -
   python main.py load_baseball_batters cosmos citus
   -
@@ -23,12 +24,14 @@ import sys
 import time
 import traceback
 
+import numpy as np
+
 from docopt import docopt
 
 import psycopg2
 from psycopg2 import pool
 
-from pysrc.minbundle import Bytes, Counter, Env, FS, Storage, System
+from pysrc.minbundle import Bytes, Counter, EmbeddingsSidecar, Env, FS, Storage, System
 
 EXPECTED_EMBEDDINGS_ARRAY_LENGTH = 1536
 
@@ -133,14 +136,14 @@ def load_baseball_players(envname, dbname):
         ]
         columns_tup = str(tuple(columns_list)).replace("'",'')
 
-        print('reading the wrangled_embeddings_file...')
-        documents = FS.read_json(wrangled_embeddings_file())
+        print('reading the wrangled documents...')
+        documents, sidecar = read_wrangled_documents()
         player_ids = sorted(documents.keys())
 
         for idx, pid in enumerate(player_ids):
             try:
                 doc = documents[pid]
-                embeddings = doc['embeddings']
+                embeddings = document_embeddings(doc, sidecar)
                 if idx < 100_000:
                     if len(embeddings) == EXPECTED_EMBEDDINGS_ARRAY_LENGTH:
                         id = idx + 1
@@ -168,7 +171,7 @@ def load_baseball_players(envname, dbname):
                         column_values.append(pitching_data)
                         column_values.append(batting_data)
                         column_values.append(doc['embeddings_str'])
-                        column_values.append(str(doc['embeddings']))
+                        column_values.append(vector_literal(doc['embeddings']))
                         values_tup = tuple(column_values)
                         sql_stmt = f'insert into players {columns_tup} values {values_tup};'
                         cursor.execute(sql_stmt)
@@ -230,15 +233,15 @@ def load_baseball_batters(envname, dbname):
         ]
         columns_tup = str(tuple(columns_list)).replace("'",'')
 
-        print('reading the wrangled_embeddings_file...')
-        documents = FS.read_json(wrangled_embeddings_file())
+        print('reading the wrangled documents...')
+        documents, sidecar = read_wrangled_documents()
         player_ids = sorted(documents.keys())
 
         for idx, pid in enumerate(player_ids):
             try:
                 doc = documents[pid]
                 if doc['category'] == 'fielder':
-                    embeddings = doc['embeddings']
+                    embeddings = document_embeddings(doc, sidecar)
                     if idx < 100_000:
                         if len(embeddings) == EXPECTED_EMBEDDINGS_ARRAY_LENGTH:
                             id = idx + 1
@@ -351,16 +354,55 @@ def search_similar_baseball_players(envname, dbname, player_id):
             client.close()
 
 def vector_query_sql(embeddings):
+    # The wrangled embeddings are unit-normalized, so the <#> (negative inner
+    # product) order is the cosine similarity order, without the norms, as in
+    # the IP vCore and dotProduct Cognitive Search indexes.
     return """
 select player_id, first_name, last_name, bats, throws, primary_position, embeddings_str
 from players
-order by embeddings <-> '{}'
+order by embeddings <#> '{}'
 limit 10;
     """.format(embeddings).strip()
 
+def vector_literal(embeddings):
+    """
+    Return the pgvector text value of the given embeddings.  With --float16
+    the values are formatted at half precision, for a halfvec(1536) players
+    embeddings column (pgvector 0.7.0+); see psql/baseball_deldef.sql.
+    """
+    if Env.boolean_arg('--float16'):
+        return '[{}]'.format(','.join(str(v) for v in np.asarray(embeddings, dtype=np.float16)))
+    return str(embeddings)
+
 def wrangled_embeddings_file():
     return '../data/wrangled/documents_with_embeddings.json'
 
+def wrangled_embeddings_sidecar():
+    return EmbeddingsSidecar('../data/wrangled/documents_with_embeddings')
+
+def read_wrangled_documents():
+    """
+    Return the wrangled documents and their memory-mapped EmbeddingsSidecar,
+    or the documents of the wrangled json file and None if the sidecar files
+    don't exist; see 'python bb_wrangle.py write_embeddings_sidecar'.
+    With --float16 the compact float16 sidecar matrix is read if it exists;
+    see 'python bb_wrangle.py quantize_embeddings float16'.
+    """
+    sidecar = wrangled_embeddings_sidecar()
+    if sidecar.exists():
+        encoding = None
+        if Env.boolean_arg('--float16') and os.path.isfile(sidecar.matrix_file('float16')):
+            encoding = 'float16'
+        print(f'reading the embeddings sidecar: {sidecar.basename}, encoding: {encoding or "float32"}')
+        return sidecar.load(encoding).read_documents(), sidecar
+    return FS.read_json(wrangled_embeddings_file()), None
+
+def document_embeddings(doc, sidecar):
+    """ Return the embeddings of the given doc, setting them from the sidecar if given. """
+    if sidecar is not None:
+        doc['embeddings'] = sidecar.vector_list(doc['playerID'])
+    return doc['embeddings']
+
 def get_jsonb_value(doc, key):
     if key in doc.keys():
         return doc[key]
@@ -27,6 +27,7 @@ create table players (
   batting_data         jsonb,
   embeddings_str       VARCHAR(255),
   embeddings           vector(1536)
+  -- embeddings        halfvec(1536)  -- pgvector 0.7.0+, for 'load_baseball_players ... --float16'
 );
 
 -- this table is only for ad-hoc queries of batters
@@ -3,7 +3,7 @@ Module minbundle.py - bundled standard codebase.
 Copyright (c) 2023 Chris Joakim, MIT License
 Timestamp: 2023-08-01 15:43
 
-Usage:  from pysrc.minbundle import Bytes, Counter, Env, FS, Storage, System
+Usage:  from pysrc.minbundle import Bytes, Counter, EmbeddingsSidecar, Env, FS, Storage, System
 """
 
 import csv
@@ -15,6 +15,7 @@ import sys
 import time
 import traceback
 
+import numpy as np
 import psutil
 
 from numbers import Number
@@ -155,6 +156,85 @@ class Counter():
         return self.data
 # ==============================================================================
 
+class EmbeddingsSidecar():
+    """
+    This class reads and writes the binary sidecar of a dict of documents
+    with embeddings: a contiguous float32 .npy matrix with one row per
+    vectorized document, a json list of the row ids, and a slim json file of
+    the documents without their embeddings.  The matrix is memory-mapped on
+    read, so the vectors are not parsed out of a large json file.
+    """
+    def __init__(self, basename: str):
+        self.basename = basename
+        self.ids = None
+        self.index = None
+        self.matrix = None
+
+    def matrix_file(self, encoding: str = None) -> str:
+        """ Return the float32 matrix filename, or that of the given compact encoding, such as float16. """
+        if encoding is None or encoding == 'float32':
+            return f'{self.basename}.npy'
+        return f'{self.basename}_{encoding}.npy'
+
+    def ids_file(self) -> str:
+        return f'{self.basename}_ids.json'
+
+    def docs_file(self) -> str:
+        return f'{self.basename}_docs.json'
+
+    def exists(self) -> bool:
+        """ Return True if all three sidecar files exist. """
+        for f in [self.matrix_file(), self.ids_file(), self.docs_file()]:
+            if not os.path.isfile(f):
+                return False
+        return True
+
+    def write(self, documents: dict, dimensions: int, key='embeddings') -> int:
+        """
+        Write the sidecar files for the given dict of id -> document, in id
+        order.  Only documents with a key list of the given dimensions get a
+        matrix row.  Return the row count.
+        """
+        ids, rows, docs = list(), list(), dict()
+        for id in sorted(documents.keys()):
+            doc = documents[id]
+            docs[id] = {k: v for k, v in doc.items() if k != key}
+            vector = doc.get(key)
+            if isinstance(vector, list) and len(vector) == dimensions:
+                ids.append(id)
+                rows.append(vector)
+        matrix = np.asarray(rows, dtype=np.float32).reshape(len(rows), dimensions)
+        np.save(self.matrix_file(), matrix)
+        print(f'file written: {self.matrix_file()}')
+        FS.write_json(ids, self.ids_file(), pretty=False)
+        FS.write_json(docs, self.docs_file(), pretty=False)
+        return len(ids)
+
+    def load(self, encoding: str = None):
+        """ Memory-map the matrix, or its given compact encoding, and read the row ids; return self. """
+        self.ids = FS.read_json(self.ids_file())
+        self.index = {id: row for row, id in enumerate(self.ids)}
+        self.matrix = np.load(self.matrix_file(encoding), mmap_mode='r')
+        return self
+
+    def read_documents(self) -> dict:
+        """ Return the dict of id -> document, without the embeddings. """
+        return FS.read_json(self.docs_file())
+
+    def vector(self, id: str):
+        """ Return the float32 vector of the given id, or None. """
+        if id in self.index:
+            return self.matrix[self.index[id]]
+        return None
+
+    def vector_list(self, id: str) -> list[float]:
+        """ Return the vector of the given id as a list of floats, or an empty list. """
+        vector = self.vector(id)
+        if vector is None:
+            return list()
+        return vector.tolist()
+# ==============================================================================
+
 class Env():
     """
     This class is used to read the host environment, such as username and
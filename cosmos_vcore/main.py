@@ -29,7 +29,7 @@ import uuid
 
 from docopt import docopt
 
-from pysrc.mongobundle import Bytes, Counter, Env, FS, Mongo, OpenAIClient, Storage, System, Template
+from pysrc.mongobundle import Bytes, Counter, EmbeddingsSidecar, Env, FS, Mongo, OpenAIClient, Storage, System, Template
 
 import matplotlib
 import openai
@@ -55,6 +55,27 @@ def check_env():
 def wrangled_embeddings_file():
     return '../data/wrangled/documents_with_embeddings.json'
 
+def wrangled_embeddings_sidecar():
+    return EmbeddingsSidecar('../data/wrangled/documents_with_embeddings')
+
+def read_wrangled_documents():
+    """
+    Return the wrangled documents and their memory-mapped EmbeddingsSidecar,
+    or the documents of the wrangled json file and None if the sidecar files
+    don't exist; see 'python bb_wrangle.py write_embeddings_sidecar'.
+    """
+    sidecar = wrangled_embeddings_sidecar()
+    if sidecar.exists():
+        print(f'reading the embeddings sidecar: {sidecar.basename}')
+        return sidecar.load().read_documents(), sidecar
+    return FS.read_json(wrangled_embeddings_file()), None
+
+def document_embeddings(doc, sidecar):
+    """ Return the embeddings of the given doc, setting them from the sidecar if given. """
+    if sidecar is not None:
+        doc['embeddings'] = sidecar.vector_list(doc['playerID'])
+    return doc['embeddings']
+
 def load_vcore_baseball_players():
     opts = dict()
     opts['conn_string'] = Env.var('AZURE_COSMOSDB_MONGO_VCORE_CONN_STR')
@@ -65,13 +86,13 @@ def load_vcore_baseball_players():
     count = m.count_docs({})
     print('document count in db: {}, collection: {} = {}'.format(dbname, cname, count))
     
-    documents = FS.read_json(wrangled_embeddings_file())
+    documents, sidecar = read_wrangled_documents()
     player_ids = sorted(documents.keys())
 
     for idx, pid in enumerate(player_ids):
         try:
             doc = documents[pid]
-            embeddings = doc['embeddings']
+            embeddings = document_embeddings(doc, sidecar)
             if idx < 100_000:
                 if len(embeddings) == EXPECTED_EMBEDDINGS_ARRAY_LENGTH:
                     id = str(uuid.uuid4())
@@ -183,7 +204,7 @@ def search_player_like(pid):
 def random_player_search():
     print('===')
     print('random_player_search...')
-    documents = FS.read_json(wrangled_embeddings_file())
+    documents, _ = read_wrangled_documents()
     player_ids = sorted(documents.keys())
     random_pid = random.choice(player_ids)
     print('random_pid: {}'.format(random_pid))
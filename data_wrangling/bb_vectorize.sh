@@ -11,14 +11,22 @@ python --version
 
 # Users/Customers generate the embeddings with their own Azure OpenAI account
 # per the AZURE_OPENAI_URL and AZURE_OPENAI_KEY1 environment variables.
+# Set AZURE_OPENAI_EMBEDDINGS_RPM and AZURE_OPENAI_EMBEDDINGS_TPM to the quotas
+# of your embeddings deployment; the requests are sent concurrently within them.
 # The output data file from this step is NOT stored in GitHub.
 
 # The arg '1872' is the minimum debut_year of the player.
 # Using a more recent debut_year value will reduce the number
 # of rows/documents to be vectorized, and loaded into the DB.
+# The embeddings are checkpointed to tmp/embeddings_log.jsonl and .f32; if this step
+# is interrupted, rerun it to resume where it left off.
 
 python bb_wrangle.py add_embeddings_to_documents 1872
 
+# Optionally reduce the 1536-dimension embeddings to 64, 128, and 256
+# dimensions with PCA, and report the recall@10 loss of each.
+# python bb_wrangle.py reduce_embeddings pca all
+
 echo 'listing of all tmp files:'
 ls -al tmp/*.*
 
@@ -10,13 +10,31 @@ Usage:
   python bb_wrangle.py calc_player_teams
   python bb_wrangle.py calc_batters_stats
   python bb_wrangle.py calc_pitchers_stats
+  python bb_wrangle.py verify_pitchers_stats
   -
   python bb_wrangle.py build_documents
+  python bb_wrangle.py verify_embeddings_str
+  python bb_wrangle.py build_feature_vectors
+  python bb_wrangle.py search_feature_vectors <playerID>
+  python bb_wrangle.py search_feature_vectors aaronha01
+  -
+  python bb_wrangle.py run_all
   -
   python bb_wrangle.py add_embeddings_to_documents <min-debut-year>
   python bb_wrangle.py add_embeddings_to_documents 1872
   python bb_wrangle.py add_embeddings_to_documents 1970
   python bb_wrangle.py add_embeddings_to_documents 2010
+  python bb_wrangle.py add_embeddings_to_documents 1872 --local-hash
+  python bb_wrangle.py write_embeddings_sidecar
+  python bb_wrangle.py normalize_embeddings
+  python bb_wrangle.py token_report <min-debut-year>
+  python bb_wrangle.py token_report 1872
+  python bb_wrangle.py reduce_embeddings <pca|random> <dimensions>
+  python bb_wrangle.py reduce_embeddings pca 128
+  python bb_wrangle.py reduce_embeddings random 256
+  python bb_wrangle.py reduce_embeddings pca all
+  python bb_wrangle.py quantize_embeddings <int8|float16|all>
+  python bb_wrangle.py quantize_embeddings all
   -
   python bb_wrangle.py scan_documents
   python bb_wrangle.py filter_documents
@@ -34,17 +52,117 @@ Options:
 import json
 import os
 import sys
+import time
 import traceback
 
+import numpy as np
 import pandas as pd
 
 from docopt import docopt
 
-from pysrc.aibundle import Bytes, CogSearchClient, CogSvcsClient, Counter, Env, FS, Mongo, OpenAIClient, Storage, StringUtil, System
+from pysrc.aibundle import Bytes, CogSearchClient, CogSvcsClient, Counter, EmbeddingsSidecar, Env, FS, Mongo, OpenAIClient, Storage, StringUtil, System
+from pysrc.embeddings import EmbeddingsExecutor, EmbeddingsLog, EmbeddingsProgress, text_hash
+from pysrc.pipeline import Pipeline
+from pysrc.quantization import ENCODINGS, Float16Encoding, Int8Encoding, encoded_top_k, squared_norms
+from pysrc.vectors import Reducer, exact_top_k, recall_at_k, sample_rows
 
 EXPECTED_EMBEDDINGS_ARRAY_LENGTH = 1536
 ALGORITHM_RAW_NUMBERS =  'raw-numbers'
 ALGORITHM_BINNED_TEXT =  'binned-text'
+ALGORITHM_FEATURE_VECTOR = 'feature-vector'
+# The (stat, bin_factor) pairs of the binned calculated stats in the
+# binned-text embeddings_str values, in token order.
+EMBEDDINGS_PITCHING_BINS = [
+    ('opp_batting_avg', 1000),
+    ('so_pct',  1000),
+    ('bb_pct',  1000),
+    ('hbp_pct', 1000),
+    ('hr_pct',  1000),
+    ('win_pct', 100),
+    ('sho_pct', 100),
+    ('cg_pct',  100)
+]
+EMBEDDINGS_BATTING_BINS = [
+    ('batting_avg', 1000),
+    ('runs_per_ab', 1000),
+    ('2b_avg',  1000),
+    ('3b_avg',  1000),
+    ('hr_avg',  1000),
+    ('rbi_avg', 1000),
+    ('bb_avg',  1000),
+    ('so_avg',  1000),
+    ('ibb_avg', 1000),
+    ('hbp_avg', 1000)
+]
+
+DATABANK_DIR = '../data/seanhahman-baseballdatabank-2023.1/core'
+APPEARANCES_CSV = f'{DATABANK_DIR}/Appearances.csv'
+PEOPLE_CSV  = f'{DATABANK_DIR}/People.csv'
+BATTING_CSV = f'{DATABANK_DIR}/Batting.csv'
+PITCHING_CSV = f'{DATABANK_DIR}/Pitching.csv'
+
+PEOPLE_COLS = 'playerID,birthYear,birthCountry,deathYear,nameFirst,nameLast,weight,height,bats,throws,debut,finalGame'.split(',')
+PEOPLE_INT_COLS = 'birthYear,weight,height'.split(',')
+PLAYER_POSITIONS_COLS = 'playerID,G_all,G_p,G_c,G_1b,G_2b,G_3b,G_ss,G_lf,G_cf,G_rf,G_dh'.split(',')
+POSITION_COLS = 'G_p,G_c,G_1b,G_2b,G_3b,G_ss,G_lf,G_cf,G_rf,G_dh'.split(',')
+PLAYER_TEAMS_COLS = 'yearID,teamID,playerID,G_all'.split(',')
+BATTING_COLS = 'G,AB,R,H,2B,3B,HR,RBI,SB,CS,BB,SO,IBB,HBP,SF'.split(',')
+PITCHING_COLS = 'W,L,G,GS,CG,SHO,SV,IPouts,H,ER,HR,BB,SO,BAOpp,ERA,IBB,WP,HBP,BK'.split(',')
+PITCHING_FLOAT_COLS = 'BAOpp,ERA'.split(',')
+# The explicit dtypes, and implied usecols, of the Databank csv files.
+# The nullable Int32 dtype is used for count columns with missing values.
+APPEARANCES_DTYPES = {'yearID': 'int32', 'teamID': 'category', 'playerID': 'str', 'G_all': 'Int32'}
+for col in POSITION_COLS:
+    APPEARANCES_DTYPES[col] = 'Int32'
+# The other Appearances columns are read only for the dropna mask of
+# appearances_df, so that rows with a blank in any column are still dropped.
+APPEARANCES_MASK_DTYPES = {'lgID': 'category'}
+for col in 'GS,G_batting,G_defense,G_of,G_ph,G_pr'.split(','):
+    APPEARANCES_MASK_DTYPES[col] = 'Int32'
+PEOPLE_DTYPES = {
+    'playerID': 'str', 'birthYear': 'Int32', 'birthCountry': 'category', 'deathYear': 'float64',
+    'nameFirst': 'str', 'nameLast': 'str', 'weight': 'Int32', 'height': 'Int32',
+    'bats': 'category', 'throws': 'category', 'debut': 'str', 'finalGame': 'str'
+}
+BATTING_DTYPES = {'playerID': 'str'}
+for col in BATTING_COLS:
+    BATTING_DTYPES[col] = 'Int32'
+PITCHING_DTYPES = {'playerID': 'str'}
+for col in PITCHING_COLS:
+    PITCHING_DTYPES[col] = 'float64' if col in PITCHING_FLOAT_COLS else 'Int32'
+DATABANK_FRAMES = {}
+# The one-hot values and z-scored stats of the feature-vector algorithm.
+FEATURE_BATS = ['L', 'R', 'B']
+FEATURE_THROWS = ['L', 'R', 'S']
+FEATURE_POSITIONS = [col.split('_')[1].upper() for col in POSITION_COLS]
+FEATURE_PITCHING_STATS = ['full_games_pitched_equiv', 'era'] + [stat for stat, _ in EMBEDDINGS_PITCHING_BINS]
+FEATURE_BATTING_STATS = [stat for stat, _ in EMBEDDINGS_BATTING_BINS] + ['sb_pct']
+FEATURE_ZSCORE_CLIP = 4.0
+FEATURE_VECTORS_NPY  = '../data/wrangled/feature_vectors.npy'
+FEATURE_VECTORS_JSON = '../data/wrangled/feature_vectors.json'
+EMBEDDINGS_SIDECAR_BASENAME = '../data/wrangled/documents_with_embeddings'
+EMBEDDINGS_LOG_FILE = 'tmp/embeddings_log.jsonl'
+EMBEDDINGS_CHECKPOINT_EVERY = 100
+EMBEDDINGS_CACHE_FILE = 'cache/embeddings_cache.db'
+DUPLICATE_EMBEDDINGS_FILE = '../data/wrangled/documents_duplicate_embeddings.json'
+EMBEDDINGS_USD_PER_1K_TOKENS = 0.0001  # text-embedding-ada-002
+REDUCED_EMBEDDINGS_DIMENSIONS = [64, 128, 256]
+RECALL_QUERY_COUNT = 500
+RECALL_K = 10
+RECALL_TRUTH_K = 100  # the true neighbors considered for ties with the k-th
+
+BATTING_RATIOS = [
+    ('runs_per_ab', 'R'),
+    ('batting_avg', 'H'),
+    ('2b_avg',  '2B'),
+    ('3b_avg',  '3B'),
+    ('hr_avg',  'HR'),
+    ('rbi_avg', 'RBI'),
+    ('bb_avg',  'BB'),
+    ('so_avg',  'SO'),
+    ('ibb_avg', 'IBB'),
+    ('hbp_avg', 'HBP')
+]
 
 def print_options(msg):
     print(msg)
@@ -53,28 +171,26 @@ def print_options(msg):
 
 def prune_people():
     print('=== prune_people')
-    df = people_df()
-    include_cols = 'playerID,birthYear,birthCountry,deathYear,nameFirst,nameLast,weight,height,bats,throws,debut,finalGame'.split(',')
-    df2 = include_only_cols(df, include_cols)
-    df2.sort_values(by=['playerID'])
+    df2 = pruned_people_df(people_df())
     write_df(df2, 'tmp/people.csv')
-    rows = FS.read_csv_as_dicts('tmp/people.csv')
-    # Cast appropriate attributes to ints
-    int_cols = 'birthYear,weight,height'.split(',')
-    for row in rows:
-        try:
-            for int_col in int_cols:
-                row[int_col] = to_int(row[int_col])
-        except Exception as e:
-            print(f"Exception on row: {row}")
-            print(traceback.format_exc())
-    FS.write_json(rows, 'tmp/people.json')
+    FS.write_json(people_records(df2), 'tmp/people.json')
+
+def pruned_people_df(df):
+    df2 = include_only_cols(df, PEOPLE_COLS)
+    df2.sort_values(by=['playerID'])
+    return df2
+
+def people_records(df2):
+    """
+    Return the list of people dicts for the given pruned people frame, with
+    the same str values that a csv round-trip would produce and the
+    birthYear/weight/height attributes cast to ints.
+    """
+    return csv_records(df2, PEOPLE_INT_COLS)
 
 def prune_player_positions():
     print('=== prune_player_positions')
-    df = appearances_df()
-    include_cols = 'playerID,G_all,G_p,G_c,G_1b,G_2b,G_3b,G_ss,G_lf,G_cf,G_rf,G_dh'.split(',')
-    df2 = include_only_cols(df, include_cols)
+    df2 = include_only_cols(appearances_df(), PLAYER_POSITIONS_COLS)
     df2.sort_values(by=['playerID'])
     write_df(df2, 'tmp/player_positions_pruned.csv')
     grouped = df2.groupby(['playerID'])
@@ -84,181 +200,249 @@ def prune_player_positions():
 
 def prune_player_teams():
     print('=== prune_player_teams')
-    df = appearances_df()
-    include_cols = 'yearID,teamID,playerID,G_all'.split(',')
-    df2 = include_only_cols(df, include_cols)
+    df2 = include_only_cols(appearances_df(), PLAYER_TEAMS_COLS)
     df2.sort_values(by=['playerID'])
     write_df(df2, 'tmp/player_teams.csv')
-    rows = FS.read_csv_as_dicts('tmp/player_teams.csv')
-    # Cast appropriate attributes to ints
-    int_cols = 'yearID,G_all'.split(',')
-    for row in rows:
-        try:
-            for int_col in int_cols:
-                row[int_col] = to_int(row[int_col])
-        except Exception as e:
-            print(f"Exception on row: {row}")
-            print(traceback.format_exc())
-    FS.write_json(rows, 'tmp/player_teams.json')
+    FS.write_json(csv_records(df2, ['yearID', 'G_all']), 'tmp/player_teams.json')
 
 def prune_batters():
     print('=== prune_batters')
     df = batters_df()
-    include_cols = 'playerID,G,AB,R,H,2B,3B,HR,RBI,SB,CS,BB,SO,IBB,HBP,SF'.split(',')
+    include_cols = ['playerID'] + BATTING_COLS
     df2 = include_only_cols(df, include_cols)
     df2.sort_values(by=['playerID'])
     write_df(df2, 'tmp/batters_pruned.csv')
-    grouped = df2.groupby(['playerID'])
-    grouped.sum().to_csv('tmp/batters.csv')
-    rows = FS.read_csv_as_dicts('tmp/batters.csv')
-    # Cast appropriate attributes to ints
-    int_cols = 'G,AB,R,H,2B,3B,HR,RBI,SB,CS,BB,SO,IBB,HBP,SF'.split(',')
-    for row in rows:
-        try:
-            for int_col in int_cols:
-                row[int_col] = to_int(row[int_col])
-        except Exception as e:
-            print(f"Exception on row: {row}")
-            print(traceback.format_exc())
-    FS.write_json(rows, 'tmp/batters.json')
+    grouped = df2.groupby(['playerID']).sum()
+    grouped.to_csv('tmp/batters.csv')
+    totals = batters_totals_df(grouped)
+    FS.write_json(totals.reset_index().to_dict(orient='records'), 'tmp/batters.json')
+    return totals
 
 def prune_pitchers():
     print('=== prune_pitchers')
     df = pitchers_df()
     # playerID,yearID,stint,teamID,lgID,W,L,G,GS,CG,SHO,SV,IPouts,H,ER,HR,BB,SO,BAOpp,ERA,IBB,WP,HBP,BK,BFP,GF,R,SH,SF,GIDP
-    include_cols = 'playerID,W,L,G,GS,CG,SHO,SV,IPouts,H,ER,HR,BB,SO,BAOpp,ERA,IBB,WP,HBP,BK'.split(',')
+    include_cols = ['playerID'] + PITCHING_COLS
     df2 = include_only_cols(df, include_cols)
     df2.sort_values(by=['playerID'])
     write_df(df2, 'tmp/pitchers_pruned.csv')
-    grouped = df2.groupby(['playerID'])
-    grouped.sum().to_csv('tmp/pitchers.csv')
-    rows = FS.read_csv_as_dicts('tmp/pitchers.csv')
-    # Cast appropriate attributes to ints
-    int_cols = 'W,L,G,GS,CG,SHO,SV,IPouts,H,ER,HR,BB,SO,IBB,WP,HBP,BK'.split(',')
-    float_cols = 'BAOpp,ERA'.split(',')
-    for row in rows:
-        try:
-            for int_col in int_cols:
-                row[int_col] = to_int(row[int_col])
-            for float_col in float_cols:
-                row[float_col] = to_float(row[float_col])
-        except Exception as e:
-            print(f"Exception on row: {row}")
-            print(traceback.format_exc())
-
-    FS.write_json(rows, 'tmp/pitchers.json')
+    grouped = df2.groupby(['playerID']).sum()
+    grouped.to_csv('tmp/pitchers.csv')
+    totals = pitchers_totals_df(grouped)
+    FS.write_json(totals.reset_index().to_dict(orient='records'), 'tmp/pitchers.json')
+    return totals
 
 def calc_player_positions():
     print('=== calc_player_positions')
     infile = 'tmp/player_positions.csv'
     outfile = 'tmp/player_positions.json'
     rows = FS.read_csv_as_dicts(infile)
+    grouped = pd.read_csv(infile, index_col='playerID', float_precision='round_trip')
+    primary = primary_positions(grouped).tolist()
+    games = grouped['G_all'].to_numpy(dtype='float64')
+    percents = {}
+    for position_col in POSITION_COLS:
+        position = position_col.split('_')[1]
+        percents[f"{position}_percent"] = (grouped[position_col].to_numpy(dtype='float64') / games).tolist()
     player_dict = {}
-    position_cols = 'G_p,G_c,G_1b,G_2b,G_3b,G_ss,G_lf,G_cf,G_rf,G_dh'.split(',')
     for row_idx, player in enumerate(rows):
-        player['primary_position'] = '?'
-        pid = player['playerID']
-        games = float(player['G_all'])
-        player_dict[pid] = player
-        greatest = 0.0
-        for position_col in position_cols:
-            position = position_col.split('_')[1]
-            position_percent_col = f"{position}_percent"
-            n = float(player[position_col])
-            player[position_percent_col] = n / games
-            if n > greatest:
-                greatest = n
-                player['primary_position'] = position.upper()
+        player['primary_position'] = primary[row_idx]
+        for position_percent_col, values in percents.items():
+            player[position_percent_col] = values[row_idx]
+        player_dict[player['playerID']] = player
         if verbose():
             print(json.dumps(player, sort_keys=False, indent=2))
     FS.write_json(player_dict, outfile)
 
+def primary_positions(grouped):
+    """
+    Return a Series, indexed by playerID, of the position with the most games
+    for each player in the given grouped appearances frame.  Ties go to the
+    first position in POSITION_COLS; players with no position games get '?'.
+    """
+    games = grouped[POSITION_COLS].to_numpy(dtype='float64')
+    labels = np.array([col.split('_')[1].upper() for col in POSITION_COLS], dtype=object)
+    primary = labels[games.argmax(axis=1)] if len(games) > 0 else labels[:0]
+    primary = np.where(games.max(axis=1, initial=0.0) > 0.0, primary, '?')
+    return pd.Series(primary, index=grouped.index)
+
 def calc_player_teams():
     print('=== calc_player_teams')
     infile = 'tmp/player_teams.csv'
     outfile = 'tmp/player_teams_calc.json'
-    rows = FS.read_csv_as_dicts(infile)
-    player_dict = {}
+    df = pd.read_csv(infile, dtype={'playerID': str, 'teamID': str}, keep_default_na=False)
+    FS.write_json(player_teams_dict(player_team_games_df(df)), outfile)
 
-    # First collect the playerDict
-    for row_idx, player in enumerate(rows):
-        # {'yearID': '2022', 'teamID': 'BAL', 'playerID': 'zimmebr02', 'G_all': '15'}
-        pid = player['playerID']
-        tid = player['teamID']
-        game_count = int(float(player['G_all']))
-        if pid in player_dict.keys():
+def player_team_games_df(df):
+    """
+    Return a playerID/teamID/G_all frame of the games per player per team,
+    for the given appearances frame, in order of first appearance.
+    """
+    games = df['G_all'].astype('float64').astype('int64')
+    return games.groupby([df['playerID'], df['teamID']], sort=False, observed=True).sum().reset_index()
+
+def player_teams_dict(team_games):
+    """
+    Return a dict of playerID -> {total_games, teams, primary_team} for the
+    given player_team_games_df frame.  The primary team is the first one
+    with the most games.
+    """
+    player_dict = {}
+    rows = zip(team_games['playerID'].tolist(), team_games['teamID'].tolist(), team_games['G_all'].tolist())
+    for pid, tid, game_count in rows:
+        if pid in player_dict:
             player_info = player_dict[pid]
             player_info['total_games'] = player_info['total_games'] + game_count
-            if tid in player_info['teams'].keys():
-                player_info['teams'][tid] = player_info['teams'][tid] + game_count
-            else:
-                player_info['teams'][tid] = game_count
         else:
             player_info = {}
             player_info['total_games'] = game_count
             player_info['teams'] = {}
-            player_info['teams'][tid] = game_count
             player_dict[pid] = player_info
+        player_info['teams'][tid] = game_count
     # Identify the primary team for each player
-    for pid in sorted(player_dict.keys()):
-        player_info, highest = player_dict[pid], 0
-        for tid in player_info['teams'].keys():
-            games = player_info['teams'][tid]
+    for player_info in player_dict.values():
+        highest = 0
+        for tid, games in player_info['teams'].items():
             if games > highest:
                 highest = games
                 player_info['primary_team'] = tid
+    return player_dict
 
-    FS.write_json(player_dict, outfile)
-
-def calc_batters_stats():
+def calc_batters_stats(totals=None):
     print('=== calc_batters_stats')
-    infile  = 'tmp/batters.json'
     outfile = 'tmp/batters_calc.json'
-    batters_list = FS.read_json(infile)
-    output_dict = {}
-    calculated_count = 0
-
-    for batter in batters_list:
-        try:
-            pid = batter['playerID']
-            calculated = {}
-            batter['calculated'] = calculated
-            output_dict[pid] = batter
-            ab = float_value(batter, 'AB', 0.0)
-            if ab > 0.0:
-                # playerID,G,AB,R,H,2B,3B,HR,RBI,SB,CS,BB,SO,IBB,HBP,SF
-                calculated['runs_per_ab'] = float_value(batter, 'R', 0.0) / ab
-                calculated['batting_avg'] = float_value(batter, 'H', 0.0) / ab
-                calculated['2b_avg']  = float_value(batter, '2B', 0.0) / ab
-                calculated['3b_avg']  = float_value(batter, '3B', 0.0) / ab
-                calculated['hr_avg']  = float_value(batter, 'HR', 0.0) / ab
-                calculated['rbi_avg'] = float_value(batter, 'RBI', 0.0) / ab
-                calculated['bb_avg']  = float_value(batter, 'BB', 0.0) / ab
-                calculated['so_avg']  = float_value(batter, 'SO', 0.0) / ab
-                calculated['ibb_avg'] = float_value(batter, 'IBB', 0.0) / ab
-                calculated['hbp_avg'] = float_value(batter, 'HBP', 0.0) / ab
-                sb = float_value(batter, 'SB', 0.0)
-                cs = float_value(batter, 'CS', 0.0)
-                calculated['sb_pct'] = -1.0
-                if sb > 50:
-                    sb_attempts = sb + cs
-                    calculated['sb_pct'] = sb / sb_attempts
-                calculated_count += 1
-        except Exception as e:
-            print(f"Exception on batter: {batter}")
-            print(traceback.format_exc())
-        if verbose():
+    if totals is None:
+        totals = read_batters_totals_df()
+    output_dict, calculated_count = calc_batters_stats_vectorized(totals)
+    if verbose():
+        for batter in output_dict.values():
             print(json.dumps(batter, sort_keys=False, indent=2))
-
-    print(f'batters count:    {len(batters_list)}')
+    print(f'batters count:    {len(totals)}')
     print(f'calculated count: {calculated_count}')
     FS.write_json(output_dict, outfile)
+    return output_dict
 
-def calc_pitchers_stats():
+def calc_batters_stats_vectorized(totals):
+    """
+    Return a tuple of the (output_dict, calculated_count) for the given
+    batter career totals frame.
+    """
+    calculated = batters_calculated_df(totals)
+    return stats_output_dict(totals, calculated), len(calculated)
+
+def stats_output_dict(totals, calculated, index_key='playerID'):
+    """
+    Return the dict of playerID -> totals dict, each with a 'calculated'
+    sub-dict, for the given totals and calculated frames.  The per-player
+    dicts are materialized only at this output boundary.
+    """
+    calculated_rows = frame_to_dicts(calculated)
+    output_dict = {}
+    for pid, stats in frame_to_dicts(totals, index_key).items():
+        stats['calculated'] = {}
+        if pid in calculated_rows:
+            stats['calculated'] = calculated_rows[pid]
+        output_dict[pid] = stats
+    return output_dict
+
+def read_batters_totals_df():
+    """ read the grouped career totals written by prune_batters, as int columns """
+    df = pd.read_csv('tmp/batters.csv', index_col='playerID', float_precision='round_trip')
+    return batters_totals_df(df)
+
+def batters_totals_df(grouped):
+    """ cast the grouped batting sums to int columns """
+    return grouped[BATTING_COLS].fillna(0).round().astype('int64')
+
+def read_pitchers_totals_df():
+    """ read the grouped career totals written by prune_pitchers """
+    df = pd.read_csv('tmp/pitchers.csv', index_col='playerID', float_precision='round_trip')
+    return pitchers_totals_df(df)
+
+def pitchers_totals_df(grouped):
+    """ cast the grouped pitching sums to int columns, and BAOpp/ERA to floats """
+    totals = grouped[PITCHING_COLS].copy()
+    for col in PITCHING_COLS:
+        if col in PITCHING_FLOAT_COLS:
+            totals[col] = totals[col].fillna(0.0).astype('float64')
+        else:
+            totals[col] = totals[col].fillna(0).round().astype('int64')
+    return totals
+
+def batters_calculated_df(totals):
+    """
+    Return a DataFrame of the calculated batting ratios for the given career
+    totals frame, indexed by playerID.  Only players with at-bats are included.
+    The ratios are computed column-at-a-time with masked division.
+    """
+    ab = totals['AB'].to_numpy(dtype='float64')
+    has_ab = ab > 0.0
+    ab = ab[has_ab]
+    data = {}
+    for calc_col, col in BATTING_RATIOS:
+        data[calc_col] = totals[col].to_numpy(dtype='float64')[has_ab] / ab
+    sb = totals['SB'].to_numpy(dtype='float64')[has_ab]
+    cs = totals['CS'].to_numpy(dtype='float64')[has_ab]
+    data['sb_pct'] = masked_divide(sb, sb + cs, sb > 50, -1.0)
+    return pd.DataFrame(data, index=totals.index[has_ab])
+
+def calc_pitchers_stats(totals=None):
     print('=== calc_pitchers_stats')
-    infile  = 'tmp/pitchers.json'
     outfile = 'tmp/pitchers_calc.json'
-    pitchers_list = FS.read_json(infile)
+    t1 = time.perf_counter()
+    if totals is None:
+        totals = read_pitchers_totals_df()
+    output_dict, calculated_count = calc_pitchers_stats_vectorized(totals)
+    elapsed = time.perf_counter() - t1
+    print(f'pitcher count:    {len(totals)}')
+    print(f'calculated count: {calculated_count}')
+    print(f'elapsed seconds:  {elapsed:.4f}')
+    FS.write_json(output_dict, outfile)
+    return output_dict
+
+def calc_pitchers_stats_vectorized(totals):
+    """
+    Return a tuple of the (output_dict, calculated_count) for the given pitcher
+    career totals frame.  The dict values are identical to those produced by
+    calc_pitchers_stats_rowwise.
+    """
+    calculated = pitchers_calculated_df(totals)
+    return stats_output_dict(totals, calculated), len(calculated)
+
+def pitchers_calculated_df(totals):
+    """
+    Return a DataFrame of the calculated pitching metrics for the given career
+    totals frame, indexed by playerID.  Only players with IPouts are included;
+    the zero W+L and zero GS cases are handled as masks.
+    """
+    has_ipo = totals['IPouts'].to_numpy(dtype='float64') > 0.0
+    cols = {}
+    for col in 'W,L,ER,GS,CG,SHO,H,BB,SO,IPouts,HR,HBP'.split(','):
+        cols[col] = totals[col].to_numpy(dtype='float64')[has_ipo]
+    w, l, gs, ipo = cols['W'], cols['L'], cols['GS'], cols['IPouts']
+    fge = ipo / 27.0
+    official_at_bats = ipo + cols['H']
+    all_at_bats = official_at_bats + cols['BB'] + cols['HBP']
+    decisions = w + l
+
+    data = {}
+    data['full_games_pitched_equiv'] = fge
+    data['era'] = cols['ER'] / fge
+    data['opp_batting_avg'] = cols['H'] / official_at_bats
+    data['bb_pct']  = cols['BB']  / all_at_bats
+    data['so_pct']  = cols['SO']  / all_at_bats
+    data['hbp_pct'] = cols['HBP'] / all_at_bats
+    data['hr_pct']  = cols['HR']  / all_at_bats
+    data['win_pct'] = masked_divide(w, decisions, decisions > 0.0, 0.0)
+    data['sho_pct'] = masked_divide(cols['SHO'], decisions, decisions > 0.0, 0.0)
+    data['cg_pct']  = masked_divide(cols['CG'], gs, gs > 0.0, 0.0)
+    return pd.DataFrame(data, index=totals.index[has_ipo])
+
+def calc_pitchers_stats_rowwise(pitchers_list):
+    """
+    The original per-row implementation of calc_pitchers_stats, retained
+    as the reference for verify_pitchers_stats.
+    """
     calculated_count = 0
     output_dict = {}
 
@@ -309,9 +493,75 @@ def calc_pitchers_stats():
             print(f"Exception on pitcher: {pitcher}")
             print(traceback.format_exc())
 
-    print(f'pitcher count:    {len(pitchers_list)}')
-    print(f'calculated count: {calculated_count}')
-    FS.write_json(output_dict, outfile)
+    return output_dict, calculated_count
+
+def verify_pitchers_stats():
+    """
+    Diff the calculated sub-dicts of the rowwise and vectorized pitcher
+    implementations, and report the timing of each.  Exits non-zero on any
+    mismatch.
+    """
+    print('=== verify_pitchers_stats')
+    pitchers_list = FS.read_json('tmp/pitchers.json')
+    totals = read_pitchers_totals_df()
+    t1 = time.perf_counter()
+    rowwise_dict, rowwise_count = calc_pitchers_stats_rowwise(pitchers_list)
+    t2 = time.perf_counter()
+    pitchers_calculated_df(totals)
+    t3 = time.perf_counter()
+    vectorized_dict, vectorized_count = calc_pitchers_stats_vectorized(totals)
+    t4 = time.perf_counter()
+
+    mismatches = []
+    for pid in sorted(set(rowwise_dict.keys()) | set(vectorized_dict.keys())):
+        if pid not in rowwise_dict or pid not in vectorized_dict:
+            mismatches.append(pid)
+        elif json.dumps(rowwise_dict[pid]) != json.dumps(vectorized_dict[pid]):
+            mismatches.append(pid)
+    for pid in mismatches[:10]:
+        print(f'mismatch: {pid}')
+        print(f'  rowwise:    {rowwise_dict.get(pid)}')
+        print(f'  vectorized: {vectorized_dict.get(pid)}')
+
+    rowwise_secs, compute_secs, vectorized_secs = t2 - t1, t3 - t2, t4 - t3
+    print(f'pitcher count:      {len(rowwise_dict)} rowwise, {len(vectorized_dict)} vectorized')
+    print(f'calculated count:   {rowwise_count} rowwise, {vectorized_count} vectorized')
+    print(f'rowwise seconds:    {rowwise_secs:.4f}')
+    print(f'vectorized seconds: {vectorized_secs:.4f} ({compute_secs:.4f} compute, {vectorized_secs - compute_secs:.4f} materialize)')
+    if compute_secs > 0:
+        print(f'compute speedup:    {rowwise_secs / compute_secs:.1f}x')
+    print(f'mismatch count:     {len(mismatches)}')
+    if len(mismatches) > 0:
+        sys.exit(1)
+
+def verify_embeddings_str():
+    """
+    Recompute the embeddings_str value of each built document with the
+    per-player calculate_embeddings_string_value, diff it against the batch
+    value, and report the per-player timing.  Exits non-zero on any mismatch.
+    """
+    print('=== verify_embeddings_str')
+    documents = FS.read_json('../data/wrangled/documents.json')
+    mismatches = []
+    t1 = time.perf_counter()
+    for pid, doc in documents.items():
+        if 'category' not in doc.keys():
+            if 'embeddings_str' in doc.keys():
+                mismatches.append(pid)
+            continue
+        player = dict(doc)
+        calculate_embeddings_string_value(player, ALGORITHM_BINNED_TEXT)
+        if player['embeddings_str'] != doc.get('embeddings_str'):
+            mismatches.append(pid)
+    elapsed = time.perf_counter() - t1
+    for pid in mismatches[:10]:
+        print(f'mismatch: {pid}')
+        print(f'  batch:      {documents[pid].get("embeddings_str")}')
+    print(f'documents count:    {len(documents)}')
+    print(f'per-player seconds: {elapsed:.4f}')
+    print(f'mismatch count:     {len(mismatches)}')
+    if len(mismatches) > 0:
+        sys.exit(1)
 
 def build_documents():
     print('=== build_documents')
@@ -320,74 +570,172 @@ def build_documents():
     pitchers_dict = FS.read_json('tmp/pitchers_calc.json')
     player_teams_dict = FS.read_json('tmp/player_teams_calc.json')
     player_positions_dict = FS.read_json('tmp/player_positions.json')
-    print(f'players count:      {len(players_list)}')
-    print(f'batters count:      {len(batters_dict.keys())}')
-    print(f'pitchers count:     {len(pitchers_dict.keys())}')
+    positions = pd.DataFrame(
+        {'primary_position': {pid: pp['primary_position'] for pid, pp in player_positions_dict.items()}})
+    batters, batters_calc = stats_frames(batters_dict)
+    pitchers, pitchers_calc = stats_frames(pitchers_dict)
+    documents = assemble_documents(
+        pd.DataFrame(players_list), player_teams_dict, positions,
+        batters, batters_calc, pitchers, pitchers_calc)
+    FS.write_json(documents, '../data/wrangled/documents.json')
+    return documents
+
+def stats_frames(stats_dict):
+    """
+    Return the (totals, calculated) frames, indexed by playerID, for the given
+    dict of playerID -> stats dict as written by calc_batters_stats or
+    calc_pitchers_stats.
+    """
+    totals, calculated = {}, {}
+    for pid, stats in stats_dict.items():
+        totals[pid] = {k: v for k, v in stats.items() if k not in ('playerID', 'calculated')}
+        if len(stats['calculated']) > 0:
+            calculated[pid] = stats['calculated']
+    return pd.DataFrame.from_dict(totals, orient='index'), pd.DataFrame.from_dict(calculated, orient='index')
+
+def join_player_frames(people, team_pids, positions, batters, pitchers):
+    """
+    Join the given frames on playerID in one columnar pass, for the people
+    with teams.  Return a frame in people order with the people columns plus
+    primary_position, has_batting, has_pitching, category, debut_year and
+    final_year.  A player that both pitched and batted is a pitcher if their
+    IPouts exceed their hits (see aardsda01); category is '' for players with
+    neither batting nor pitching totals.
+    """
+    df = people[people['playerID'].isin(list(team_pids))].reset_index(drop=True)
+    pids = df['playerID']
+    joined = df.copy()
+    joined['primary_position'] = positions['primary_position'].reindex(pids).fillna('?').to_numpy()
+    has_batting  = pids.isin(batters.index).to_numpy()
+    has_pitching = pids.isin(pitchers.index).to_numpy()
+    batting_hits = batters['H'].reindex(pids).fillna(0).to_numpy(dtype='int64')
+    pitching_ipo = pitchers['IPouts'].reindex(pids).fillna(0).to_numpy(dtype='int64')
+    joined['has_batting']  = has_batting
+    joined['has_pitching'] = has_pitching
+    joined['category'] = np.select(
+        [has_pitching & has_batting & (pitching_ipo > batting_hits), has_batting, has_pitching],
+        ['pitcher', 'fielder', 'pitcher'], default='')
+    debut_year = pd.to_numeric(df['debut'].astype('str').str.slice(0, 4), errors='coerce')
+    final_year = pd.to_numeric(df['finalGame'].astype('str').str.slice(0, 4), errors='coerce')
+    joined['debut_year'] = debut_year.fillna(0).astype('int64').to_numpy()
+    joined['final_year'] = final_year.where(debut_year.notna()).fillna(0).astype('int64').to_numpy()
+    return joined
+
+def assemble_documents(people, player_teams_dict, positions, batters, batters_calc, pitchers, pitchers_calc):
+    """
+    Join the people, teams, positions, batting and pitching data on playerID
+    and return the dict of player documents, with calculated embeddings_str
+    values.  The join is columnar; the document dicts are only materialized
+    at this output boundary.
+    """
+    print(f'players count:      {len(people)}')
+    print(f'batters count:      {len(batters)}')
+    print(f'pitchers count:     {len(pitchers)}')
     print(f'player teams count: {len(player_teams_dict.keys())}')
+    joined = join_player_frames(people, player_teams_dict.keys(), positions, batters, pitchers)
+    batting_dicts  = stats_output_dict(batters, batters_calc, None)
+    pitching_dicts = stats_output_dict(pitchers, pitchers_calc, None)
+    players = people_records(joined[people.columns])
+    columns = zip(
+        joined['primary_position'].tolist(), joined['has_batting'].tolist(), joined['has_pitching'].tolist(),
+        joined['category'].tolist(), joined['debut_year'].tolist(), joined['final_year'].tolist())
     documents = {}
-    outfile = '../data/wrangled/documents.json'
-    pruned_player_attrs  = 'x'.split(',')
-    pruned_pitcher_attrs = 'playerID,dog'.split(',')
-    pruned_batter_attrs  = 'playerID,cat'.split(',')
-
-    for player in players_list:
+    for player, (pp, has_batting, has_pitching, category, debut_year, final_year) in zip(players, columns):
         pid = player['playerID']
-        if pid in player_teams_dict.keys():
-            documents[pid] = player
-            player['teams'] = player_teams_dict[pid]
-            pitching_ipo, batting_hits = 0, 0
-
-            if pid in pitchers_dict.keys():
-                player['pitching'] = pitchers_dict[pid]
-                pitching_ipo = int(float(player['pitching']['IPouts']))
-                player['category'] = 'pitcher'
-                for attr in pruned_pitcher_attrs:
-                     if attr in player['pitching'].keys():
-                        del player['pitching'][attr]
-
-            if pid in player_positions_dict.keys():
-                pp = player_positions_dict[pid]
-                player['primary_position'] = pp['primary_position']
-            else:
-                player['primary_position'] = '?'
-
-            if pid in batters_dict.keys():
-                player['batting'] = batters_dict[pid]
-                batting_hits = int(float(player['batting']['H']))
-                player['category'] = 'fielder'
-                for attr in pruned_batter_attrs:
-                    if attr in player['batting'].keys():
-                        del player['batting'][attr]
-
-            if 'pitching' in player.keys():
-                if 'batting' in player.keys():
-                    # compare the primary metric for each category if the player
-                    # is BOTH a pitcher and a batter/fielder.  see aardsda01.
-                    if pitching_ipo > batting_hits:  
-                        player['category'] = 'pitcher'
-                    else:
-                        player['category'] = 'fielder'
-            for attr in pruned_player_attrs:
-                if attr in player.keys():
-                    del player[attr]
-
-            refine_values(player)
-            calculate_embeddings_string_value(player, ALGORITHM_BINNED_TEXT)
-
+        documents[pid] = player
+        player['teams'] = player_teams_dict[pid]
+        if has_pitching:
+            player['pitching'] = pitching_dicts[pid]
+            player['category'] = category
+        player['primary_position'] = pp
+        if has_batting:
+            player['batting'] = batting_dicts[pid]
+            player['category'] = category
+        player['debut_year'] = debut_year
+        player['final_year'] = final_year
+
+    t1 = time.perf_counter()
+    total_games = [player_teams_dict[pid]['total_games'] for pid in documents.keys()]
+    embeddings_strings = binned_text_embeddings_strings(
+        joined, total_games, batters, batters_calc, pitchers, pitchers_calc)
+    for player, embeddings_str in zip(documents.values(), embeddings_strings):
+        if embeddings_str is not None:
+            player['embeddings_str'] = embeddings_str
+    print(f'embeddings_str seconds: {time.perf_counter() - t1:.4f}')
     print(f'documents count: {len(documents.keys())}')
-    FS.write_json(documents, outfile)
+    return documents
 
-def refine_values(player):
-    try:
-        player['debut_year'] = 0
-        player['final_year'] = 0
-        player['birthYear']  = int(float(player['birthYear']))
-        player['weight']     = int(float(player['weight']))
-        player['height']     = int(float(player['height']))
-        player['debut_year'] = int(player['debut'][0:4])
-        player['final_year'] = int(player['finalGame'][0:4])
-    except:
-        pass
+def run_all():
+    """
+    Run the full prune/calc/build_documents rebuild in this one process
+    invocation.  Each source CSV is read once, the independent branches run
+    concurrently in a process pool, and the frames are handed between stages
+    in memory rather than through the tmp/ files.  Each DataFrame stage result
+    is cached in tmp/cache/ as Parquet, and a stage is skipped when the
+    fingerprint of its inputs, code, and params is unchanged.
+    """
+    print('=== run_all')
+    pipeline = Pipeline(cache_dir='tmp/cache')
+    engine = csv_engine()  # the parsed dtypes may differ per csv engine
+    pipeline.add_stage('people', stage_people, inputs=[PEOPLE_CSV],
+        code=[people_df, read_databank_csv, pruned_people_df, include_only_cols],
+        params={'cols': PEOPLE_COLS, 'dtypes': PEOPLE_DTYPES, 'engine': engine})
+    pipeline.add_stage('appearances', stage_appearances, inputs=[APPEARANCES_CSV],
+        code=[appearances_df, read_databank_csv],
+        params={'dtypes': APPEARANCES_DTYPES, 'mask_dtypes': APPEARANCES_MASK_DTYPES, 'engine': engine})
+    pipeline.add_stage('player_positions', stage_player_positions, ['appearances'],
+        code=[include_only_cols, primary_positions], params={'cols': PLAYER_POSITIONS_COLS})
+    pipeline.add_stage('player_teams', stage_player_teams, ['appearances'],
+        code=[include_only_cols, player_team_games_df], params={'cols': PLAYER_TEAMS_COLS})
+    pipeline.add_stage('batters', stage_batters, inputs=[BATTING_CSV],
+        code=[batters_df, read_databank_csv, include_only_cols, batters_totals_df],
+        params={'cols': BATTING_COLS, 'dtypes': BATTING_DTYPES, 'engine': engine})
+    pipeline.add_stage('batters_calc', stage_batters_calc, ['batters'],
+        code=[batters_calculated_df, masked_divide], params={'ratios': BATTING_RATIOS})
+    pipeline.add_stage('pitchers', stage_pitchers, inputs=[PITCHING_CSV],
+        code=[pitchers_df, read_databank_csv, include_only_cols, pitchers_totals_df],
+        params={'cols': PITCHING_COLS, 'dtypes': PITCHING_DTYPES, 'engine': engine})
+    pipeline.add_stage('pitchers_calc', stage_pitchers_calc, ['pitchers'],
+        code=[pitchers_calculated_df, masked_divide])
+    pipeline.add_stage('documents', stage_documents,
+        ['people', 'batters', 'batters_calc', 'pitchers', 'pitchers_calc', 'player_teams', 'player_positions'],
+        cache=False)
+    pipeline.run()
+    print('run_all stage report:')
+    pipeline.report()
+
+def stage_people():
+    return pruned_people_df(people_df())
+
+def stage_appearances():
+    return appearances_df()
+
+def stage_player_positions(appearances):
+    grouped = include_only_cols(appearances, PLAYER_POSITIONS_COLS).groupby(['playerID']).sum()
+    return primary_positions(grouped).to_frame('primary_position')
+
+def stage_player_teams(appearances):
+    return player_team_games_df(include_only_cols(appearances, PLAYER_TEAMS_COLS))
+
+def stage_batters():
+    df2 = include_only_cols(batters_df(), ['playerID'] + BATTING_COLS)
+    return batters_totals_df(df2.groupby(['playerID']).sum())
+
+def stage_batters_calc(totals):
+    return batters_calculated_df(totals)
+
+def stage_pitchers():
+    df2 = include_only_cols(pitchers_df(), ['playerID'] + PITCHING_COLS)
+    return pitchers_totals_df(df2.groupby(['playerID']).sum())
+
+def stage_pitchers_calc(totals):
+    return pitchers_calculated_df(totals)
+
+def stage_documents(people, batters, batters_calc, pitchers, pitchers_calc, team_games, positions):
+    documents = assemble_documents(
+        people, player_teams_dict(team_games), positions, batters, batters_calc, pitchers, pitchers_calc)
+    FS.write_json(documents, '../data/wrangled/documents.json')
+    return len(documents)
 
 def calculate_embeddings_string_value(player, algorithm):
     if algorithm == ALGORITHM_BINNED_TEXT:
@@ -412,28 +760,14 @@ def calculate_embeddings_string_value_with_binned_text(player):
             calculated = player['pitching']['calculated']
             values.append(labeled_floating_text_value('full_games_pitched_equiv', calculated['full_games_pitched_equiv'], 1)) 
             values.append(labeled_floating_text_value('era', calculated['era'], 1000)) 
-            values.append(labeled_binned_pct_text_value(calculated, 'opp_batting_avg', 1000))
-            values.append(labeled_binned_pct_text_value(calculated, 'so_pct', 1000)) 
-            values.append(labeled_binned_pct_text_value(calculated, 'bb_pct', 1000)) 
-            values.append(labeled_binned_pct_text_value(calculated, 'hbp_pct', 1000)) 
-            values.append(labeled_binned_pct_text_value(calculated, 'hr_pct', 1000))
-            values.append(labeled_binned_pct_text_value(calculated, 'win_pct', 100)) 
-            values.append(labeled_binned_pct_text_value(calculated, 'sho_pct', 100)) 
-            values.append(labeled_binned_pct_text_value(calculated, 'cg_pct', 100)) 
+            for stat, bin_factor in EMBEDDINGS_PITCHING_BINS:
+                values.append(labeled_binned_pct_text_value(calculated, stat, bin_factor))
         else:
             values.append(labeled_text_value('hits', player['batting']['H']))
             values.append(labeled_text_value('hr', player['batting']['HR']))
             calculated = player['batting']['calculated']
-            values.append(labeled_binned_pct_text_value(calculated, 'batting_avg', 1000))
-            values.append(labeled_binned_pct_text_value(calculated, 'runs_per_ab', 1000)) 
-            values.append(labeled_binned_pct_text_value(calculated, '2b_avg', 1000))
-            values.append(labeled_binned_pct_text_value(calculated, '3b_avg', 1000)) 
-            values.append(labeled_binned_pct_text_value(calculated, 'hr_avg', 1000)) 
-            values.append(labeled_binned_pct_text_value(calculated, 'rbi_avg', 1000)) 
-            values.append(labeled_binned_pct_text_value(calculated, 'bb_avg', 1000))
-            values.append(labeled_binned_pct_text_value(calculated, 'so_avg', 1000)) 
-            values.append(labeled_binned_pct_text_value(calculated, 'ibb_avg', 1000)) 
-            values.append(labeled_binned_pct_text_value(calculated, 'hbp_avg', 1000))
+            for stat, bin_factor in EMBEDDINGS_BATTING_BINS:
+                values.append(labeled_binned_pct_text_value(calculated, stat, bin_factor))
             values.append(labeled_text_value('sb', player['batting']['SB']))
             sb_value = 'sb_pct_na'
             if 'sb_pct' in calculated.keys():
@@ -475,23 +809,108 @@ def labeled_binned_pct_text_value(values_dict, stat, bin_factor):
     for a values dict with stat/key "so_pct" with value 0.22576361221779548 and bin factor 100
     return the string 'so_pct_23' by binning the rounded percent value.
     bin_factor value is expected to be 10, 100, 1000, etc.
+    The tier is the rounded value clamped to 0..bin_factor-2, or '?' if negative.
     """
     s = str(stat).strip()
-    bin_range = range(bin_factor - 1)
     try:
         if stat not in values_dict.keys():
             return ''
         int_value = int(round(float(values_dict[stat]) * float(bin_factor)))
         tier_name = '?'
-        for tier in bin_range:
-            if int_value >= tier:
-                tier_name = str(tier)
+        if int_value >= 0 and bin_factor > 1:
+            tier_name = str(min(int_value, bin_factor - 2))
         return f'{s}_{tier_name}'.strip().lower()
     except Exception as e:
         print(f"Exception in labeled_binned_pct_text_value: {values_dict} {stat}")
         print(traceback.format_exc())
         return f'{s}_??'.lower()
 
+def binned_text_embeddings_strings(joined, total_games, batters, batters_calc, pitchers, pitchers_calc):
+    """
+    Return the list of ALGORITHM_BINNED_TEXT embeddings_str values for all
+    rows of the given join_player_frames frame at once, byte-identical to
+    calculate_embeddings_string_value_with_binned_text.  The binned and
+    labeled tokens are computed column-at-a-time; the value is None for rows
+    without a category, and '' for pitchers without calculated stats.
+    """
+    category = joined['category'].to_numpy()
+    results = np.full(len(joined), None, dtype=object)
+    is_pitcher = category == 'pitcher'
+    is_fielder = (category != '') & ~is_pitcher
+    common = [
+        category.astype(object),
+        labeled_text_values('primary_position', joined['primary_position']),
+        labeled_text_values('total_games', pd.Series(total_games)),
+        labeled_text_values('bats', pd.Series(csv_values(joined['bats']))),
+        labeled_text_values('throws', pd.Series(csv_values(joined['throws'])))]
+
+    rows = np.flatnonzero(is_pitcher)
+    pids = joined['playerID'].to_numpy()[rows]
+    totals = pitchers.reindex(pids)
+    calculated = pitchers_calc.reindex(pids)
+    has_calculated = np.isin(pids, pitchers_calc.index)
+    tokens = [col[rows] for col in common]
+    tokens.append(labeled_text_values('wins', totals['W']))
+    tokens.append(labeled_text_values('losses', totals['L']))
+    tokens.append(labeled_floating_text_values('full_games_pitched_equiv', calculated['full_games_pitched_equiv'], 1))
+    tokens.append(labeled_floating_text_values('era', calculated['era'], 1000))
+    for stat, bin_factor in EMBEDDINGS_PITCHING_BINS:
+        tokens.append(labeled_binned_pct_text_values(stat, calculated[stat], has_calculated, bin_factor))
+    strings = [' '.join(values) for values in zip(*tokens)]
+    results[rows] = np.where(has_calculated, np.array(strings, dtype=object), '')
+
+    rows = np.flatnonzero(is_fielder)
+    pids = joined['playerID'].to_numpy()[rows]
+    totals = batters.reindex(pids)
+    calculated = batters_calc.reindex(pids)
+    has_calculated = np.isin(pids, batters_calc.index)
+    tokens = [col[rows] for col in common]
+    tokens.append(labeled_text_values('hits', totals['H']))
+    tokens.append(labeled_text_values('hr', totals['HR']))
+    for stat, bin_factor in EMBEDDINGS_BATTING_BINS:
+        tokens.append(labeled_binned_pct_text_values(stat, calculated[stat], has_calculated, bin_factor))
+    tokens.append(labeled_text_values('sb', totals['SB']))
+    sb_pct = calculated['sb_pct'].to_numpy(dtype='float64')
+    sb_tokens = labeled_binned_pct_text_values('sb_pct', sb_pct, has_calculated, 100)
+    tokens.append(np.where(has_calculated & (sb_pct >= 0), sb_tokens, 'sb_pct_na'))
+    results[rows] = [' '.join(values) for values in zip(*tokens)]
+    return results.tolist()
+
+def labeled_text_values(stat, series):
+    """ Return the array of labeled_text_value tokens for the given Series of values. """
+    tokens = (str(stat).strip() + '_' + series.astype('str').str.strip()).str.lower()
+    return tokens.to_numpy(dtype=object)
+
+def labeled_floating_text_values(stat, series, multiplier):
+    """
+    Return the array of labeled_floating_text_value tokens for the given
+    Series of values; '' for non-finite values.
+    """
+    s = str(stat).strip().lower()
+    scaled = series.to_numpy(dtype='float64') * float(multiplier)
+    finite = np.isfinite(scaled)
+    rounded = np.rint(np.where(finite, scaled, 0.0)).tolist()
+    return np.array(
+        [f'{s}_{int(value)}' if ok else '' for value, ok in zip(rounded, finite.tolist())], dtype=object)
+
+def labeled_binned_pct_text_values(stat, values, present, bin_factor):
+    """
+    Return the array of labeled_binned_pct_text_value tokens for the given
+    values, selected from a precomputed array of the tier labels.  Rows that
+    are not present get '', and non-finite values get the '??' tier.
+    """
+    s = str(stat).strip().lower()
+    tier_count = max(bin_factor - 1, 0)
+    labels = [f'{s}_{tier}' for tier in range(tier_count)] + [f'{s}_?', f'{s}_??', '']
+    labels = np.array(labels, dtype=object)
+    scaled = np.asarray(values, dtype='float64') * float(bin_factor)
+    finite = np.isfinite(scaled)
+    rounded = np.rint(np.where(finite, scaled, 0.0))
+    index = np.where((rounded < 0) | (tier_count == 0), tier_count, np.minimum(rounded, tier_count - 1))
+    index = np.where(finite, index, tier_count + 1)
+    index = np.where(present, index, tier_count + 2)
+    return labels[index.astype('int64')]
+
 def calculate_embeddings_string_value_with_raw_numbers(player):
     try:
         values = []
@@ -542,7 +961,107 @@ def calculate_embeddings_string_value_with_raw_numbers(player):
         print(traceback.format_exc())
         return None
 
+def build_feature_vectors():
+    """
+    Calculate the ALGORITHM_FEATURE_VECTOR vectors of the built documents, and
+    save them as a float32 matrix with a json file of the row playerIDs and
+    the feature names.
+    """
+    print('=== build_feature_vectors')
+    documents = FS.read_json('../data/wrangled/documents.json')
+    t1 = time.perf_counter()
+    pids, names, matrix = calculate_feature_vectors(documents)
+    elapsed = time.perf_counter() - t1
+    np.save(FEATURE_VECTORS_NPY, matrix)
+    print(f'file written: {FEATURE_VECTORS_NPY}')
+    info = dict(algorithm=ALGORITHM_FEATURE_VECTOR, dtype=str(matrix.dtype), shape=list(matrix.shape), names=names, ids=pids)
+    FS.write_json(info, FEATURE_VECTORS_JSON)
+    print(f'feature vectors shape: {matrix.shape}, {matrix.nbytes} bytes')
+    print(f'elapsed seconds:       {elapsed:.4f}')
+
+def calculate_feature_vectors(documents):
+    """
+    Return (playerIDs, feature names, float32 matrix) for the documents with a
+    category, in playerID order.  Each row is the pitcher category flag, the
+    one-hot bats, throws and primary_position values, the z-scored log of the
+    total games, and the z-scored calculated stats of the player category.
+    The stats of the other category, and missing stats, are zero (the mean).
+    """
+    pids = sorted(pid for pid, doc in documents.items() if 'category' in doc.keys())
+    docs = [documents[pid] for pid in pids]
+    is_pitcher = np.array([doc['category'] == 'pitcher' for doc in docs], dtype=bool)
+    names, columns = ['is_pitcher'], [is_pitcher.astype('float64')]
+    for key, values in (('bats', FEATURE_BATS), ('throws', FEATURE_THROWS), ('primary_position', FEATURE_POSITIONS)):
+        keys = np.array([doc[key] for doc in docs], dtype=object)
+        for value in values:
+            names.append(f'{key}_{value}'.lower())
+            columns.append((keys == value).astype('float64'))
+
+    games = np.log1p(np.array([doc['teams']['total_games'] for doc in docs], dtype='float64'))
+    names.append('total_games')
+    columns.append(feature_zscores(games, np.ones(len(docs), dtype=bool)))
+    for category, stats, mask in (('pitching', FEATURE_PITCHING_STATS, is_pitcher), ('batting', FEATURE_BATTING_STATS, ~is_pitcher)):
+        calculated = [doc[category]['calculated'] if category in doc.keys() else {} for doc in docs]
+        for stat in stats:
+            values = np.array([c.get(stat, np.nan) for c in calculated], dtype='float64')
+            if stat == 'sb_pct':
+                values[values < 0] = np.nan
+            names.append(f'{category}_{stat}')
+            columns.append(feature_zscores(values, mask))
+    matrix = np.column_stack(columns).astype('float32') if len(docs) > 0 else np.zeros((0, len(names)), dtype='float32')
+    return pids, names, matrix
+
+def feature_zscores(values, mask):
+    """
+    Return the z-scores of the finite values where mask is True, clipped to
+    +/- FEATURE_ZSCORE_CLIP, and 0.0 elsewhere.
+    """
+    result = np.zeros(len(values), dtype='float64')
+    valid = mask & np.isfinite(values)
+    if valid.sum() > 1:
+        std = values[valid].std()
+        if std > 0:
+            zscores = (values[valid] - values[valid].mean()) / std
+            result[valid] = np.clip(zscores, -FEATURE_ZSCORE_CLIP, FEATURE_ZSCORE_CLIP)
+    return result
+
+def search_feature_vectors(pid, count=10):
+    """
+    Print the players most similar to the given playerID, by the cosine
+    similarity of the saved feature vectors.
+    """
+    print(f'=== search_feature_vectors: {pid}')
+    info = FS.read_json(FEATURE_VECTORS_JSON)
+    matrix = np.load(FEATURE_VECTORS_NPY, mmap_mode='r')
+    ids = info['ids']
+    if pid not in ids:
+        print(f'playerID not found: {pid}')
+        return
+    row = ids.index(pid)
+    t1 = time.perf_counter()
+    norms = np.linalg.norm(matrix, axis=1)
+    norms[norms == 0] = 1.0
+    scores = (matrix @ matrix[row]) / (norms * norms[row])
+    top = np.argsort(-scores, kind='stable')[:count + 1]
+    elapsed = time.perf_counter() - t1
+    for row in top:
+        print(f'  {ids[row]:12} {scores[row]:.6f}')
+    print(f'elapsed seconds: {elapsed:.6f}')
+
 def add_embeddings(min_debut_year):
+    """
+    Add the embeddings of the documents with the given minimum debut year.
+    The batched embeddings requests are sent concurrently by an
+    EmbeddingsExecutor, within the deployment's RPM and TPM quotas.
+    Documents with identical embeddings_str values share one API input.
+    Each generated embedding is appended to the EMBEDDINGS_LOG_FILE, keyed by
+    playerID and embeddings_str hash, and the log is flushed to disk every
+    EMBEDDINGS_CHECKPOINT_EVERY embeddings.  On restart the logged embeddings
+    of unchanged embeddings_str values are reused, if they were generated by
+    the same embeddings model, so an interrupted run resumes where it left
+    off.  The embeddings are L2-normalized before the documents are written;
+    see normalize_document_embeddings.
+    """
     print(f'=== add_embeddings')
     infile  = '../data/wrangled/documents.json'
     outfile = '../data/wrangled/documents_with_embeddings.json'
@@ -550,34 +1069,323 @@ def add_embeddings(min_debut_year):
     print(json.dumps(oaic.get_config(), sort_keys=False, indent=2))
 
     documents = FS.read_json(infile)
-    for idx, pid in enumerate(sorted(documents.keys())):
-        if idx < 100_000:
-            print(f'adding embedding for: {pid}')
-            doc = documents[pid]
-            try:
-                doc['embeddings'] = []
-                doc = documents[pid]
-                if doc['debut_year'] >= min_debut_year:
-                    estr = doc['embeddings_str']
-                    if len(estr) > 0:
-                        embed = oaic.get_embedding(estr)
-                        if embed is not None:
-                            doc['embeddings'] = embed
-            except Exception as e:
-                print(f"Exception on doc: {doc}")
-                print(traceback.format_exc())
+    log = EmbeddingsLog(EMBEDDINGS_LOG_FILE, oaic.embedding_model, EMBEDDINGS_CHECKPOINT_EVERY)
+    logged = log.read()
+    todo, resumed_count = list(), 0
+    for pid in sorted(documents.keys()):
+        doc = documents[pid]
+        doc['embeddings'] = []
+        estr = doc.get('embeddings_str', '')
+        if doc['debut_year'] >= min_debut_year and len(estr) > 0:
+            h = text_hash(estr)
+            if pid in logged and logged[pid][0] == h:
+                doc['embeddings'] = logged[pid][1]
+                resumed_count = resumed_count + 1
+            else:
+                todo.append((pid, h))
+    print(f'embeddings resumed from {EMBEDDINGS_LOG_FILE}: {resumed_count}, to generate: {len(todo)}')
+
+    # Each unique embeddings_str is embedded once, and fanned out to its documents.
+    groups = embeddings_str_groups(documents, todo)
+    unique_texts = list(groups.keys())
+    print(f'unique embeddings_str values: {len(unique_texts)}, api inputs saved by dedup: {len(todo) - len(unique_texts)}')
+    progress = EmbeddingsProgress(len(todo))
+    executor = create_embeddings_executor(oaic)
+
+    def add_batch_embeddings(indexes, embeddings):
+        for idx, embed in zip(indexes, embeddings):
+            for pid, h in groups[unique_texts[idx]]:
+                progress.increment(embed is not None)
+                if embed is not None:
+                    documents[pid]['embeddings'] = embed
+                    if log.append(pid, h, embed):
+                        print(f'checkpoint: {progress.status()}')
+
+    log.open()
+    try:
+        executor.run(unique_texts, add_batch_embeddings)
+    finally:
+        log.close()
+    print(f'completed: {progress.status()}, {progress.elapsed():.1f} seconds')
+    normalize_document_embeddings(documents)
+    write_duplicate_embeddings(documents)
+    print(f'requests:  {json.dumps(executor.summary())}')
+    print(f'cache:     {json.dumps(oaic.get_cache_stats())}')
 
     FS.write_json(documents, outfile)
+    EmbeddingsSidecar(EMBEDDINGS_SIDECAR_BASENAME).write(documents, EXPECTED_EMBEDDINGS_ARRAY_LENGTH)
+
+def embeddings_str_groups(documents, todo):
+    """
+    Return a dict of embeddings_str -> list of the (playerID, hash) tuples
+    of the given todo list with that exact embeddings_str, in todo order.
+    """
+    groups = dict()
+    for pid, h in todo:
+        estr = documents[pid]['embeddings_str']
+        if estr not in groups:
+            groups[estr] = list()
+        groups[estr].append((pid, h))
+    return groups
+
+def normalize_document_embeddings(documents):
+    """
+    Scale the embeddings of the given documents to unit L2 norm, once, and
+    record the original norm in embeddings_norm and embeddings_normalized.
+    With unit vectors the inner product is the cosine similarity, so the IP
+    vCore index, the pgvector <#> order of vector_query_sql, the dotProduct
+    Cognitive Search profile, and the local 'ip' searches skip the norms.
+    The vectors are stored as float32, the precision of every engine.
+    Documents already marked as normalized are skipped; return the count of
+    documents normalized.
+    """
+    count, norms = 0, list()
+    for pid in sorted(documents.keys()):
+        doc = documents[pid]
+        embeddings = doc.get('embeddings', [])
+        if len(embeddings) == 0 or doc.get('embeddings_normalized', False):
+            continue
+        vector = np.asarray(embeddings, dtype=np.float64)
+        norm = float(np.linalg.norm(vector))
+        doc['embeddings_norm'] = norm
+        doc['embeddings_normalized'] = norm > 0
+        if norm > 0:
+            doc['embeddings'] = (vector / norm).astype(np.float32).tolist()
+        count, norms = count + 1, norms + [norm]
+    if count > 0:
+        print(f'embeddings normalized: {count}, original norm min: {min(norms):.6f}, max: {max(norms):.6f}')
+    return count
+
+def normalize_embeddings():
+    """
+    L2-normalize the embeddings of an existing documents_with_embeddings.json
+    file, and rewrite it and its EmbeddingsSidecar.
+    """
+    print(f'=== normalize_embeddings')
+    documents = FS.read_json(f'{EMBEDDINGS_SIDECAR_BASENAME}.json')
+    if normalize_document_embeddings(documents) > 0:
+        FS.write_json(documents, f'{EMBEDDINGS_SIDECAR_BASENAME}.json')
+        EmbeddingsSidecar(EMBEDDINGS_SIDECAR_BASENAME).write(documents, EXPECTED_EMBEDDINGS_ARRAY_LENGTH)
+    else:
+        print('the embeddings are already normalized')
+
+def write_duplicate_embeddings(documents):
+    """
+    Write the groups of vectorized documents with identical embeddings_str
+    values, and hence identical embeddings, to DUPLICATE_EMBEDDINGS_FILE so
+    that the search layers can collapse the tied results.
+    """
+    groups = dict()
+    for pid in sorted(documents.keys()):
+        doc = documents[pid]
+        if len(doc.get('embeddings', [])) > 0:
+            estr = doc['embeddings_str']
+            if estr not in groups:
+                groups[estr] = list()
+            groups[estr].append(pid)
+    duplicates = list()
+    for estr, pids in groups.items():
+        if len(pids) > 1:
+            duplicates.append(dict(hash=text_hash(estr), count=len(pids), playerIDs=pids, embeddings_str=estr))
+    duplicates = sorted(duplicates, key=lambda group: (-group['count'], group['playerIDs'][0]))
+    FS.write_json(duplicates, DUPLICATE_EMBEDDINGS_FILE)
+    duplicate_docs = sum(group['count'] for group in duplicates)
+    print(f'duplicate embeddings groups: {len(duplicates)}, documents: {duplicate_docs}')
+
+def token_report(min_debut_year):
+    """
+    Report the token count distribution of the embeddings_str values to be
+    vectorized for the given minimum debut year, and the projected requests,
+    cost, and duration at the deployment's RPM and TPM quotas, before any
+    API calls.  The tokens are counted with the encoding of the add_embeddings
+    client; see create_token_counting_oai_client.
+    """
+    print(f'=== token_report')
+    documents = FS.read_json('../data/wrangled/documents.json')
+    texts = list()
+    for pid in sorted(documents.keys()):
+        doc = documents[pid]
+        estr = doc.get('embeddings_str', '')
+        if doc['debut_year'] >= min_debut_year and len(estr) > 0:
+            texts.append(estr)
+    unique_texts = list(dict.fromkeys(texts))
+    oaic = create_token_counting_oai_client()
+    t1 = time.perf_counter()
+    counts = np.array(oaic.get_token_counts(texts), dtype='int64')
+    elapsed = time.perf_counter() - t1
+    unique_tokens = int(np.sum(oaic.get_token_counts(unique_texts))) if len(unique_texts) > 0 else 0
+    request_count = len(oaic.embeddings_batches(unique_texts))
+    rpm = float(Env.var('AZURE_OPENAI_EMBEDDINGS_RPM', '720'))
+    tpm = float(Env.var('AZURE_OPENAI_EMBEDDINGS_TPM', '120000'))
+
+    report = dict(min_debut_year=min_debut_year, documents=len(texts), unique_texts=len(unique_texts))
+    report['tokens'] = int(counts.sum())
+    if len(counts) > 0:
+        report['tokens_mean'] = round(float(counts.mean()), 2)
+        for name, pct in [('min', 0), ('p50', 50), ('p90', 90), ('p99', 99), ('max', 100)]:
+            report[f'tokens_{name}'] = int(np.percentile(counts, pct, method='nearest'))
+    report['unique_tokens'] = unique_tokens
+    report['projected_requests'] = request_count
+    report['projected_usd'] = round(unique_tokens / 1000.0 * EMBEDDINGS_USD_PER_1K_TOKENS, 4)
+    # the duration is bound by the more limiting of the two quotas
+    report['projected_minutes_at_quota'] = round(max(unique_tokens / tpm, request_count / rpm), 2)
+    report['token_count_seconds'] = round(elapsed, 4)
+    print(json.dumps(report, sort_keys=False, indent=2))
+    FS.write_json(report, 'tmp/token_report.json')
+
+def create_embeddings_executor(oaic):
+    """
+    Return an EmbeddingsExecutor for the given client, per the requests and
+    tokens per minute quotas of the Azure OpenAI embeddings deployment in the
+    AZURE_OPENAI_EMBEDDINGS_RPM and AZURE_OPENAI_EMBEDDINGS_TPM environment
+    variables, and the AZURE_OPENAI_EMBEDDINGS_IN_FLIGHT concurrent requests.
+    The local-hash client is not rate limited.
+    """
+    rpm = float(Env.var('AZURE_OPENAI_EMBEDDINGS_RPM', '720'))
+    tpm = float(Env.var('AZURE_OPENAI_EMBEDDINGS_TPM', '120000'))
+    max_in_flight = int(Env.var('AZURE_OPENAI_EMBEDDINGS_IN_FLIGHT', '8'))
+    if oaic.type == 'local-hash':
+        rpm, tpm, max_in_flight = 1e12, 1e12, 1  # no quotas, and no I/O to overlap
+    print(f'create_embeddings_executor, rpm: {rpm}, tpm: {tpm}, max_in_flight: {max_in_flight}')
+    return EmbeddingsExecutor(oaic, rpm, tpm, max_in_flight)
+
+def write_embeddings_sidecar():
+    """
+    Write the binary EmbeddingsSidecar files of an existing
+    documents_with_embeddings.json file, and compare the load times.
+    """
+    print(f'=== write_embeddings_sidecar')
+    t1 = time.perf_counter()
+    documents = FS.read_json(f'{EMBEDDINGS_SIDECAR_BASENAME}.json')
+    t2 = time.perf_counter()
+    sidecar = EmbeddingsSidecar(EMBEDDINGS_SIDECAR_BASENAME)
+    row_count = sidecar.write(documents, EXPECTED_EMBEDDINGS_ARRAY_LENGTH)
+    t3 = time.perf_counter()
+    sidecar = EmbeddingsSidecar(EMBEDDINGS_SIDECAR_BASENAME).load()
+    sidecar.read_documents()
+    t4 = time.perf_counter()
+    print(f'documents count:      {len(documents)}')
+    print(f'embeddings rows:      {row_count}')
+    print(f'json load seconds:    {t2 - t1:.4f}')
+    print(f'sidecar load seconds: {t4 - t3:.4f}')
+
+def reduce_embeddings(method, dimensions):
+    """
+    Reduce the embeddings sidecar matrix to the given dimensions by PCA or a
+    Gaussian random projection, and write the reduced float32 matrix, in the
+    row order of the sidecar ids file, and the fitted reduction model.
+    Report the recall@10 of cosine searches of the reduced vectors against
+    those of the full vectors, for a sample of the players.
+    """
+    print(f'=== reduce_embeddings, method: {method}, dimensions: {dimensions}')
+    sidecar = EmbeddingsSidecar(EMBEDDINGS_SIDECAR_BASENAME).load()
+    matrix = np.asarray(sidecar.matrix, dtype=np.float32)
+    queries = sample_rows(len(matrix), RECALL_QUERY_COUNT)
+    truth_ids, truth_scores = exact_top_k(matrix, matrix[queries], RECALL_TRUTH_K, 'cosine', exclude=queries)
+
+    t1 = time.perf_counter()
+    reducer = Reducer(method, dimensions).fit(matrix)
+    reduced = reducer.transform(matrix)
+    elapsed = time.perf_counter() - t1
+    reduced_basename = f'{EMBEDDINGS_SIDECAR_BASENAME}_{method}{dimensions}'
+    np.save(f'{reduced_basename}.npy', reduced)
+    print(f'file written: {reduced_basename}.npy')
+    reducer.save(f'{reduced_basename}_model.npz')
+    print(f'file written: {reduced_basename}_model.npz')
+
+    found_ids, _ = exact_top_k(reduced, reduced[queries], RECALL_K, 'cosine', exclude=queries)
+    report = dict(method=method, input_dimensions=int(matrix.shape[1]), dimensions=int(dimensions))
+    report['rows'] = len(matrix)
+    report['queries'] = len(queries)
+    report[f'recall_at_{RECALL_K}'] = round(recall_at_k(truth_ids, found_ids, RECALL_K, truth_scores), 4)
+    report[f'recall_at_{RECALL_K}_loss'] = round(1.0 - report[f'recall_at_{RECALL_K}'], 4)
+    if reducer.explained_variance_ratio is not None:
+        report['explained_variance_ratio'] = round(reducer.explained_variance_ratio, 4)
+    report['bytes_per_vector'] = int(reduced.itemsize * dimensions)
+    report['fit_transform_seconds'] = round(elapsed, 4)
+    print(json.dumps(report, sort_keys=False, indent=2))
+    FS.write_json(report, f'tmp/reduce_embeddings_{method}{dimensions}.json')
+    return report
+
+def quantize_embeddings(encoding_name):
+    """
+    Encode the embeddings sidecar matrix as int8, with a per-dimension scale
+    and offset, or as float16, and write the codes and the encoding model next
+    to the sidecar; 'python main.py load_baseball_players ... --float16' in
+    cosmos_pg loads the float16 codes into a pgvector halfvec column.
+    Report the recall@10 of cosine searches scored directly on the codes
+    against those of the float32 vectors, for a sample of the players.
+    """
+    print(f'=== quantize_embeddings, encoding: {encoding_name}')
+    sidecar = EmbeddingsSidecar(EMBEDDINGS_SIDECAR_BASENAME).load()
+    matrix = np.asarray(sidecar.matrix, dtype=np.float32)
+    queries = sample_rows(len(matrix), RECALL_QUERY_COUNT)
+    t1 = time.perf_counter()
+    truth_ids, truth_scores = exact_top_k(matrix, matrix[queries], RECALL_TRUTH_K, 'cosine', exclude=queries)
+    float32_seconds = time.perf_counter() - t1
+
+    encoding = Int8Encoding() if encoding_name == 'int8' else Float16Encoding()
+    codes = encoding.fit(matrix).encode(matrix)
+    np.save(sidecar.matrix_file(encoding_name), codes)
+    print(f'file written: {sidecar.matrix_file(encoding_name)}')
+    model_file = f'{EMBEDDINGS_SIDECAR_BASENAME}_{encoding_name}_model.npz'
+    encoding.save(model_file)
+    print(f'file written: {model_file}')
+
+    t1 = time.perf_counter()
+    row_norms = squared_norms(encoding, codes)
+    found_ids, _ = encoded_top_k(encoding, codes, matrix[queries], RECALL_K, 'cosine', exclude=queries, row_norms=row_norms)
+    encoded_seconds = time.perf_counter() - t1
+    errors = np.abs(encoding.decode(codes) - matrix)
+
+    report = dict(encoding=encoding_name, rows=len(matrix), dimensions=int(matrix.shape[1]), queries=len(queries))
+    report[f'recall_at_{RECALL_K}'] = round(recall_at_k(truth_ids, found_ids, RECALL_K, truth_scores), 4)
+    report['mean_abs_error'] = float(errors.mean())
+    report['max_abs_error'] = float(errors.max())
+    report['bytes_per_vector'] = int(codes.itemsize * codes.shape[1])
+    report['float32_bytes_per_vector'] = int(matrix.itemsize * matrix.shape[1])
+    report['float32_search_seconds'] = round(float32_seconds, 4)
+    report['encoded_search_seconds'] = round(encoded_seconds, 4)
+    print(json.dumps(report, sort_keys=False, indent=2))
+    FS.write_json(report, f'tmp/quantize_embeddings_{encoding_name}.json')
+    return report
 
 def create_azure_oai_client():
+    if Env.boolean_arg('--local-hash'):
+        return create_local_hash_oai_client()
     config = {}
     config['type'] = 'azure'
     config['url']  = os.environ['AZURE_OPENAI_URL']
     config['key']  = os.environ['AZURE_OPENAI_KEY1']
     config['api_version'] = '2023-05-15'  # <-- subject to change
+    config['embeddings_cache_file'] = Env.var('AZURE_OPENAI_EMBEDDINGS_CACHE', EMBEDDINGS_CACHE_FILE)
     print('create_azure_oai_client, config: {}'.format(json.dumps(config)))
     return OpenAIClient(config)
 
+def create_local_hash_oai_client():
+    """
+    Return an OpenAIClient which generates deterministic feature-hashing
+    embeddings locally, without Azure OpenAI; see --local-hash.
+    """
+    config = {}
+    config['type'] = 'local-hash'
+    config['embedding_dimensions'] = EXPECTED_EMBEDDINGS_ARRAY_LENGTH
+    print('create_local_hash_oai_client, config: {}'.format(json.dumps(config)))
+    return OpenAIClient(config)
+
+def create_token_counting_oai_client():
+    """
+    Return an OpenAIClient which counts tokens and packs batches as the
+    add_embeddings client does, without setting the global openai api key
+    and headers: a local-hash client, with the cl100k_base tiktoken encoding
+    of the Azure OpenAI client unless --local-hash is on the command-line.
+    """
+    config = {}
+    config['type'] = 'local-hash'
+    if not Env.boolean_arg('--local-hash'):
+        config['encoding_model'] = 'cl100k_base'
+    return OpenAIClient(config)
+
 def scan_documents():
     print(f'=== scan_documents')
     infile = '../data/wrangled/documents.json'
@@ -699,6 +1507,15 @@ def to_float(s: str) -> float:
     except:
         return 0.0
 
+def masked_divide(numerator, denominator, mask, default_value: float):
+    """
+    Divide the given numpy arrays element-wise where mask is True,
+    and return default_value elsewhere.
+    """
+    result = np.full(len(numerator), float(default_value))
+    np.divide(numerator, denominator, out=result, where=mask)
+    return result
+
 def float_value(dictionary: dict, key: str, default_value: float) -> float:
     try:
         return float(dictionary[key])
@@ -706,9 +1523,13 @@ def float_value(dictionary: dict, key: str, default_value: float) -> float:
         return float(default_value)
 
 def appearances_df():
-    infile = '../data/seanhahman-baseballdatabank-2023.1/core/Appearances.csv'
-    df = pd.read_csv(infile)
-    df = df.dropna()
+    """
+    Return the Appearances rows without a blank in any column, as the
+    original dropna of the whole csv did, with only the APPEARANCES_DTYPES
+    columns; the APPEARANCES_MASK_DTYPES columns are read only for the mask.
+    """
+    df = read_databank_csv(APPEARANCES_CSV, {**APPEARANCES_DTYPES, **APPEARANCES_MASK_DTYPES})
+    df = df.loc[df.notna().all(axis=1), list(APPEARANCES_DTYPES.keys())]
     if verbose():
         cols = list(df.columns.values)
         cols_str = ",".join(cols)
@@ -717,8 +1538,7 @@ def appearances_df():
     return df
 
 def people_df():
-    infile = '../data/seanhahman-baseballdatabank-2023.1/core/People.csv'
-    df = pd.read_csv(infile)
+    df = read_databank_csv(PEOPLE_CSV, PEOPLE_DTYPES)
     if verbose():
         cols = list(df.columns.values)
         cols_str = ",".join(cols)
@@ -727,8 +1547,7 @@ def people_df():
     return df
 
 def batters_df():
-    infile = '../data/seanhahman-baseballdatabank-2023.1/core/Batting.csv'
-    df = pd.read_csv(infile)
+    df = read_databank_csv(BATTING_CSV, BATTING_DTYPES)
     if verbose():
         cols = list(df.columns.values)
         cols_str = ",".join(cols)
@@ -737,8 +1556,7 @@ def batters_df():
     return df
 
 def pitchers_df():
-    infile = '../data/seanhahman-baseballdatabank-2023.1/core/Pitching.csv'
-    df = pd.read_csv(infile)
+    df = read_databank_csv(PITCHING_CSV, PITCHING_DTYPES)
     if verbose():
         cols = list(df.columns.values)
         cols_str = ",".join(cols)
@@ -746,6 +1564,59 @@ def pitchers_df():
         print(f"pitchers_df columns: {cols_str}")
     return df
 
+def read_databank_csv(infile, dtypes):
+    """
+    Read only the columns named in the given dtypes dict from the given
+    Databank csv file, with those explicit dtypes.  The pyarrow csv engine
+    is used if --pyarrow is on the command-line.  The parsed frame is
+    memoized per process, so callers must not modify it in place.
+    """
+    engine = csv_engine()
+    key = (infile, engine)
+    if key not in DATABANK_FRAMES:
+        DATABANK_FRAMES[key] = pd.read_csv(
+            infile, usecols=list(dtypes.keys()), dtype=dtypes, engine=engine)
+    return DATABANK_FRAMES[key]
+
+def csv_engine():
+    if Env.boolean_arg('--pyarrow'):
+        return 'pyarrow'
+    return 'c'
+
+def csv_records(df, int_cols):
+    """
+    Return a list of row dicts for the given frame, with the same str values
+    that FS.read_csv_as_dicts would return after write_df, and the given
+    int_cols cast with to_int.  This avoids the csv file round-trip.
+    """
+    cols = list(df.columns)
+    columns = []
+    for col in cols:
+        series = df[col]
+        if col in int_cols:
+            values = series.astype('float64').fillna(0).round().astype('int64').tolist()
+        else:
+            values = csv_values(series)
+        columns.append(values)
+    return [dict(zip(cols, values)) for values in zip(*columns)]
+
+def csv_values(series):
+    """ Return the list of str values of the given Series, as read back from a csv file. """
+    return [v if isinstance(v, str) else ('' if pd.isna(v) else str(v)) for v in series.tolist()]
+
+def frame_to_dicts(df, index_key=None):
+    """
+    Return a dict of index value -> row dict, with native python values.
+    If index_key is given, the index value is also the first item of each row dict.
+    """
+    index = df.index.tolist()
+    cols = list(df.columns)
+    columns = [df[col].tolist() for col in cols]
+    if index_key is not None:
+        cols = [index_key] + cols
+        columns = [index] + columns
+    return {idx: dict(zip(cols, values)) for idx, values in zip(index, zip(*columns))}
+
 def include_only_cols(df, cols_to_keep):
     col_names = list(df.columns.values)
     cols_to_delete = []
@@ -791,11 +1662,41 @@ if __name__ == "__main__":
                 calc_batters_stats()
             elif func == 'calc_pitchers_stats':
                 calc_pitchers_stats()
+            elif func == 'verify_pitchers_stats':
+                verify_pitchers_stats()
             elif func == 'build_documents':
                 build_documents()
+            elif func == 'verify_embeddings_str':
+                verify_embeddings_str()
+            elif func == 'build_feature_vectors':
+                build_feature_vectors()
+            elif func == 'search_feature_vectors':
+                search_feature_vectors(sys.argv[2])
+            elif func == 'run_all':
+                run_all()
             elif func == 'add_embeddings_to_documents':
                 min_debut_year = int(sys.argv[2])
                 add_embeddings(min_debut_year)
+            elif func == 'write_embeddings_sidecar':
+                write_embeddings_sidecar()
+            elif func == 'normalize_embeddings':
+                normalize_embeddings()
+            elif func == 'token_report':
+                min_debut_year = int(sys.argv[2])
+                token_report(min_debut_year)
+            elif func == 'reduce_embeddings':
+                method = sys.argv[2].lower()
+                if sys.argv[3].lower() == 'all':
+                    for dimensions in REDUCED_EMBEDDINGS_DIMENSIONS:
+                        reduce_embeddings(method, dimensions)
+                else:
+                    reduce_embeddings(method, int(sys.argv[3]))
+            elif func == 'quantize_embeddings':
+                encoding_name = sys.argv[2].lower()
+                for name in (ENCODINGS if encoding_name == 'all' else [encoding_name]):
+                    if name not in ENCODINGS:
+                        raise ValueError(f'invalid encoding: {name}')
+                    quantize_embeddings(name)
             elif func == 'scan_documents':
                 scan_documents()
             elif func == 'flatten_documents':
@@ -7,6 +7,9 @@
 mkdir -p tmp/
 rm tmp/*.*
 
+# Alternatively, 'python bb_wrangle.py run_all' executes all of the following
+# prune/calc/build_documents steps in one process, without the tmp/ files.
+
 # Prune unnecessary columns from the Lahman Baseball Database CSV files.
 python bb_wrangle.py prune_people
 python bb_wrangle.py prune_player_positions
@@ -24,6 +27,10 @@ python bb_wrangle.py calc_pitchers_stats
 # The output JSON files are saved in GitHub for end-user/customer processing.
 python bb_wrangle.py build_documents
 
+# Calculate the local numeric feature vectors of the documents; these don't
+# require Azure OpenAI, see search_feature_vectors.
+python bb_wrangle.py build_feature_vectors
+
 python bb_wrangle.py scan_documents
 
 echo 'listing of all tmp files:'
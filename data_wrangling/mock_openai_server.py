@@ -0,0 +1,275 @@
+"""
+Usage:
+  python mock_openai_server.py serve <port> <rpm> <tpm> <latency-ms> <failure-rate>
+  python mock_openai_server.py serve 8089 720 120000 50 0.01
+  python mock_openai_server.py benchmark <port> <strategy> <count>
+  python mock_openai_server.py benchmark 8089 sequential 200
+  python mock_openai_server.py benchmark 8089 batched 2000
+  python mock_openai_server.py benchmark 8089 concurrent 2000
+  python mock_openai_server.py benchmark 8089 all 2000
+  python mock_openai_server.py serve 8089 720 120000 50 0.01 --whitespace-tokens
+  python mock_openai_server.py benchmark 8089 all 2000 --whitespace-tokens
+Options:
+  -h --help     Show this screen.
+  --version     Show version.
+"""
+
+# A local stand-in for the Azure OpenAI embeddings endpoint, for load testing
+# the OpenAIClient retry and concurrency strategies.  The server enforces the
+# given requests and tokens per minute, returns 429 responses with Retry-After
+# headers, and injects latency and 500 failures.  The embeddings are those of
+# the local-hash OpenAIClient.  The server counts the tokens of each request
+# with OpenAIClient.get_token_counts, with the cl100k_base tiktoken encoding
+# as the client does, so its 429 thresholds match the client's TPM budget;
+# with --whitespace-tokens on both the serve and benchmark command-lines,
+# both count whitespace separated words, without the tiktoken data.  The
+# concurrent strategy is the EmbeddingsExecutor of add_embeddings, created by
+# bb_wrangle.create_embeddings_executor.  add_embeddings can also be run against it:
+#   AZURE_OPENAI_URL=http://127.0.0.1:8089 AZURE_OPENAI_KEY1=mock python bb_wrangle.py add_embeddings_to_documents 1872
+# Chris Joakim, Microsoft, 2023
+
+import json
+import math
+import random
+import sys
+import threading
+import time
+import traceback
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from docopt import docopt
+
+from bb_wrangle import create_embeddings_executor
+from pysrc.aibundle import Counter, FS, OpenAIClient
+
+BENCHMARK_STRATEGIES = ['sequential', 'batched', 'concurrent']
+BENCHMARK_PAUSE_SECONDS = 5.0
+
+def print_options(msg):
+    print(msg)
+    arguments = docopt(__doc__, version='1.0.0')
+    print(arguments)
+
+
+class MockEmbeddingsService():
+    """
+    This class holds the quota window, the fault injection settings, and the
+    response counts of the mock server.  The requests and tokens of the
+    admitted requests in the last minute are counted against rpm and tpm.
+    """
+    def __init__(self, rpm: int, tpm: int, latency_ms: float, failure_rate: float, encoding_model: str):
+        self.rpm = int(rpm)
+        self.tpm = int(tpm)
+        self.latency_ms = float(latency_ms)
+        self.failure_rate = float(failure_rate)
+        self.window = deque()
+        self.window_tokens = 0
+        self.lock = threading.Lock()
+        self.counter = Counter()
+        self.embedder = OpenAIClient({'type': 'local-hash', 'encoding_model': encoding_model})
+
+    def admit(self, tokens: int) -> float | None:
+        """ Return None if the request is within the quotas, else the Retry-After seconds. """
+        with self.lock:
+            now = time.monotonic()
+            while len(self.window) > 0 and self.window[0][0] <= now - 60.0:
+                self.window_tokens = self.window_tokens - self.window.popleft()[1]
+            if len(self.window) + 1 <= self.rpm and self.window_tokens + tokens <= self.tpm:
+                self.window.append((now, tokens))
+                self.window_tokens = self.window_tokens + tokens
+                return None
+            # the time until enough of the window expires to admit this request
+            freed_requests, freed_tokens = 0, 0
+            for t, n in self.window:
+                freed_requests, freed_tokens = freed_requests + 1, freed_tokens + n
+                if len(self.window) - freed_requests + 1 <= self.rpm and self.window_tokens - freed_tokens + tokens <= self.tpm:
+                    return max(0.001, t + 60.0 - now)
+            return 60.0
+
+    def latency_seconds(self, input_count: int) -> float:
+        """ Return an exponentially-tailed latency, growing with the input count. """
+        base = (self.latency_ms / 1000.0) * (1.0 + 0.05 * input_count)
+        return base * (0.5 + random.expovariate(2.0))
+
+    def increment(self, key: str) -> None:
+        with self.lock:
+            self.counter.increment(key)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counter.get_data())
+
+
+class MockEmbeddingsHandler(BaseHTTPRequestHandler):
+    """ This class handles the /openai/deployments/<name>/embeddings and /stats requests. """
+    service = None
+
+    def do_POST(self):
+        service = MockEmbeddingsHandler.service
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.path.split('?')[0].endswith('/embeddings'):
+            self.send_json(404, {'error': {'code': '404', 'message': f'not found: {self.path}'}})
+            return
+        inputs = json.loads(body).get('input', [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        tokens = sum(service.embedder.get_token_counts([str(text) for text in inputs]))
+        service.increment('requests')
+
+        retry_after = service.admit(tokens)
+        if retry_after is not None:
+            service.increment('throttled')
+            headers = {'Retry-After': str(int(math.ceil(retry_after))), 'retry-after-ms': str(int(retry_after * 1000))}
+            message = f'Requests to the Embeddings_Create Operation have exceeded the rate limit. Please retry after {int(math.ceil(retry_after))} seconds.'
+            self.send_json(429, {'error': {'code': '429', 'message': message}}, headers)
+            return
+        time.sleep(service.latency_seconds(len(inputs)))
+        if random.random() < service.failure_rate:
+            service.increment('failed')
+            self.send_json(500, {'error': {'code': '500', 'message': 'injected failure'}})
+            return
+
+        data = list()
+        for idx, text in enumerate(inputs):
+            data.append({'object': 'embedding', 'index': idx, 'embedding': service.embedder.local_hash_embedding(str(text))})
+        service.increment('succeeded')
+        usage = {'prompt_tokens': tokens, 'total_tokens': tokens}
+        self.send_json(200, {'object': 'list', 'data': data, 'model': 'text-embedding-ada-002', 'usage': usage})
+
+    def do_GET(self):
+        if self.path.startswith('/stats'):
+            self.send_json(200, MockEmbeddingsHandler.service.stats())
+        else:
+            self.send_json(404, {'error': {'code': '404', 'message': f'not found: {self.path}'}})
+
+    def send_json(self, status: int, obj: dict, headers: dict = {}):
+        payload = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        if verbose():
+            super().log_message(format, *args)
+
+
+def serve(port, rpm, tpm, latency_ms, failure_rate):
+    print(f'=== serve, port: {port}, rpm: {rpm}, tpm: {tpm}, latency_ms: {latency_ms}, failure_rate: {failure_rate}, encoding_model: {encoding_model()}')
+    MockEmbeddingsHandler.service = MockEmbeddingsService(rpm, tpm, latency_ms, failure_rate, encoding_model())
+    server = ThreadingHTTPServer(('127.0.0.1', int(port)), MockEmbeddingsHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print(json.dumps(MockEmbeddingsHandler.service.stats()))
+
+def benchmark(port, strategy, count):
+    """
+    Embed the first count embeddings_str values of the wrangled documents
+    through the mock server with the given client strategy, or all of them,
+    and report the throughput, retries, and request latency percentiles.
+    """
+    print(f'=== benchmark, port: {port}, strategy: {strategy}, count: {count}')
+    documents = FS.read_json('../data/wrangled/documents.json')
+    texts = [documents[pid]['embeddings_str'] for pid in sorted(documents.keys())
+        if len(documents[pid].get('embeddings_str', '')) > 0][:int(count)]
+    strategies = BENCHMARK_STRATEGIES if strategy == 'all' else [strategy]
+    results = list()
+    for s in strategies:
+        results.append(benchmark_strategy(port, s, texts))
+    for result in results:
+        print(json.dumps(result))
+    FS.write_json(results, f'tmp/mock_openai_benchmark_{strategy}.json')
+
+def benchmark_strategy(port, strategy, texts):
+    opts = dict(type='azure', url=f'http://127.0.0.1:{port}', key='mock',
+        embeddings_pause_seconds=BENCHMARK_PAUSE_SECONDS, encoding_model=encoding_model())
+    client = OpenAIClient(opts)
+    stats_before = server_stats(port)
+    latencies, failed_texts = list(), 0
+    t1 = time.perf_counter()
+    if strategy == 'sequential':
+        # the original one-text-per-request get_embedding loop
+        for text in texts:
+            t2 = time.perf_counter()
+            try:
+                client.get_embedding(text)
+                latencies.append(time.perf_counter() - t2)
+            except Exception:
+                failed_texts = failed_texts + 1
+    elif strategy == 'batched':
+        for batch in client.embeddings_batches(texts):
+            t2 = time.perf_counter()
+            try:
+                client.get_batch_embeddings([texts[idx] for idx in batch])
+                latencies.append(time.perf_counter() - t2)
+            except Exception:
+                failed_texts = failed_texts + len(batch)
+    elif strategy == 'concurrent':
+        # the EmbeddingsExecutor and RateLimiter of add_embeddings
+        executor = create_embeddings_executor(client)
+        embeddings = executor.run(texts)
+        failed_texts = len([e for e in embeddings if e is None])
+        latencies = executor.latencies
+    else:
+        raise Exception(f'invalid strategy: {strategy}')
+    elapsed = time.perf_counter() - t1
+
+    stats_after = server_stats(port)
+    counts = {k: stats_after.get(k, 0) - stats_before.get(k, 0) for k in ['requests', 'succeeded', 'throttled', 'failed']}
+    result = dict(strategy=strategy, texts=len(texts), failed_texts=failed_texts, seconds=round(elapsed, 3))
+    result['embeddings_per_sec'] = round((len(texts) - failed_texts) / elapsed, 2) if elapsed > 0 else 0.0
+    result.update(counts)
+    result['retries'] = counts['requests'] - counts['succeeded']
+    for pct in [50, 95, 99]:
+        result[f'p{pct}_seconds'] = percentile(latencies, pct)
+    return result
+
+def server_stats(port) -> dict:
+    return requests.get(f'http://127.0.0.1:{port}/stats').json()
+
+def percentile(values, pct):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct / 100))], 4)
+
+def encoding_model():
+    if '--whitespace-tokens' in sys.argv:
+        return 'whitespace'
+    return 'cl100k_base'
+
+def verbose():
+    for arg in sys.argv:
+        if arg == '--verbose':
+            return True
+    return False
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        try:
+            func = sys.argv[1].lower()
+            if func == 'serve':
+                port, rpm, tpm = sys.argv[2], sys.argv[3], sys.argv[4]
+                latency_ms, failure_rate = sys.argv[5], sys.argv[6]
+                serve(port, rpm, tpm, latency_ms, failure_rate)
+            elif func == 'benchmark':
+                port, strategy, count = sys.argv[2], sys.argv[3].lower(), sys.argv[4]
+                benchmark(port, strategy, count)
+            else:
+                print_options('Error: invalid function: {}'.format(func))
+        except Exception as e:
+            print(str(e))
+            print(traceback.format_exc())
+    else:
+        print_options('Error: no command-line function specified')
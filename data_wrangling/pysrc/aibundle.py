@@ -3,27 +3,32 @@ Module aibundle.py - bundled standard codebase.
 Copyright (c) 2023 Chris Joakim, MIT License
 Timestamp: 2023-10-30 16:27
 
-Usage:  from pysrc.aibundle import Bytes, CogSearchClient, CogSvcsClient, Counter, Env, FS, Mongo, OpenAIClient, Storage, StringUtil, System
+Usage:  from pysrc.aibundle import Bytes, CogSearchClient, CogSvcsClient, Counter, EmbeddingsCache, EmbeddingsSidecar, Env, FS, Mongo, OpenAIClient, Storage, StringUtil, System
 """
 
 import csv
+import hashlib
 import json
 import os
 import platform
 import socket
+import sqlite3
 import sys
+import threading
 import time
 import traceback
 import uuid
 
 import certifi
 import matplotlib
+import numpy as np
 import openai
 import pandas as pd
 import psutil
 import requests
 import tiktoken
 
+from collections import OrderedDict
 from numbers import Number
 from typing import Iterator
 
@@ -788,6 +793,186 @@ class Counter():
         return self.data
 # ==============================================================================
 
+class EmbeddingsCache():
+    """
+    This class is a persistent, content-addressed cache of embeddings in a
+    SQLite database file.  The key is the sha256 of the embedding model and
+    the whitespace-normalized text, and the vectors are stored as float32
+    blobs.  The least recently used rows are evicted when the vectors exceed
+    max_bytes.
+    """
+    def __init__(self, dbfile: str, max_bytes: int = 1_000_000_000):
+        self.dbfile = dbfile
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+        dirname = os.path.dirname(dbfile)
+        if len(dirname) > 0:
+            os.makedirs(dirname, exist_ok=True)
+        self.conn = sqlite3.connect(dbfile, check_same_thread=False)
+        self.conn.execute('create table if not exists embeddings ' +
+            '(key text primary key, model text, vector blob, last_used real)')
+        self.conn.execute('create index if not exists embeddings_last_used on embeddings (last_used)')
+        self.conn.commit()
+        self.total_bytes = self.size_bytes()
+
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        """ Return the given text with its whitespace collapsed to single spaces. """
+        return ' '.join(text.split())
+
+    @classmethod
+    def key(cls, model: str, text: str) -> str:
+        return hashlib.sha256(f'{model}\n{cls.normalize(text)}'.encode('utf-8')).hexdigest()
+
+    def get_many(self, model: str, texts: list[str]) -> list[list[float] | None]:
+        """ Return the cached embeddings of the given texts, in order; None for misses. """
+        keys = [self.key(model, text) for text in texts]
+        found = dict()
+        with self.lock:
+            for idx in range(0, len(keys), 500):
+                chunk = keys[idx:idx + 500]
+                sql = 'select key, vector from embeddings where key in ({})'.format(','.join('?' * len(chunk)))
+                for key, vector in self.conn.execute(sql, chunk):
+                    found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+            if len(found) > 0:
+                now = time.time()
+                self.conn.executemany('update embeddings set last_used = ? where key = ?', [(now, key) for key in found.keys()])
+                self.conn.commit()
+            embeddings = [found.get(key) for key in keys]
+            hit_count = len([e for e in embeddings if e is not None])
+            self.hits = self.hits + hit_count
+            self.misses = self.misses + len(keys) - hit_count
+        return embeddings
+
+    def put_many(self, model: str, texts: list[str], embeddings: list[list[float]]) -> None:
+        """ Cache the given embeddings of the given texts; None embeddings are skipped. """
+        now = time.time()
+        rows = list()
+        for text, e in zip(texts, embeddings):
+            if e is not None:
+                rows.append((self.key(model, text), model, np.asarray(e, dtype=np.float32).tobytes(), now))
+        if len(rows) > 0:
+            with self.lock:
+                self.conn.executemany('insert or replace into embeddings values (?, ?, ?, ?)', rows)
+                self.conn.commit()
+                self.total_bytes = self.total_bytes + sum(len(row[2]) for row in rows)
+                if self.total_bytes > self.max_bytes:
+                    self.evict()
+
+    def evict(self) -> None:
+        """ Delete the least recently used rows until the vectors fit in 90% of max_bytes. """
+        self.total_bytes = self.size_bytes()
+        target = int(self.max_bytes * 0.9)
+        if self.total_bytes > self.max_bytes:
+            keys = list()
+            for key, size in self.conn.execute('select key, length(vector) from embeddings order by last_used'):
+                if self.total_bytes <= target:
+                    break
+                keys.append((key,))
+                self.total_bytes = self.total_bytes - size
+            self.conn.executemany('delete from embeddings where key = ?', keys)
+            self.conn.commit()
+            self.evicted = self.evicted + len(keys)
+
+    def size_bytes(self) -> int:
+        return int(self.conn.execute('select coalesce(sum(length(vector)), 0) from embeddings').fetchone()[0])
+
+    def stats(self) -> dict:
+        """ Return the hit rate, row count, and size of the cache. """
+        with self.lock:
+            rows = int(self.conn.execute('select count(*) from embeddings').fetchone()[0])
+            lookups = self.hits + self.misses
+            hit_rate = round(self.hits / lookups, 4) if lookups > 0 else 0.0
+            return dict(dbfile=self.dbfile, hits=self.hits, misses=self.misses, hit_rate=hit_rate,
+                evicted=self.evicted, rows=rows, bytes=self.total_bytes, max_bytes=self.max_bytes)
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+# ==============================================================================
+
+class EmbeddingsSidecar():
+    """
+    This class reads and writes the binary sidecar of a dict of documents
+    with embeddings: a contiguous float32 .npy matrix with one row per
+    vectorized document, a json list of the row ids, and a slim json file of
+    the documents without their embeddings.  The matrix is memory-mapped on
+    read, so the vectors are not parsed out of a large json file.
+    """
+    def __init__(self, basename: str):
+        self.basename = basename
+        self.ids = None
+        self.index = None
+        self.matrix = None
+
+    def matrix_file(self, encoding: str = None) -> str:
+        """ Return the float32 matrix filename, or that of the given compact encoding, such as float16. """
+        if encoding is None or encoding == 'float32':
+            return f'{self.basename}.npy'
+        return f'{self.basename}_{encoding}.npy'
+
+    def ids_file(self) -> str:
+        return f'{self.basename}_ids.json'
+
+    def docs_file(self) -> str:
+        return f'{self.basename}_docs.json'
+
+    def exists(self) -> bool:
+        """ Return True if all three sidecar files exist. """
+        for f in [self.matrix_file(), self.ids_file(), self.docs_file()]:
+            if not os.path.isfile(f):
+                return False
+        return True
+
+    def write(self, documents: dict, dimensions: int, key='embeddings') -> int:
+        """
+        Write the sidecar files for the given dict of id -> document, in id
+        order.  Only documents with a key list of the given dimensions get a
+        matrix row.  Return the row count.
+        """
+        ids, rows, docs = list(), list(), dict()
+        for id in sorted(documents.keys()):
+            doc = documents[id]
+            docs[id] = {k: v for k, v in doc.items() if k != key}
+            vector = doc.get(key)
+            if isinstance(vector, list) and len(vector) == dimensions:
+                ids.append(id)
+                rows.append(vector)
+        matrix = np.asarray(rows, dtype=np.float32).reshape(len(rows), dimensions)
+        np.save(self.matrix_file(), matrix)
+        print(f'file written: {self.matrix_file()}')
+        FS.write_json(ids, self.ids_file(), pretty=False)
+        FS.write_json(docs, self.docs_file(), pretty=False)
+        return len(ids)
+
+    def load(self, encoding: str = None):
+        """ Memory-map the matrix, or its given compact encoding, and read the row ids; return self. """
+        self.ids = FS.read_json(self.ids_file())
+        self.index = {id: row for row, id in enumerate(self.ids)}
+        self.matrix = np.load(self.matrix_file(encoding), mmap_mode='r')
+        return self
+
+    def read_documents(self) -> dict:
+        """ Return the dict of id -> document, without the embeddings. """
+        return FS.read_json(self.docs_file())
+
+    def vector(self, id: str):
+        """ Return the float32 vector of the given id, or None. """
+        if id in self.index:
+            return self.matrix[self.index[id]]
+        return None
+
+    def vector_list(self, id: str) -> list[float]:
+        """ Return the vector of the given id as a list of floats, or an empty list. """
+        vector = self.vector(id)
+        if vector is None:
+            return list()
+        return vector.tolist()
+# ==============================================================================
+
 class Env():
     """
     This class is used to read the host environment, such as username and
@@ -1268,15 +1453,24 @@ class Mongo():
 # ==============================================================================
 
 class OpenAIClient(object):
-    """ This class is a REST and/or SDK client to Azure OpenAI. """
+    """
+    This class is a REST and/or SDK client to Azure OpenAI.  The 'local-hash'
+    type instead generates deterministic embeddings locally, by feature
+    hashing the tokens of the text, for offline runs and benchmarks.
+    Only data_wrangling generates the document embeddings, so the batched,
+    cached, and concurrent embeddings methods are in this copy of the class
+    only; the copies in the other bundles embed single query texts.
+    """
 
     def __init__(self, opts):
         self.opts = opts
         self.type = 'azure'  # default
         try:
             if 'type' in opts.keys():
-                self.type = opts['type'].strip().lower()  # azure or openai
-            if self.type == 'azure':
+                self.type = opts['type'].strip().lower()  # azure, openai, or local-hash
+            if self.type == 'local-hash':
+                pass
+            elif self.type == 'azure':
                 openai.api_base    = opts['url']
                 openai.api_key     = opts['key']
                 openai.api_type    = 'azure'
@@ -1300,6 +1494,17 @@ class OpenAIClient(object):
         self.embeddings_sleep_seconds = 0.20
         self.embeddings_pause_seconds = 150.0
         self.retry_count = 5
+        self.embeddings_batch_size = 16
+        self.embeddings_batch_max_tokens = 8191
+        self.embeddings_cache_file = None
+        self.embeddings_cache_max_bytes = 1_000_000_000
+        self.embedding_dimensions = 1536
+        self.token_count_threads = 8
+        self.token_count_memo_size = 100_000
+        if self.type == 'local-hash':
+            self.embedding_model = 'local-hash'
+            self.encoding_model = 'whitespace'
+            self.embeddings_sleep_seconds = 0.0
 
         # override default embedding and encoding values
 
@@ -1313,8 +1518,32 @@ class OpenAIClient(object):
             self.embeddings_pause_seconds = float(opts['embeddings_pause_seconds'])
         if 'retry_count' in opts.keys():
             self.retry_count = int(opts['retry_count'])
-
-        self.encoding = tiktoken.get_encoding(self.encoding_model)
+        if 'embeddings_batch_size' in opts.keys():
+            self.embeddings_batch_size = int(opts['embeddings_batch_size'])
+        if 'embeddings_batch_max_tokens' in opts.keys():
+            self.embeddings_batch_max_tokens = int(opts['embeddings_batch_max_tokens'])
+        if 'embeddings_cache_file' in opts.keys():
+            self.embeddings_cache_file = opts['embeddings_cache_file']
+        if 'embeddings_cache_max_bytes' in opts.keys():
+            self.embeddings_cache_max_bytes = int(opts['embeddings_cache_max_bytes'])
+        if 'embedding_dimensions' in opts.keys():
+            self.embedding_dimensions = int(opts['embedding_dimensions'])
+        if 'token_count_threads' in opts.keys():
+            self.token_count_threads = int(opts['token_count_threads'])
+        if 'token_count_memo_size' in opts.keys():
+            self.token_count_memo_size = int(opts['token_count_memo_size'])
+        self.token_count_memo = OrderedDict()
+        self.token_count_lock = threading.Lock()
+
+        self.embeddings_cache = None
+        if self.embeddings_cache_file is not None:
+            self.embeddings_cache = EmbeddingsCache(self.embeddings_cache_file, self.embeddings_cache_max_bytes)
+
+        # The whitespace encoding, the local-hash default, counts whitespace
+        # separated tokens, and doesn't require tiktoken data.
+        self.encoding = None
+        if self.encoding_model != 'whitespace':
+            self.encoding = tiktoken.get_encoding(self.encoding_model)
 
     def get_config(self) -> dict:
         """ return a dict containing the config values for this client """
@@ -1331,6 +1560,13 @@ class OpenAIClient(object):
         config['embeddings_sleep_seconds'] = self.embeddings_sleep_seconds
         config['embeddings_pause_seconds'] = self.embeddings_pause_seconds
         config['retry_count'] = self.retry_count
+        config['embeddings_batch_size'] = self.embeddings_batch_size
+        config['embeddings_batch_max_tokens'] = self.embeddings_batch_max_tokens
+        config['embeddings_cache_file'] = self.embeddings_cache_file
+        config['embeddings_cache_max_bytes'] = self.embeddings_cache_max_bytes
+        config['embedding_dimensions'] = self.embedding_dimensions
+        config['token_count_threads'] = self.token_count_threads
+        config['token_count_memo_size'] = self.token_count_memo_size
         return config
 
     def list_deployments(self) -> None:
@@ -1359,10 +1595,15 @@ class OpenAIClient(object):
     def get_embedding(self, text):
         # This method implements limited retry logic with linear backoff
         # to handle possible OpenAI API rate limiting.
+        # The embeddings cache, if configured, is checked first.
+        e = self.get_cached_embeddings([text])[0]
+        if e != None:
+            return e
         for n in range(self.retry_count):
             #print('get_embedding for text: {}'.format(text))
             e = self.try_get_embedding(text)
             if e != None:
+                self.cache_embeddings([text], [e])
                 return e
         raise Exception('unable to get embedding for text: {}'.format(text))
 
@@ -1373,9 +1614,7 @@ class OpenAIClient(object):
         #   text-embedding-ada-002  cl100k_base  8191               1536
         try:
             time.sleep(self.embeddings_sleep_seconds)
-            text = text.replace("\n", ' ')
-            e = openai.Embedding.create(input=[text], engine=self.embedding_model)
-            return e['data'][0]['embedding']  # returns a list of 1536 floats!
+            return self.create_embeddings([text])[0]  # returns a list of 1536 floats!
         except Exception as e:
             print("try_get_embedding exception: {}".format(str(e)))
             traceback.print_exc()
@@ -1385,14 +1624,152 @@ class OpenAIClient(object):
             time.sleep(self.embeddings_pause_seconds)
             return None
 
+    def get_embeddings(self, texts: list[str]) -> list[list[float]]:
+        """
+        Return the list of embeddings for the given list of texts, in the same
+        order.  The cached embeddings are reused, and for the other texts many
+        texts are sent per request, packed into batches of at most
+        embeddings_batch_size texts and embeddings_batch_max_tokens tokens.
+        """
+        embeddings = self.get_cached_embeddings(texts)
+        misses = [idx for idx, e in enumerate(embeddings) if e is None]
+        for batch in self.embeddings_batches([texts[idx] for idx in misses]):
+            batch_texts = [texts[misses[idx]] for idx in batch]
+            batch_embeddings = self.get_batch_embeddings(batch_texts)
+            self.cache_embeddings(batch_texts, batch_embeddings)
+            for idx, e in zip(batch, batch_embeddings):
+                embeddings[misses[idx]] = e
+        return embeddings
+
+    def get_cached_embeddings(self, texts: list[str]) -> list[list[float] | None]:
+        """ Return the cached embeddings of the given texts, None for misses or if there is no cache. """
+        if self.embeddings_cache is None:
+            return [None] * len(texts)
+        return self.embeddings_cache.get_many(self.embedding_model, texts)
+
+    def cache_embeddings(self, texts: list[str], embeddings: list[list[float]]) -> None:
+        if self.embeddings_cache is not None:
+            self.embeddings_cache.put_many(self.embedding_model, texts, embeddings)
+
+    def get_cache_stats(self) -> dict | None:
+        if self.embeddings_cache is None:
+            return None
+        return self.embeddings_cache.stats()
+
+    def embeddings_batches(self, texts: list[str]) -> list[list[int]]:
+        """
+        Return the lists of text indexes for each embeddings request, packing
+        consecutive texts under the batch size and token count limits.  A text
+        with more tokens than the limit is sent alone.
+        """
+        batches, batch, batch_tokens = list(), list(), 0
+        token_counts = self.get_token_counts([text.replace("\n", ' ') for text in texts])
+        for idx, tokens in enumerate(token_counts):
+            if len(batch) > 0:
+                if len(batch) >= self.embeddings_batch_size or batch_tokens + tokens > self.embeddings_batch_max_tokens:
+                    batches.append(batch)
+                    batch, batch_tokens = list(), 0
+            batch.append(idx)
+            batch_tokens = batch_tokens + tokens
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+
+    def get_batch_embeddings(self, texts: list[str]) -> list[list[float]]:
+        # Same retry logic as get_embedding, for one request of many texts.
+        for n in range(self.retry_count):
+            embeddings = self.try_get_batch_embeddings(texts)
+            if embeddings != None:
+                return embeddings
+        raise Exception('unable to get embeddings for {} texts'.format(len(texts)))
+
+    def try_get_batch_embeddings(self, texts: list[str]) -> list[list[float]] | None:
+        try:
+            time.sleep(self.embeddings_sleep_seconds)
+            return self.create_embeddings(texts)
+        except Exception as e:
+            print("try_get_batch_embeddings exception: {}".format(str(e)))
+            traceback.print_exc()
+            self.embeddings_sleep_seconds = (self.embeddings_sleep_seconds) * 1.5
+            print('new embeddings_sleep_seconds is {}'.format(self.embeddings_sleep_seconds))
+            print('pausing for {} seconds'.format(self.embeddings_pause_seconds))
+            time.sleep(self.embeddings_pause_seconds)
+            return None
+
+    def create_embeddings(self, texts: list[str]) -> list[list[float]]:
+        """
+        Send one embeddings request for the given texts, without sleeping or
+        retrying, and return the embeddings in the order of the texts.
+        Exceptions, such as rate limiting, are raised to the caller.
+        """
+        inputs = [text.replace("\n", ' ') for text in texts]
+        if self.type == 'local-hash':
+            return [self.local_hash_embedding(text) for text in inputs]
+        e = openai.Embedding.create(input=inputs, engine=self.embedding_model)
+        embeddings = [None] * len(inputs)
+        for item in e['data']:
+            embeddings[item['index']] = item['embedding']
+        return embeddings
+
+    def local_hash_embedding(self, text: str) -> list[float]:
+        """
+        Return a deterministic unit vector of embedding_dimensions floats for
+        the given text.  Each lowercased whitespace token is hashed with
+        blake2b to two signed dimensions, so texts sharing tokens are similar.
+        A text without tokens returns the first unit basis vector.
+        """
+        vector = np.zeros(self.embedding_dimensions, dtype=np.float64)
+        for token in text.lower().split():
+            digest = hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+            for offset in [0, 8]:
+                h = int.from_bytes(digest[offset:offset + 8], 'little')
+                sign = 1.0 if (h >> 63) == 0 else -1.0
+                vector[h % self.embedding_dimensions] += sign
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0] = 1.0
+            norm = 1.0
+        return (vector / norm).tolist()
+
     def get_token_count(self, text: str) -> int:
         try:
-            return len(self.encoding.encode(text))
+            return self.get_token_counts([text])[0]
         except Exception as e:
             print("exception: {}".format(str(e)))
             traceback.print_exc()
             return -1
 
+    def get_token_counts(self, texts: list[str]) -> list[int]:
+        """
+        Return the token counts of the given texts, in order.  The texts not in
+        the LRU memo of recent counts are encoded at once with the tiktoken
+        batch encoder on token_count_threads threads.
+        """
+        counts = [None] * len(texts)
+        misses = dict()
+        with self.token_count_lock:
+            for idx, text in enumerate(texts):
+                if text in self.token_count_memo:
+                    self.token_count_memo.move_to_end(text)
+                    counts[idx] = self.token_count_memo[text]
+                else:
+                    misses.setdefault(text, list()).append(idx)
+        if len(misses) > 0:
+            unique_texts = list(misses.keys())
+            if self.encoding is None:
+                unique_counts = [len(text.split()) for text in unique_texts]
+            else:
+                encoded = self.encoding.encode_batch(unique_texts, num_threads=self.token_count_threads)
+                unique_counts = [len(tokens) for tokens in encoded]
+            with self.token_count_lock:
+                for text, count in zip(unique_texts, unique_counts):
+                    for idx in misses[text]:
+                        counts[idx] = count
+                    self.token_count_memo[text] = count
+                while len(self.token_count_memo) > self.token_count_memo_size:
+                    self.token_count_memo.popitem(last=False)
+        return counts
+
     def generate(self, deployment_name: str, prompt: str, max_tokens: int) -> object | None:
         try:
             return self.get_openai_response(deployment_name, prompt, int(max_tokens))
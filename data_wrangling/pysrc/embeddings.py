@@ -0,0 +1,353 @@
+"""
+Module embeddings.py - helpers for the long-running generation of
+embeddings: an append-only checkpoint log, progress reporting, and a
+concurrent executor governed by the requests and tokens per minute quotas.
+
+Usage:  from pysrc.embeddings import EmbeddingsExecutor, EmbeddingsLog, EmbeddingsProgress, RateLimiter, TokenBucket, text_hash
+"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# ==============================================================================
+
+def text_hash(text: str) -> str:
+    """ Return the sha256 hex digest of the given embedding string. """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class EmbeddingsLog():
+    """
+    This class is an append-only checkpoint log of generated embeddings,
+    keyed by document id and the hash of the embedding string, for the given
+    embeddings model; the entries of other models, such as those of the
+    local-hash client, are never returned by read.  The json-lines
+    logfile holds the keys and the offset of each vector in a companion file
+    of raw little-endian float32 values, 6KB per 1536 dimension vector, rather
+    than the vectors as json text.  Entries are appended as they are generated
+    and both files are flushed to disk at each checkpoint, so that an
+    interrupted run can resume without repeating the API calls.
+    """
+    def __init__(self, logfile: str, model: str, checkpoint_every: int = 100):
+        self.logfile = logfile
+        self.model = model
+        self.vectors_file = f'{os.path.splitext(logfile)[0]}.f32'
+        self.checkpoint_every = max(1, int(checkpoint_every))
+        self.file = None
+        self.vectors = None
+        self.offset = 0
+        self.pending = 0
+
+    def read(self) -> dict:
+        """
+        Return a dict of id -> (hash, embeddings) of the logged entries of the
+        model; the last entry for an id wins.
+        """
+        entries = dict()
+        if os.path.isfile(self.vectors_file):
+            vectors = np.fromfile(self.vectors_file, dtype='<f4')
+            for entry in self.entries(len(vectors)):
+                if entry.get('model') != self.model:
+                    continue
+                start = entry['offset']
+                entries[entry['id']] = (entry['hash'], vectors[start:start + entry['dimensions']].tolist())
+        return entries
+
+    def entries(self, vector_values: int) -> list[dict]:
+        """
+        Return the parsed entries of the logfile whose vectors are entirely
+        within the first vector_values of the vectors file.  Partially written
+        lines, and the entries of partially written vectors, are ignored.
+        """
+        entries = list()
+        if os.path.isfile(self.logfile):
+            with open(file=self.logfile, encoding='utf-8', mode='rt') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        if int(entry['offset']) + int(entry['dimensions']) <= vector_values:
+                            entries.append(entry)
+                    except Exception:
+                        pass
+        return entries
+
+    def open(self):
+        """
+        Open the log and vectors files for appending; return self.  The files
+        are first repaired after an interrupted write: the ignored entries are
+        removed from the logfile, and the vectors file is truncated after the
+        last logged vector, so that new entries never overlap ignored ones.
+        """
+        if self.file is None:
+            size = os.path.getsize(self.vectors_file) if os.path.isfile(self.vectors_file) else 0
+            entries = self.entries(size // 4)
+            self.offset = max([e['offset'] + e['dimensions'] for e in entries], default=0)
+            if os.path.isfile(self.logfile) and len(entries) < self.line_count():
+                with open(file=self.logfile, encoding='utf-8', mode='wt') as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry))
+                        f.write('\n')
+            if size > self.offset * 4:
+                os.truncate(self.vectors_file, self.offset * 4)
+            self.vectors = open(file=self.vectors_file, mode='ab')
+            self.file = open(file=self.logfile, encoding='utf-8', mode='at')
+            self.pending = 0
+        return self
+
+    def line_count(self) -> int:
+        with open(file=self.logfile, encoding='utf-8', mode='rt') as f:
+            return sum(1 for _ in f)
+
+    def append(self, id: str, hash: str, embeddings: list[float]) -> bool:
+        """ Append the given entry; return True if a checkpoint was written. """
+        vector = np.asarray(embeddings, dtype='<f4')
+        self.vectors.write(vector.tobytes())
+        self.file.write(json.dumps(dict(id=id, hash=hash, model=self.model, offset=self.offset, dimensions=len(vector))))
+        self.file.write('\n')
+        self.offset = self.offset + len(vector)
+        self.pending = self.pending + 1
+        if self.pending >= self.checkpoint_every:
+            self.checkpoint()
+            return True
+        return False
+
+    def checkpoint(self) -> None:
+        """ Flush the appended vectors, then their entries, to disk. """
+        if self.file is not None:
+            for f in [self.vectors, self.file]:
+                f.flush()
+                os.fsync(f.fileno())
+            self.pending = 0
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.checkpoint()
+            self.file.close()
+            self.vectors.close()
+            self.file = None
+            self.vectors = None
+
+class EmbeddingsProgress():
+    """
+    This class tracks the progress of a run of embeddings requests, and
+    formats the throughput (embeddings per second) and ETA.
+    """
+    def __init__(self, total: int):
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+        self.start = time.perf_counter()
+
+    def increment(self, ok: bool = True) -> None:
+        if ok:
+            self.completed = self.completed + 1
+        else:
+            self.failed = self.failed + 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def rate(self) -> float:
+        """ Return the completed embeddings per second. """
+        elapsed = self.elapsed()
+        if elapsed > 0:
+            return self.completed / elapsed
+        return 0.0
+
+    def eta_seconds(self) -> float | None:
+        remaining = self.total - self.completed - self.failed
+        rate = self.rate()
+        if rate > 0:
+            return remaining / rate
+        return None
+
+    def status(self) -> str:
+        eta = self.eta_seconds()
+        eta_str = '?' if eta is None else time.strftime('%H:%M:%S', time.gmtime(eta))
+        done = self.completed + self.failed
+        return f'{done}/{self.total} embeddings, {self.failed} failed, {self.rate():.2f}/sec, eta {eta_str}'
+
+def is_throttled(exception) -> bool:
+    """
+    Return True if the given exception is an HTTP 429 rate limiting response;
+    the status is http_status in the openai 0.x errors, status_code in 1.x.
+    """
+    status = getattr(exception, 'status_code', None) or getattr(exception, 'http_status', None)
+    return status == 429
+
+def retry_after_seconds(exception) -> float | None:
+    """
+    Return the Retry-After seconds of the given rate limiting exception, from
+    the retry-after-ms or Retry-After response headers, or None.
+    """
+    headers = getattr(exception, 'headers', None) or dict()
+    headers = {str(k).lower(): v for k, v in dict(headers).items()}
+    try:
+        if 'retry-after-ms' in headers:
+            return float(headers['retry-after-ms']) / 1000.0
+        if 'retry-after' in headers:
+            return float(headers['retry-after'])
+    except Exception:
+        pass
+    return None
+
+class TokenBucket():
+    """
+    This class is a thread-safe token bucket which refills at a per-minute
+    rate.  Callers reserve tokens and are told how long to wait; the bucket
+    may go into debt, so concurrent callers are queued fairly at the rate.
+    """
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = float(per_minute) / 60.0
+        self.capacity = float(capacity) if capacity is not None else max(1.0, float(per_minute) / 6.0)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, count: float) -> float:
+        """
+        Reserve the given count of tokens; return the seconds to wait before
+        using them.  A count larger than the capacity is charged in full, as debt.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens = self.tokens - float(count)
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+class RateLimiter():
+    """
+    This class combines the requests per minute (RPM) and tokens per minute
+    (TPM) buckets of an Azure OpenAI deployment, plus a shared pause for the
+    Retry-After of throttled requests.
+    """
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, token_count: int) -> float:
+        """ Block until one request of the given token count may be sent; return the seconds waited. """
+        waited = 0.0
+        with self.lock:
+            pause = self.paused_until - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+            waited = pause
+        wait = max(self.requests.reserve(1), self.tokens.reserve(token_count))
+        if wait > 0:
+            time.sleep(wait)
+        return waited + wait
+
+    def pause(self, seconds: float) -> None:
+        """ Pause all requests for the given seconds, per a Retry-After value. """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class EmbeddingsExecutor():
+    """
+    This class sends the batched embeddings requests of an OpenAIClient from
+    a pool of max_in_flight threads.  Every request first acquires the shared
+    RateLimiter.  Throttled (429) requests honor Retry-After by pausing the
+    shared limiter; other failures, including 5xx responses which may also
+    carry Retry-After, are retried with jittered exponential backoff.
+    """
+    def __init__(self, client, rpm: float, tpm: float, max_in_flight: int = 8,
+            max_retries: int = 6, backoff_seconds: float = 1.0, max_backoff_seconds: float = 60.0):
+        self.client = client
+        self.limiter = RateLimiter(rpm, tpm)
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_retries = int(max_retries)
+        self.backoff_seconds = float(backoff_seconds)
+        self.max_backoff_seconds = float(max_backoff_seconds)
+        self.lock = threading.Lock()
+        self.stats = dict(requests=0, retries=0, throttled=0, failed=0, tokens=0)
+        self.latencies = list()
+
+    def run(self, texts: list[str], callback=None) -> list[list[float]]:
+        """
+        Return the embeddings of the given texts, in order; None for the texts
+        of failed requests.  Only the texts not in the client's embeddings
+        cache are requested.  The optional callback(indexes, embeddings) is
+        invoked in the calling thread for the cache hits, and as each request
+        completes.
+        """
+        embeddings = self.client.get_cached_embeddings(texts)
+        hits = [idx for idx, e in enumerate(embeddings) if e is not None]
+        misses = [idx for idx, e in enumerate(embeddings) if e is None]
+        if len(hits) > 0 and callback is not None:
+            callback(hits, [embeddings[idx] for idx in hits])
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            futures = dict()
+            for batch in self.client.embeddings_batches([texts[idx] for idx in misses]):
+                batch = [misses[idx] for idx in batch]
+                futures[pool.submit(self.request, [texts[idx] for idx in batch])] = batch
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    batch_embeddings = future.result()
+                    self.client.cache_embeddings([texts[idx] for idx in batch], batch_embeddings)
+                except Exception as e:
+                    print(f'embeddings request failed: {str(e)}')
+                    print(traceback.format_exc())
+                    batch_embeddings = [None] * len(batch)
+                    self.increment('failed')
+                for idx, e in zip(batch, batch_embeddings):
+                    embeddings[idx] = e
+                if callback is not None:
+                    callback(batch, batch_embeddings)
+        return embeddings
+
+    def request(self, texts: list[str]) -> list[list[float]]:
+        """ Send one embeddings request, with rate limiting and retries. """
+        token_count = sum(self.client.get_token_counts(texts))
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(token_count)
+            t1 = time.perf_counter()
+            try:
+                embeddings = self.client.create_embeddings(texts)
+                with self.lock:
+                    self.stats['requests'] = self.stats['requests'] + 1
+                    self.stats['tokens'] = self.stats['tokens'] + token_count
+                    self.latencies.append(time.perf_counter() - t1)
+                return embeddings
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                self.increment('retries')
+                retry_after = None
+                if is_throttled(e):
+                    self.increment('throttled')
+                    retry_after = retry_after_seconds(e)
+                if retry_after is not None:
+                    self.limiter.pause(retry_after)
+                else:
+                    backoff = min(self.max_backoff_seconds, self.backoff_seconds * (2 ** attempt))
+                    time.sleep(random.uniform(0, backoff))
+
+    def increment(self, key: str) -> None:
+        with self.lock:
+            self.stats[key] = self.stats[key] + 1
+
+    def summary(self) -> dict:
+        """ Return the request counts and the p50/p95/p99 request latency seconds. """
+        summary = dict(self.stats)
+        latencies = sorted(self.latencies)
+        for pct in [50, 95, 99]:
+            key = f'p{pct}_seconds'
+            summary[key] = None
+            if len(latencies) > 0:
+                summary[key] = round(latencies[min(len(latencies) - 1, int(len(latencies) * pct / 100))], 4)
+        return summary
@@ -0,0 +1,250 @@
+"""
+Module hnsw.py - a pure NumPy Hierarchical Navigable Small World (HNSW)
+approximate nearest neighbors index, as in the hnsw algorithm configuration
+of the Cognitive Search baseballplayers index.
+
+Usage:  from pysrc.hnsw import HnswIndex
+"""
+
+import heapq
+import math
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from pysrc.vectors import METRICS, normalize_rows
+
+# ==============================================================================
+
+class HnswIndex():
+    """
+    This class is an HNSW graph over the rows of a float32 matrix, per
+    Malkov and Yashunin.  Each node links to at most m neighbors on the
+    upper levels and 2 * m on level 0, chosen with the neighbor selection
+    heuristic; ef_construction and ef_search are the candidate list sizes of
+    the build and of the searches.  The defaults are those of the Cognitive
+    Search hnsw configuration.  The candidate searches of a batch of rows
+    run concurrently against the read-only graph, and the batch is linked
+    serially; see build.  The index, including its vectors, is saved to and
+    loaded from a single .npz file.
+    """
+    def __init__(self, matrix, metric: str = 'cosine', m: int = 4, ef_construction: int = 400, seed: int = 42):
+        if metric not in METRICS:
+            raise ValueError(f'invalid metric: {metric}')
+        self.metric = metric
+        self.matrix = normalize_rows(matrix) if metric == 'cosine' else np.ascontiguousarray(matrix, dtype=np.float32)
+        self.row_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+        self.m = max(2, int(m))
+        self.m0 = 2 * self.m
+        self.ef_construction = max(int(ef_construction), self.m)
+        self.seed = int(seed)
+        self.levels = np.zeros(len(self.matrix), dtype=np.int32)
+        self.links = list()  # per level, a dict of node -> list of neighbor nodes
+        self.entry = -1
+        self.build_seconds = 0.0
+
+    def distances(self, vector, rows) -> np.ndarray:
+        """
+        Return the distances of the given rows to the given vector; smaller is
+        closer.  These are the negated inner products for cosine and ip, and
+        the squared distances for l2.
+        """
+        dots = self.matrix[rows] @ vector
+        if self.metric == 'l2':
+            return self.row_norms[rows] - 2.0 * dots + float(vector @ vector)
+        return -dots
+
+    def build(self, max_workers: int = None, batch_size: int = 64):
+        """
+        Assign the random levels, and insert all rows; return self.  With more
+        than one worker the rows are inserted in batches of batch_size, in two
+        phases: the candidate neighbors of the batch rows are searched
+        concurrently in the graph as it was before the batch, which is only
+        read, then the batch rows are linked serially in row order, each also
+        considering the batch rows linked before it.  With one worker the rows
+        are searched and linked one at a time.
+        """
+        t1 = time.perf_counter()
+        row_count = len(self.matrix)
+        rng = np.random.default_rng(self.seed)
+        uniform = 1.0 - rng.random(row_count)  # in (0, 1]
+        self.levels = np.floor(-np.log(uniform) / math.log(self.m)).astype(np.int32)
+        self.links = [dict() for _ in range(int(self.levels.max()) + 1 if row_count > 0 else 0)]
+        for node, level in enumerate(self.levels.tolist()):
+            for lc in range(level + 1):
+                self.links[lc][node] = list()
+        self.build_seconds = 0.0
+        if row_count == 0:
+            return self
+        # the first node of the top level is the fixed entry point of the graph
+        self.entry = int(np.argmax(self.levels))
+        nodes = [node for node in range(row_count) if node != self.entry]
+        max_workers = max_workers or os.cpu_count() or 1
+        if max_workers == 1:
+            for node in nodes:
+                self.link(node, self.search_candidates(node), [])
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                for start in range(0, len(nodes), batch_size):
+                    batch = nodes[start:start + batch_size]
+                    candidate_sets = list(pool.map(self.search_candidates, batch))
+                    for idx, node in enumerate(batch):
+                        self.link(node, candidate_sets[idx], batch[:idx])
+        self.build_seconds = time.perf_counter() - t1
+        return self
+
+    def max_level(self) -> int:
+        return int(self.levels[self.entry]) if self.entry >= 0 else -1
+
+    def search_candidates(self, node: int) -> dict:
+        """
+        Return a dict of level -> the (distance, node) candidate neighbors of
+        the given node on each of its levels, nearest first, searched in the
+        current graph without modifying it.
+        """
+        vector = self.matrix[node]
+        level = int(self.levels[node])
+        entry_points = [self.entry]
+        for lc in range(self.max_level(), level, -1):
+            entry_points = [self.search_layer(vector, entry_points, 1, lc)[0][1]]
+        candidate_sets = dict()
+        for lc in range(min(level, self.max_level()), -1, -1):
+            candidates = [(d, e) for d, e in self.search_layer(vector, entry_points, self.ef_construction, lc) if e != node]
+            candidate_sets[lc] = candidates
+            if len(candidates) > 0:
+                entry_points = [e for _, e in candidates]
+        return candidate_sets
+
+    def link(self, node: int, candidate_sets: dict, batch_nodes: list[int]) -> None:
+        """
+        Link the given node to its selected neighbors on each level, and the
+        neighbors back to it, pruning their links with the heuristic.  The
+        given batch_nodes, linked after the candidates were searched, are
+        added to the candidates of their levels.
+        """
+        vector = self.matrix[node]
+        for lc, candidates in candidate_sets.items():
+            extra = [n for n in batch_nodes if self.levels[n] >= lc]
+            if len(extra) > 0:
+                extra_candidates = zip(self.distances(vector, extra).tolist(), extra)
+                candidates = sorted(set(candidates).union(extra_candidates))[:self.ef_construction]
+            neighbors = [e for _, e in self.select_neighbors(candidates, self.m)]
+            self.links[lc][node] = list(neighbors)
+            max_links = self.m0 if lc == 0 else self.m
+            for e in neighbors:
+                e_links = self.links[lc][e]
+                if node in e_links:
+                    continue
+                if len(e_links) < max_links:
+                    e_links.append(node)
+                else:
+                    e_links = e_links + [node]
+                    e_candidates = sorted(zip(self.distances(self.matrix[e], e_links).tolist(), e_links))
+                    self.links[lc][e] = [n for _, n in self.select_neighbors(e_candidates, max_links)]
+
+    def search_layer(self, vector, entry_points: list[int], ef: int, level: int) -> list[tuple[float, int]]:
+        """ Return the (distance, node) tuples of the ef nodes of the level nearest to the vector, nearest first. """
+        visited = set(entry_points)
+        dists = self.distances(vector, entry_points).tolist()
+        candidates = list(zip(dists, entry_points))
+        heapq.heapify(candidates)
+        results = [(-d, e) for d, e in candidates]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+        links = self.links[level]
+        while len(candidates) > 0:
+            d, c = heapq.heappop(candidates)
+            if d > -results[0][0] and len(results) >= ef:
+                break
+            neighbors = [n for n in links[c] if n not in visited]
+            if len(neighbors) == 0:
+                continue
+            visited.update(neighbors)
+            for nd, n in zip(self.distances(vector, neighbors).tolist(), neighbors):
+                if len(results) < ef or nd < -results[0][0]:
+                    heapq.heappush(candidates, (nd, n))
+                    heapq.heappush(results, (-nd, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted((-d, e) for d, e in results)
+
+    def select_neighbors(self, candidates: list[tuple[float, int]], count: int) -> list[tuple[float, int]]:
+        """
+        Return up to count of the given (distance, node) candidates, nearest
+        first, with the heuristic: a candidate is kept only if it is closer
+        to the base than to every kept neighbor, so that the links spread in
+        different directions.  The pruned candidates fill any remaining slots.
+        """
+        selected, pruned = list(), list()
+        for d, e in candidates:
+            if len(selected) >= count:
+                break
+            if len(selected) == 0 or not (self.distances(self.matrix[e], [s for _, s in selected]) < d).any():
+                selected.append((d, e))
+            else:
+                pruned.append((d, e))
+        return selected + pruned[:count - len(selected)]
+
+    def search(self, queries, k: int = 10, ef_search: int = 500):
+        """
+        Return the (rows, scores) arrays, of shape (len(queries), k), of the
+        approximate k nearest rows of each query, as in VectorIndex.search;
+        rows are -1 where fewer than k were found.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.metric == 'cosine':
+            queries = normalize_rows(queries)
+        all_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        all_scores = np.zeros((len(queries), k), dtype=np.float32)
+        if self.entry < 0:
+            return all_rows, all_scores
+        for qidx, vector in enumerate(queries):
+            entry_points = [self.entry]
+            for lc in range(self.max_level(), 0, -1):
+                entry_points = [self.search_layer(vector, entry_points, 1, lc)[0][1]]
+            found = self.search_layer(vector, entry_points, max(int(ef_search), k), 0)[:k]
+            for idx, (d, e) in enumerate(found):
+                all_rows[qidx, idx] = e
+                all_scores[qidx, idx] = d if self.metric == 'l2' else -d
+        return all_rows, all_scores
+
+    def save(self, outfile: str) -> None:
+        """
+        Write the index to a single .npz file: the vectors and levels, the
+        level 0 links padded with -1, and the links of the upper levels as
+        counts and neighbors, per level and node.
+        """
+        level0 = np.full((len(self.matrix), self.m0), -1, dtype=np.int32)
+        if len(self.links) > 0:
+            for node, neighbors in self.links[0].items():
+                level0[node, :len(neighbors)] = neighbors
+        upper_counts, upper_neighbors = list(), list()
+        for lc in range(1, len(self.links)):
+            for node in sorted(self.links[lc].keys()):
+                upper_counts.append(len(self.links[lc][node]))
+                upper_neighbors.extend(self.links[lc][node])
+        np.savez(outfile, matrix=self.matrix, metric=self.metric, m=self.m, ef_construction=self.ef_construction,
+            seed=self.seed, levels=self.levels, entry=self.entry, build_seconds=self.build_seconds, level0=level0,
+            upper_counts=np.asarray(upper_counts, dtype=np.int32), upper_neighbors=np.asarray(upper_neighbors, dtype=np.int32))
+
+    @classmethod
+    def load(cls, infile: str):
+        data = np.load(infile)
+        index = HnswIndex(data['matrix'], str(data['metric']), int(data['m']), int(data['ef_construction']), int(data['seed']))
+        index.levels = data['levels']
+        index.entry = int(data['entry'])
+        index.build_seconds = float(data['build_seconds'])
+        index.links = [dict() for _ in range(index.max_level() + 1)]
+        for node, row in enumerate(data['level0'].tolist()):
+            index.links[0][node] = [n for n in row if n >= 0]
+        counts, neighbors = data['upper_counts'].tolist(), data['upper_neighbors'].tolist()
+        offset, idx = 0, 0
+        for lc in range(1, len(index.links)):
+            for node in np.flatnonzero(index.levels >= lc).tolist():
+                index.links[lc][node] = neighbors[offset:offset + counts[idx]]
+                offset, idx = offset + counts[idx], idx + 1
+        return index
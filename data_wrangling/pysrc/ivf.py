@@ -0,0 +1,146 @@
+"""
+Module ivf.py - a local inverted file (IVF) approximate nearest neighbors
+index, as in the vector-ivf cosmosSearch index of Cosmos DB Mongo vCore.
+
+Usage:  from pysrc.ivf import IvfIndex, kmeans
+"""
+
+import numpy as np
+
+from pysrc.vectors import METRICS, normalize_rows, top_k_rows
+
+# ==============================================================================
+
+def kmeans(matrix, k: int, iterations: int = 20, spherical: bool = True, seed: int = 42,
+        block_size: int = 4096) -> np.ndarray:
+    """
+    Return the (k, dimensions) float32 centroids of Lloyd's k-means of the
+    given matrix rows, initialized with a seeded sample of the rows.  The
+    spherical variant assigns by inner product and normalizes the centroids,
+    for cosine similarity; otherwise rows are assigned by L2 distance.
+    Empty clusters are reseeded with the rows farthest from their centroid.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    k = max(1, min(int(k), len(matrix)))
+    centroids = matrix[rng.choice(len(matrix), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments, scores = assign(matrix, centroids, spherical, block_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, matrix)
+        counts = np.bincount(assignments, minlength=k)
+        empty = np.flatnonzero(counts == 0)
+        nonempty = counts > 0
+        sums[nonempty] = sums[nonempty] / counts[nonempty, None]
+        if len(empty) > 0:
+            sums[empty] = matrix[np.argsort(scores, kind='stable')[:len(empty)]]
+        centroids = normalize_rows(sums) if spherical else sums
+    return centroids
+
+def assign(matrix, centroids, spherical: bool = True, block_size: int = 4096):
+    """
+    Return the nearest centroid of each row, and its score: the inner
+    product if spherical, else the negated squared L2 distance.
+    """
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    assignments = np.zeros(len(matrix), dtype=np.int64)
+    best = np.zeros(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), block_size):
+        block = np.asarray(matrix[start:start + block_size], dtype=np.float32)
+        scores = block @ centroids.T
+        if not spherical:
+            scores = 2.0 * scores - centroid_norms[None, :] - np.einsum('ij,ij->i', block, block)[:, None]
+        assignments[start:start + len(block)] = np.argmax(scores, axis=1)
+        best[start:start + len(block)] = scores.max(axis=1)
+    return assignments, best
+
+class IvfIndex():
+    """
+    This class partitions the rows of a matrix into num_lists inverted lists
+    by a k-means coarse quantizer.  The rows are stored contiguously in list
+    order, with the list offsets, so a search scores the nprobe lists whose
+    centroids are nearest to the query as contiguous slices.  The index is
+    saved to and loaded from a single .npz file.
+    """
+    def __init__(self, matrix, num_lists: int, metric: str = 'cosine'):
+        if metric not in METRICS:
+            raise ValueError(f'invalid metric: {metric}')
+        self.metric = metric
+        self.num_lists = int(num_lists)
+        self.matrix = normalize_rows(matrix) if metric == 'cosine' else np.ascontiguousarray(matrix, dtype=np.float32)
+        self.centroids = None
+        self.rows = None     # the original row ids, in list order
+        self.vectors = None  # the vectors, in list order
+        self.offsets = None  # list i is vectors[offsets[i]:offsets[i + 1]]
+        self.row_norms = None
+
+    def train(self, iterations: int = 20, seed: int = 42):
+        """ Train the coarse quantizer, and build the inverted lists; return self. """
+        spherical = self.metric != 'l2'
+        self.centroids = kmeans(self.matrix, self.num_lists, iterations, spherical, seed)
+        self.num_lists = len(self.centroids)
+        assignments, _ = assign(self.matrix, self.centroids, spherical)
+        self.rows = np.argsort(assignments, kind='stable')
+        self.vectors = np.ascontiguousarray(self.matrix[self.rows])
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=self.num_lists))])
+        self.row_norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+        return self
+
+    def list_sizes(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def search(self, queries, k: int = 10, nprobe: int = 1):
+        """
+        Return the (rows, scores) arrays, of shape (len(queries), k), of the
+        approximate k nearest rows of each query, as in VectorIndex.search;
+        rows are -1 where the probed lists hold fewer than k rows.  Each
+        probed list is scored once, with one matmul for all the queries which
+        probe it, and merged into the running top-k of those queries.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.metric == 'cosine':
+            queries = normalize_rows(queries)
+        nprobe = max(1, min(int(nprobe), self.num_lists))
+        spherical = self.metric != 'l2'
+        coarse = queries @ self.centroids.T
+        if not spherical:
+            coarse = 2.0 * coarse - np.einsum('ij,ij->i', self.centroids, self.centroids)[None, :]
+        probes, _ = top_k_rows(coarse, nprobe)
+        query_norms = np.einsum('ij,ij->i', queries, queries)
+        all_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for lidx in np.unique(probes).tolist():
+            start, end = int(self.offsets[lidx]), int(self.offsets[lidx + 1])
+            if end == start:
+                continue
+            qids = np.flatnonzero((probes == lidx).any(axis=1))
+            scores = queries[qids] @ self.vectors[start:end].T
+            if self.metric == 'l2':
+                scores = 2.0 * scores - self.row_norms[None, start:end] - query_norms[qids, None]
+            ids, top = top_k_rows(scores, min(k, end - start))
+            merged_rows = np.concatenate([all_rows[qids], self.rows[start + ids]], axis=1)
+            merged_scores = np.concatenate([all_scores[qids], top], axis=1)
+            ids, top = top_k_rows(merged_scores, k)
+            all_rows[qids] = np.take_along_axis(merged_rows, ids, axis=1)
+            all_scores[qids] = top
+        all_rows[~np.isfinite(all_scores)] = -1
+        all_scores[~np.isfinite(all_scores)] = 0.0
+        if self.metric == 'l2':
+            all_scores = -all_scores
+        return all_rows, all_scores
+
+    def save(self, outfile: str) -> None:
+        np.savez(outfile, metric=self.metric, centroids=self.centroids, rows=self.rows,
+            vectors=self.vectors, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, infile: str):
+        data = np.load(infile)
+        index = IvfIndex(np.zeros((0, data['vectors'].shape[1]), dtype=np.float32), len(data['centroids']), str(data['metric']))
+        index.centroids = data['centroids']
+        index.rows = data['rows']
+        index.vectors = data['vectors']
+        index.offsets = data['offsets']
+        index.row_norms = np.einsum('ij,ij->i', index.vectors, index.vectors)
+        index.matrix = index.vectors[np.argsort(index.rows)]
+        return index
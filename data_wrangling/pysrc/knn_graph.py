@@ -0,0 +1,108 @@
+"""
+Module knn_graph.py - the all-pairs k-nearest-neighbors graph of the
+embeddings matrix, computed with blocked matrix multiplications, and its
+compact memory-mapped adjacency file.
+
+Usage:  from pysrc.knn_graph import KnnGraph
+"""
+
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from pysrc.vectors import METRICS, normalize_rows, top_k_rows
+
+# ==============================================================================
+
+KNN_GRAPH_MAGIC = b'KNNG'
+KNN_GRAPH_VERSION = 1
+KNN_GRAPH_HEADER_BYTES = 32
+
+class KnnGraph():
+    """
+    This class holds the k nearest neighbors of every row of a matrix, as an
+    (n, k) int32 array of neighbor rows and an (n, k) float16 array of their
+    scores, best first; a row is not its own neighbor.  The adjacency file is
+    a 32 byte header followed by the two arrays, and is memory-mapped on
+    load, so the neighbors of a row are an O(1) slice of the file.
+    """
+    def __init__(self, neighbors, scores, metric: str):
+        self.neighbors = neighbors
+        self.scores = scores
+        self.metric = metric
+
+    @classmethod
+    def build(cls, matrix, k: int, metric: str = 'cosine', max_workers: int = None,
+            max_block_bytes: int = 256 * 1024 * 1024):
+        """
+        Return the KnnGraph of the given matrix.  Blocks of rows are scored
+        against the whole matrix concurrently, by max_workers threads (numpy
+        releases the GIL in the matmul and partition), and the score blocks
+        in flight are bounded to about max_block_bytes in total.
+        """
+        if metric not in METRICS:
+            raise ValueError(f'invalid metric: {metric}')
+        matrix = normalize_rows(matrix) if metric == 'cosine' else np.ascontiguousarray(matrix, dtype=np.float32)
+        row_count = len(matrix)
+        if row_count < 2 or int(k) < 1:
+            raise ValueError(f'a knn graph requires at least 2 rows and k >= 1; rows: {row_count}, k: {k}')
+        k = min(int(k), row_count - 1)
+        row_norms = np.einsum('ij,ij->i', matrix, matrix) if metric == 'l2' else None
+        max_workers = max_workers or os.cpu_count() or 1
+        block_size = max(1, min(row_count, int(max_block_bytes // (max_workers * row_count * 4))))
+        neighbors = np.zeros((row_count, k), dtype=np.int32)
+        scores = np.zeros((row_count, k), dtype=np.float16)
+
+        def build_block(start):
+            block = matrix[start:start + block_size]
+            block_scores = block @ matrix.T
+            if metric == 'l2':
+                block_scores *= 2.0
+                block_scores -= row_norms[None, :]
+                block_scores -= row_norms[start:start + len(block), None]
+            block_scores[np.arange(len(block)), np.arange(start, start + len(block))] = -np.inf
+            rows, top = top_k_rows(block_scores, k)
+            neighbors[start:start + len(block)] = rows
+            scores[start:start + len(block)] = -top if metric == 'l2' else top
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(build_block, range(0, row_count, block_size)))
+        return KnnGraph(neighbors, scores, metric)
+
+    def row_count(self) -> int:
+        return int(self.neighbors.shape[0])
+
+    def k(self) -> int:
+        return int(self.neighbors.shape[1])
+
+    def lookup(self, row: int):
+        """ Return the (neighbor rows, scores) of the given row, best first. """
+        return self.neighbors[row], self.scores[row]
+
+    def save(self, outfile: str) -> int:
+        """ Write the adjacency file; return its size in bytes. """
+        header = np.zeros(KNN_GRAPH_HEADER_BYTES, dtype=np.uint8)
+        header[:4] = np.frombuffer(KNN_GRAPH_MAGIC, dtype=np.uint8)
+        header[4:20] = np.array([KNN_GRAPH_VERSION, self.row_count(), self.k(), METRICS.index(self.metric)],
+            dtype='<u4').view(np.uint8)
+        with open(outfile, 'wb') as f:
+            f.write(header.tobytes())
+            f.write(np.ascontiguousarray(self.neighbors, dtype='<i4').tobytes())
+            f.write(np.ascontiguousarray(self.scores, dtype='<f2').tobytes())
+        return os.path.getsize(outfile)
+
+    @classmethod
+    def load(cls, infile: str):
+        """ Memory-map the given adjacency file; return a KnnGraph. """
+        header = np.fromfile(infile, dtype=np.uint8, count=KNN_GRAPH_HEADER_BYTES)
+        if header[:4].tobytes() != KNN_GRAPH_MAGIC:
+            raise ValueError(f'not a knn graph file: {infile}')
+        version, row_count, k, metric = header[4:20].view('<u4').tolist()
+        if version != KNN_GRAPH_VERSION:
+            raise ValueError(f'unsupported knn graph version: {version}')
+        neighbors = np.memmap(infile, dtype='<i4', mode='r', offset=KNN_GRAPH_HEADER_BYTES, shape=(row_count, k))
+        scores_offset = KNN_GRAPH_HEADER_BYTES + row_count * k * 4
+        scores = np.memmap(infile, dtype='<f2', mode='r', offset=scores_offset, shape=(row_count, k))
+        return KnnGraph(neighbors, scores, METRICS[metric])
@@ -0,0 +1,214 @@
+"""
+Module pipeline.py - an in-memory dependency graph of wrangling stages,
+with a content-hash cache of the stage results.
+
+Usage:  from pysrc.pipeline import Pipeline, StageCache
+"""
+
+import glob
+import hashlib
+import inspect
+import json
+import os
+import time
+import traceback
+
+import pandas as pd
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# ==============================================================================
+
+def timed_call(func, args):
+    """ Invoke the given stage function in a worker process, return (result, seconds, pid). """
+    t1 = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t1, os.getpid()
+
+class PipelineStage():
+    """
+    This class is a named node in a Pipeline.  The results of the dependency
+    stages are passed, in order, as the positional args of the stage function.
+    """
+    def __init__(self, name: str, func, deps: list[str], inputs: list[str], code: list, params: dict, cache: bool):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.code = list(code)
+        self.params = dict(params)
+        self.cache = cache
+        self.fingerprint = None
+        self.cache_status = None
+        self.seconds = 0.0
+        self.pid = None
+
+class StageCache():
+    """
+    This class stores DataFrame stage results as Parquet files named by the
+    stage name and fingerprint, so that an unchanged stage can be skipped.
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.file_hashes = dict()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def fingerprint(self, stage: PipelineStage, dep_fingerprints: list[str]) -> str:
+        """
+        Return the sha256 of the stage name, the source code of the stage
+        function and its code helpers, the params, the content of the input
+        files, and the fingerprints of the dependency stages.
+        """
+        h = hashlib.sha256()
+        h.update(stage.name.encode('utf-8'))
+        for func in [stage.func] + stage.code:
+            h.update(inspect.getsource(func).encode('utf-8'))
+        h.update(json.dumps(stage.params, sort_keys=True, default=str).encode('utf-8'))
+        for infile in stage.inputs:
+            h.update(infile.encode('utf-8'))
+            h.update(self.file_hash(infile).encode('utf-8'))
+        for dep_fingerprint in dep_fingerprints:
+            h.update(dep_fingerprint.encode('utf-8'))
+        return h.hexdigest()
+
+    def file_hash(self, infile: str) -> str:
+        """ Return the sha256 of the given file content, computed once per file. """
+        if infile not in self.file_hashes:
+            h = hashlib.sha256()
+            with open(infile, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(chunk)
+            self.file_hashes[infile] = h.hexdigest()
+        return self.file_hashes[infile]
+
+    def path(self, name: str, fingerprint: str) -> str:
+        return os.path.join(self.cache_dir, f'{name}-{fingerprint[:16]}.parquet')
+
+    def contains(self, name: str, fingerprint: str) -> bool:
+        return os.path.isfile(self.path(name, fingerprint))
+
+    def load(self, name: str, fingerprint: str) -> pd.DataFrame:
+        return pd.read_parquet(self.path(name, fingerprint))
+
+    def store(self, name: str, fingerprint: str, df: pd.DataFrame) -> None:
+        """ Write the given stage result, and remove the stale results of the stage. """
+        outfile = self.path(name, fingerprint)
+        for stale_file in glob.glob(os.path.join(self.cache_dir, f'{name}-*.parquet')):
+            if stale_file != outfile:
+                os.remove(stale_file)
+        df.to_parquet(outfile)
+
+class Pipeline():
+    """
+    This class runs a dependency graph of stage functions in a process pool.
+    Independent stages run concurrently, and stage results are handed to the
+    dependent stages in memory rather than through intermediate files.
+    """
+    def __init__(self, max_workers: int = None, cache_dir: str = None):
+        self.stages = dict()
+        self.results = dict()
+        self.max_workers = max_workers
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = StageCache(cache_dir)
+        self.elapsed = 0.0
+
+    def add_stage(self, name: str, func, deps: list[str] = [], inputs: list[str] = [],
+            code: list = [], params: dict = {}, cache: bool = True) -> None:
+        """
+        Add the named stage; deps is the list of stage names it depends on.
+        The inputs files, code helper functions, and params are fingerprinted
+        along with the stage function to determine if a cached result is valid.
+        Stages with cache=True must return a DataFrame.
+        """
+        self.stages[name] = PipelineStage(name, func, deps, inputs, code, params, cache)
+
+    def stage_order(self) -> list[str]:
+        """ Return the stage names in a dependency-respecting order; raise on cycles. """
+        order, state = [], dict()
+
+        def visit(name, path):
+            if name not in self.stages:
+                raise Exception(f'unknown pipeline stage: {name}, required by: {path}')
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise Exception(f'pipeline stage cycle: {path + [name]}')
+            state[name] = 'visiting'
+            for dep in self.stages[name].deps:
+                visit(dep, path + [name])
+            state[name] = 'done'
+            order.append(name)
+
+        for name in self.stages.keys():
+            visit(name, [])
+        return order
+
+    def run(self) -> dict:
+        """ Run all stages, return a dict of stage name -> result. """
+        order = self.stage_order()
+        self.resolve_cache_status(order)
+        pending = [name for name in order if self.stages[name].cache_status != 'hit']
+        running = dict()
+        max_workers = self.max_workers or max(1, min(len(pending), os.cpu_count() or 1))
+        t1 = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            while len(pending) > 0 or len(running) > 0:
+                for name in list(pending):
+                    stage = self.stages[name]
+                    if all(self.is_available(dep) for dep in stage.deps):
+                        args = [self.result(dep) for dep in stage.deps]
+                        running[executor.submit(timed_call, stage.func, args)] = name
+                        pending.remove(name)
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        result, seconds, pid = future.result()
+                    except Exception:
+                        print(f'pipeline stage failed: {name}')
+                        print(traceback.format_exc())
+                        raise
+                    stage = self.stages[name]
+                    stage.seconds = seconds
+                    stage.pid = pid
+                    self.results[name] = result
+                    if stage.cache_status == 'miss':
+                        self.cache.store(name, stage.fingerprint, result)
+                    print(f'pipeline stage completed: {name} in {seconds:.3f}s, cache {stage.cache_status}')
+        self.elapsed = time.perf_counter() - t1
+        return self.results
+
+    def resolve_cache_status(self, order: list[str]) -> None:
+        """ Fingerprint each stage, and set its cache_status to hit, miss, or off. """
+        for name in order:
+            stage = self.stages[name]
+            stage.cache_status = 'off'
+            if self.cache is not None:
+                dep_fingerprints = [self.stages[dep].fingerprint for dep in stage.deps]
+                stage.fingerprint = self.cache.fingerprint(stage, dep_fingerprints)
+                if stage.cache:
+                    if self.cache.contains(name, stage.fingerprint):
+                        stage.cache_status = 'hit'
+                    else:
+                        stage.cache_status = 'miss'
+
+    def is_available(self, name: str) -> bool:
+        return name in self.results or self.stages[name].cache_status == 'hit'
+
+    def result(self, name: str):
+        """ Return the result of the named stage, loading it from the cache if necessary. """
+        if name not in self.results:
+            self.results[name] = self.cache.load(name, self.stages[name].fingerprint)
+        return self.results[name]
+
+    def report(self) -> list[dict]:
+        """ Print and return the per-stage timings of the last run. """
+        rows = list()
+        for name in self.stage_order():
+            stage = self.stages[name]
+            rows.append(dict(stage=name, deps=stage.deps, cache=stage.cache_status,
+                seconds=round(stage.seconds, 4), pid=stage.pid))
+            print(f'  {name:24} {stage.seconds:8.3f}s  cache: {stage.cache_status:4}  pid: {stage.pid}  deps: {",".join(stage.deps)}')
+        print(f'  {"total elapsed":24} {self.elapsed:8.3f}s')
+        return rows
@@ -0,0 +1,140 @@
+"""
+Module pq.py - a product quantization (PQ) index of the embeddings, with
+asymmetric distance computation (ADC) and an optional exact re-rank of the
+candidates from the memory-mapped float32 embeddings matrix.
+
+Usage:  from pysrc.pq import PqIndex
+"""
+
+import numpy as np
+
+from pysrc.ivf import assign, kmeans
+from pysrc.vectors import METRICS, normalize_rows, top_k_rows
+
+# ==============================================================================
+
+PQ_CENTROIDS = 256  # per subspace, so that each code is one uint8
+
+class PqIndex():
+    """
+    This class splits the vector dimensions into subspaces, trains a k-means
+    sub-quantizer of 256 centroids per subspace, and stores each row as one
+    uint8 code per subspace; 32 subspaces of the 1536 dimensions are 32
+    bytes per player.  A query is scored against all codes with ADC: the
+    query's per-subspace lookup table of inner products (or squared L2
+    distances) to the centroids is summed over the codes of each row.  The
+    ADC candidates may be re-ranked with the exact vectors of a memory-mapped
+    float32 .npy file with the same rows, such as the embeddings sidecar.
+    """
+    def __init__(self, subspaces: int = 32, metric: str = 'cosine'):
+        if metric not in METRICS:
+            raise ValueError(f'invalid metric: {metric}')
+        self.subspaces = int(subspaces)
+        self.metric = metric
+        self.centroids = None  # (subspaces, 256, dimensions / subspaces)
+        self.codes = None      # (rows, subspaces) uint8
+        self.rerank_matrix = None
+
+    def prepare(self, matrix) -> np.ndarray:
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.shape[1] % self.subspaces != 0:
+            raise ValueError(f'{matrix.shape[1]} dimensions are not divisible into {self.subspaces} subspaces')
+        return normalize_rows(matrix) if self.metric == 'cosine' else matrix
+
+    def subspace(self, matrix, s: int) -> np.ndarray:
+        width = matrix.shape[1] // self.subspaces
+        return np.ascontiguousarray(matrix[:, s * width:(s + 1) * width])
+
+    def train(self, matrix, iterations: int = 20, seed: int = 42):
+        """ Train the sub-quantizers on the given matrix, and encode its rows; return self. """
+        matrix = self.prepare(matrix)
+        centroids = list()
+        for s in range(self.subspaces):
+            sub_centroids = kmeans(self.subspace(matrix, s), PQ_CENTROIDS, iterations, False, seed + s)
+            if len(sub_centroids) < PQ_CENTROIDS:
+                # fewer rows than centroids; pad with unused copies
+                sub_centroids = np.concatenate([sub_centroids, np.repeat(sub_centroids[:1], PQ_CENTROIDS - len(sub_centroids), axis=0)])
+            centroids.append(sub_centroids)
+        self.centroids = np.stack(centroids).astype(np.float32)
+        self.codes = self.encode(matrix)
+        return self
+
+    def encode(self, matrix) -> np.ndarray:
+        """ Return the (rows, subspaces) uint8 codes of the given matrix. """
+        matrix = self.prepare(matrix)
+        codes = np.zeros((len(matrix), self.subspaces), dtype=np.uint8)
+        for s in range(self.subspaces):
+            codes[:, s], _ = assign(self.subspace(matrix, s), self.centroids[s], False)
+        return codes
+
+    def decode(self, codes) -> np.ndarray:
+        """ Return the float32 reconstructions of the given codes. """
+        return np.concatenate([self.centroids[s][codes[:, s]] for s in range(self.subspaces)], axis=1)
+
+    def bytes_per_row(self) -> int:
+        return self.subspaces
+
+    def set_rerank_file(self, infile: str):
+        """ Memory-map the float32 .npy matrix used for the exact re-rank; return self. """
+        self.rerank_matrix = np.load(infile, mmap_mode='r')
+        return self
+
+    def lookup_tables(self, queries) -> np.ndarray:
+        """
+        Return the (queries, subspaces, 256) ADC tables; inner products of the
+        query subvectors and the centroids, or their squared L2 distances.
+        """
+        split = queries.reshape(len(queries), self.subspaces, -1)
+        tables = np.einsum('qsd,scd->qsc', split, self.centroids)
+        if self.metric == 'l2':
+            centroid_norms = np.einsum('scd,scd->sc', self.centroids, self.centroids)
+            query_norms = np.einsum('qsd,qsd->qs', split, split)
+            tables = query_norms[:, :, None] - 2.0 * tables + centroid_norms[None, :, :]
+        return tables
+
+    def search(self, queries, k: int = 10, rerank: int = 0, block_size: int = 16):
+        """
+        Return the (rows, scores) arrays, of shape (len(queries), k), of the
+        approximate k nearest rows of each query, as in VectorIndex.search.
+        If rerank > 0 and a rerank file is set, the top max(rerank, k) ADC
+        candidates are re-scored with their exact float32 vectors.
+        """
+        queries = self.prepare(np.atleast_2d(queries))
+        k = min(int(k), len(self.codes))
+        candidate_count = min(max(int(rerank), k), len(self.codes))
+        subspace_ids = np.arange(self.subspaces)[None, :]
+        all_rows = np.zeros((len(queries), k), dtype=np.int64)
+        all_scores = np.zeros((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), block_size):
+            block = queries[start:start + block_size]
+            tables = self.lookup_tables(block)
+            adc = tables[:, subspace_ids, self.codes].sum(axis=2)  # (block, rows)
+            if self.metric == 'l2':
+                adc = -adc
+            candidates, scores = top_k_rows(adc, candidate_count)
+            if rerank > 0 and self.rerank_matrix is not None:
+                for idx, query in enumerate(block):
+                    rows = np.sort(candidates[idx])  # ascending, for sequential reads of the memmap
+                    vectors = self.prepare(self.rerank_matrix[rows])
+                    exact = vectors @ query
+                    if self.metric == 'l2':
+                        exact = 2.0 * exact - np.einsum('ij,ij->i', vectors, vectors) - float(query @ query)
+                    candidates[idx], scores[idx] = rows, exact
+                ids, scores = top_k_rows(scores, k)
+                candidates = np.take_along_axis(candidates, ids, axis=1)
+            all_rows[start:start + len(block)] = candidates[:, :k]
+            all_scores[start:start + len(block)] = scores[:, :k]
+        if self.metric == 'l2':
+            all_scores = -all_scores
+        return all_rows, all_scores
+
+    def save(self, outfile: str) -> None:
+        np.savez(outfile, subspaces=self.subspaces, metric=self.metric, centroids=self.centroids, codes=self.codes)
+
+    @classmethod
+    def load(cls, infile: str):
+        data = np.load(infile)
+        index = PqIndex(int(data['subspaces']), str(data['metric']))
+        index.centroids = data['centroids']
+        index.codes = data['codes']
+        return index
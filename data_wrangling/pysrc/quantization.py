@@ -0,0 +1,140 @@
+"""
+Module quantization.py - compact int8 and float16 encodings of the
+embeddings matrix, their dequantization, and top-k search scored directly
+on the encoded rows.
+
+Usage:  from pysrc.quantization import Float16Encoding, Int8Encoding, encoded_top_k, load_encoding
+"""
+
+import numpy as np
+
+from pysrc.vectors import METRICS, top_k_rows
+
+# ==============================================================================
+
+ENCODINGS = ['int8', 'float16']
+
+class Int8Encoding():
+    """
+    This class encodes float32 vectors as int8 codes with a per-dimension
+    scale and offset, fitted to the min and max of each dimension, so that
+    x ~= code * scale + offset.  Inner products are computed on the codes by
+    folding the scale into the query and adding the query . offset term.
+    """
+    name = 'int8'
+
+    def __init__(self, scale=None, offset=None):
+        self.scale = scale
+        self.offset = offset
+
+    def fit(self, matrix, block_size: int = 4096):
+        """ Fit the per-dimension scale and offset to the given matrix; return self. """
+        matrix = np.asarray(matrix)
+        lo = np.full(matrix.shape[1], np.inf)
+        hi = np.full(matrix.shape[1], -np.inf)
+        for start in range(0, len(matrix), block_size):
+            block = np.asarray(matrix[start:start + block_size], dtype=np.float64)
+            lo, hi = np.minimum(lo, block.min(axis=0)), np.maximum(hi, block.max(axis=0))
+        scale = (hi - lo) / 255.0
+        scale[scale == 0] = 1.0
+        self.scale = scale.astype(np.float32)
+        self.offset = (lo + 128.0 * scale).astype(np.float32)
+        return self
+
+    def encode(self, matrix, block_size: int = 4096) -> np.ndarray:
+        matrix = np.asarray(matrix)
+        codes = np.zeros(matrix.shape, dtype=np.int8)
+        for start in range(0, len(matrix), block_size):
+            block = np.asarray(matrix[start:start + block_size], dtype=np.float32)
+            codes[start:start + len(block)] = np.clip(np.rint((block - self.offset) / self.scale), -128, 127)
+        return codes
+
+    def decode(self, codes) -> np.ndarray:
+        """ Return the dequantized float32 vectors of the given codes. """
+        return np.asarray(codes, dtype=np.float32) * self.scale + self.offset
+
+    def inner_products(self, codes, queries, block_size: int = 4096) -> np.ndarray:
+        """ Return the (len(queries), len(codes)) inner products of the queries and the decoded rows. """
+        queries = np.asarray(queries, dtype=np.float32)
+        scaled_queries = (queries * self.scale).T
+        products = np.zeros((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), block_size):
+            block = np.asarray(codes[start:start + block_size], dtype=np.float32)
+            products[:, start:start + len(block)] = (block @ scaled_queries).T
+        return products + (queries @ self.offset)[:, None]
+
+    def save(self, outfile: str) -> None:
+        np.savez(outfile, name=self.name, scale=self.scale, offset=self.offset)
+
+class Float16Encoding():
+    """ This class encodes float32 vectors as float16; it has no fitted parameters. """
+    name = 'float16'
+
+    def fit(self, matrix):
+        return self
+
+    def encode(self, matrix) -> np.ndarray:
+        return np.asarray(matrix, dtype=np.float16)
+
+    def decode(self, codes) -> np.ndarray:
+        return np.asarray(codes, dtype=np.float32)
+
+    def inner_products(self, codes, queries, block_size: int = 4096) -> np.ndarray:
+        """ Return the (len(queries), len(codes)) inner products, converting blocks of rows to float32. """
+        queries = np.asarray(queries, dtype=np.float32)
+        products = np.zeros((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), block_size):
+            block = np.asarray(codes[start:start + block_size], dtype=np.float32)
+            products[:, start:start + len(block)] = queries @ block.T
+        return products
+
+    def save(self, outfile: str) -> None:
+        np.savez(outfile, name=self.name)
+
+def load_encoding(infile: str):
+    """ Return the Int8Encoding or Float16Encoding saved in the given .npz file. """
+    data = np.load(infile)
+    if str(data['name']) == 'int8':
+        return Int8Encoding(data['scale'], data['offset'])
+    return Float16Encoding()
+
+def squared_norms(encoding, codes, block_size: int = 4096) -> np.ndarray:
+    """ Return the squared L2 norms of the decoded rows of the given codes. """
+    norms = np.zeros(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), block_size):
+        block = encoding.decode(codes[start:start + block_size])
+        norms[start:start + len(block)] = np.einsum('ij,ij->i', block, block)
+    return norms
+
+def encoded_top_k(encoding, codes, queries, k: int, metric: str = 'cosine', exclude=None,
+        row_norms=None, block_size: int = 256):
+    """
+    Return the (ids, scores) of the k encoded rows nearest to each float32
+    query, best first, as in vectors.exact_top_k.  The rows are never
+    decoded as a whole; pass the squared_norms of the codes as row_norms to
+    reuse them across calls.
+    """
+    if metric not in METRICS:
+        raise ValueError(f'invalid metric: {metric}')
+    queries = np.asarray(queries, dtype=np.float32)
+    if row_norms is None and metric != 'ip':
+        row_norms = squared_norms(encoding, codes)
+    k = min(int(k), len(codes) - (1 if exclude is not None else 0))
+    all_ids = np.zeros((len(queries), k), dtype=np.int64)
+    all_scores = np.zeros((len(queries), k), dtype=np.float32)
+    for start in range(0, len(queries), block_size):
+        block = queries[start:start + block_size]
+        scores = encoding.inner_products(codes, block)
+        query_norms = np.einsum('ij,ij->i', block, block)
+        if metric == 'cosine':
+            denominators = np.sqrt(query_norms)[:, None] * np.sqrt(row_norms)[None, :]
+            denominators[denominators == 0] = 1.0
+            scores = scores / denominators
+        elif metric == 'l2':
+            scores = 2.0 * scores - row_norms[None, :] - query_norms[:, None]
+        if exclude is not None:
+            scores[np.arange(len(block)), np.asarray(exclude[start:start + block_size])] = -np.inf
+        all_ids[start:start + len(block)], all_scores[start:start + len(block)] = top_k_rows(scores, k)
+    if metric == 'l2':
+        all_scores = -all_scores
+    return all_ids, all_scores
@@ -0,0 +1,100 @@
+"""
+Module vector_index.py - an exact, in-memory vector index over a contiguous
+float32 matrix, for local similarity searches of the wrangled embeddings
+without a database.
+
+Usage:  from pysrc.vector_index import VectorIndex
+"""
+
+import numpy as np
+
+from pysrc.vectors import METRICS, normalize_rows, top_k_rows
+
+# ==============================================================================
+
+class VectorIndex():
+    """
+    This class answers top-k queries over the rows of a contiguous float32
+    matrix with one matrix multiplication per block of queries, and an
+    argpartition of each row of scores.  The metric is cosine (the rows are
+    normalized once, at construction), ip (inner product), or l2 (the squared
+    row norms are computed once).  Scores are similarities for cosine and ip,
+    and squared distances for l2; results are best first.
+    """
+    def __init__(self, ids: list[str], matrix, metric: str = 'cosine'):
+        if metric not in METRICS:
+            raise ValueError(f'invalid metric: {metric}')
+        if len(ids) != len(matrix):
+            raise ValueError(f'ids and matrix rows differ: {len(ids)} {len(matrix)}')
+        self.ids = list(ids)
+        self.index = {id: row for row, id in enumerate(self.ids)}
+        self.metric = metric
+        if metric == 'cosine':
+            self.matrix = normalize_rows(matrix)
+        else:
+            self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.row_norms = np.einsum('ij,ij->i', self.matrix, self.matrix) if metric == 'l2' else None
+
+    @classmethod
+    def from_sidecar(cls, sidecar, metric: str = 'cosine'):
+        """ Return a VectorIndex of the rows of the given loaded EmbeddingsSidecar. """
+        return VectorIndex(sidecar.ids, sidecar.matrix, metric)
+
+    def size(self) -> int:
+        return len(self.ids)
+
+    def dimensions(self) -> int:
+        return int(self.matrix.shape[1])
+
+    def search(self, queries, k: int = 10, block_size: int = 1024):
+        """
+        Return the (rows, scores) arrays, of shape (len(queries), k), of the
+        k rows nearest to each of the given query vectors.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.metric == 'cosine':
+            queries = normalize_rows(queries)
+        k = min(int(k), self.size())
+        all_rows = np.zeros((len(queries), k), dtype=np.int64)
+        all_scores = np.zeros((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), block_size):
+            block = queries[start:start + block_size]
+            scores = block @ self.matrix.T
+            if self.metric == 'l2':
+                # rank by the negated squared distance, so that larger is better
+                scores = 2.0 * scores - self.row_norms[None, :] - np.einsum('ij,ij->i', block, block)[:, None]
+            all_rows[start:start + len(block)], all_scores[start:start + len(block)] = top_k_rows(scores, k)
+        if self.metric == 'l2':
+            all_scores = -all_scores
+        return all_rows, all_scores
+
+    def neighbors(self, id: str, k: int = 10) -> list[tuple[str, float]]:
+        """
+        Return the (id, score) tuples of the k rows nearest to the row of the
+        given id, which is itself included as in a database vector search.
+        """
+        rows, scores = self.search(self.matrix[self.index[id]], k)
+        return [(self.ids[row], float(score)) for row, score in zip(rows[0], scores[0])]
+
+    def search_document_like(self, id: str, documents: dict, k: int = 10) -> dict:
+        """
+        Return the output doc of a search for the documents like the given
+        id, in the {pid, player, pipeline, results} shape of the vCore
+        search_player_like output, with the embeddings removed.  Each result
+        also has its score.
+        """
+        output_doc = {}
+        output_doc['pid'] = id
+        output_doc['player'] = dict(documents.get(id, {}))
+        search = dict(path='embeddings', k=k, metric=self.metric)
+        output_doc['pipeline'] = [{'vectorIndex': search}]
+        output_doc['results'] = []
+        if id not in self.index:
+            return output_doc
+        output_doc['player']['embeddings'] = 'removed'
+        for rid, score in self.neighbors(id, k):
+            result_doc = dict(documents.get(rid, {'playerID': rid}))
+            result_doc['embeddings'] = 'removed'
+            result_doc['score'] = score
+            output_doc['results'].append(result_doc)
+        return output_doc
@@ -0,0 +1,139 @@
+"""
+Module vectors.py - NumPy helpers for the embeddings matrix: brute-force
+top-k search, recall measurement, and PCA / Gaussian random projection
+dimensionality reduction.
+
+Usage:  from pysrc.vectors import Reducer, exact_top_k, normalize_rows, recall_at_k, sample_rows, top_k_rows
+"""
+
+import numpy as np
+
+# ==============================================================================
+
+METRICS = ['cosine', 'ip', 'l2']
+
+def normalize_rows(matrix) -> np.ndarray:
+    """ Return a float32 copy of the given matrix with unit L2 norm rows; zero rows stay zero. """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def sample_rows(row_count: int, sample_count: int, seed: int = 42) -> np.ndarray:
+    """ Return a sorted, seeded random sample of row indexes. """
+    rng = np.random.default_rng(seed)
+    sample_count = min(int(sample_count), row_count)
+    return np.sort(rng.choice(row_count, size=sample_count, replace=False))
+
+def exact_top_k(matrix, queries, k: int, metric: str = 'cosine', exclude=None, block_size: int = 1024):
+    """
+    Return the (ids, scores) arrays, of shape (len(queries), k), of the k
+    rows of the given matrix nearest to each query vector, best first.  The
+    scores are similarities for cosine and ip, and squared distances for l2.
+    If exclude is given, exclude[i] is a row id to skip for query i, such as
+    the query's own row.  The queries are scored in blocks of block_size.
+    """
+    if metric not in METRICS:
+        raise ValueError(f'invalid metric: {metric}')
+    matrix = np.asarray(matrix, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    if metric == 'cosine':
+        matrix, queries = normalize_rows(matrix), normalize_rows(queries)
+    row_norms = np.einsum('ij,ij->i', matrix, matrix) if metric == 'l2' else None
+    k = min(int(k), len(matrix) - (1 if exclude is not None else 0))
+    all_ids = np.zeros((len(queries), k), dtype=np.int64)
+    all_scores = np.zeros((len(queries), k), dtype=np.float32)
+    for start in range(0, len(queries), block_size):
+        block = queries[start:start + block_size]
+        scores = block @ matrix.T
+        if metric == 'l2':
+            # rank by the negated squared distance, so that larger is better
+            scores = 2.0 * scores - row_norms[None, :] - np.einsum('ij,ij->i', block, block)[:, None]
+        if exclude is not None:
+            scores[np.arange(len(block)), np.asarray(exclude[start:start + block_size])] = -np.inf
+        all_ids[start:start + len(block)], all_scores[start:start + len(block)] = top_k_rows(scores, k)
+    if metric == 'l2':
+        all_scores = -all_scores
+    return all_ids, all_scores
+
+def top_k_rows(scores, k: int):
+    """ Return the (ids, scores) of the k largest scores of each row of the given matrix, best first. """
+    ids = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(scores, ids, axis=1)
+    order = np.argsort(-top, axis=1, kind='stable')
+    return np.take_along_axis(ids, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+def recall_at_k(truth_ids, found_ids, k: int = 10, truth_scores=None, tolerance: float = 1e-5) -> float:
+    """
+    Return the mean fraction of the true top-k ids found in the top-k found
+    ids.  If the truth_scores of more than k truth_ids are given, the ids
+    tied with the k-th true score also count as hits, so that the order of
+    identical vectors, such as those of duplicate embeddings_str values,
+    doesn't count as a miss.
+    """
+    truth_ids, found_ids = np.asarray(truth_ids), np.asarray(found_ids)[:, :k]
+    if truth_ids.size == 0:
+        return 0.0
+    hits = 0
+    for row, (truth, found) in enumerate(zip(truth_ids, found_ids)):
+        expected = truth[:k]
+        if truth_scores is not None:
+            scores = np.asarray(truth_scores[row])
+            expected = truth[:k].tolist() + truth[k:][np.abs(scores[k:] - scores[k - 1]) <= tolerance].tolist()
+        hits = hits + len(np.intersect1d(expected, found))
+    return hits / float(len(truth_ids) * k)
+
+class Reducer():
+    """
+    This class reduces vectors to a lower dimension by PCA (fitted to the
+    given matrix) or by a seeded Gaussian random projection.  The fitted
+    mean and components are saved and loaded as an .npz file.
+    """
+    def __init__(self, method: str, dimensions: int, mean=None, components=None):
+        if method not in ['pca', 'random']:
+            raise ValueError(f'invalid reduction method: {method}')
+        self.method = method
+        self.dimensions = int(dimensions)
+        self.mean = mean
+        self.components = components
+        self.explained_variance_ratio = None
+
+    def fit(self, matrix, seed: int = 42):
+        """ Fit the reduction to the given (rows, input dimensions) matrix; return self. """
+        matrix = np.asarray(matrix, dtype=np.float64)
+        input_dimensions = matrix.shape[1]
+        if self.dimensions > input_dimensions:
+            raise ValueError(f'cannot reduce {input_dimensions} dimensions to {self.dimensions}')
+        if self.method == 'pca':
+            self.mean = matrix.mean(axis=0)
+            centered = matrix - self.mean
+            # eigendecomposition of the (input dimensions)^2 covariance, largest first
+            eigenvalues, eigenvectors = np.linalg.eigh(centered.T @ centered)
+            order = np.argsort(eigenvalues)[::-1][:self.dimensions]
+            self.components = eigenvectors[:, order].T
+            total = eigenvalues.clip(min=0).sum()
+            self.explained_variance_ratio = float(eigenvalues[order].clip(min=0).sum() / total) if total > 0 else 0.0
+        else:
+            rng = np.random.default_rng(seed)
+            self.mean = np.zeros(input_dimensions)
+            self.components = rng.standard_normal((self.dimensions, input_dimensions)) / np.sqrt(self.dimensions)
+        self.mean = self.mean.astype(np.float32)
+        self.components = self.components.astype(np.float32)
+        return self
+
+    def transform(self, matrix, block_size: int = 4096) -> np.ndarray:
+        """ Return the float32 reduced vectors of the given matrix rows. """
+        matrix = np.asarray(matrix)
+        reduced = np.zeros((len(matrix), self.dimensions), dtype=np.float32)
+        for start in range(0, len(matrix), block_size):
+            block = np.asarray(matrix[start:start + block_size], dtype=np.float32)
+            reduced[start:start + len(block)] = (block - self.mean) @ self.components.T
+        return reduced
+
+    def save(self, outfile: str) -> None:
+        np.savez(outfile, method=self.method, dimensions=self.dimensions, mean=self.mean, components=self.components)
+
+    @classmethod
+    def load(cls, infile: str):
+        data = np.load(infile)
+        return Reducer(str(data['method']), int(data['dimensions']), data['mean'], data['components'])
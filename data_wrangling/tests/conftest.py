@@ -0,0 +1,7 @@
+# Chris Joakim, Microsoft, 2023
+
+import os
+import sys
+
+# The tests import the pysrc package of the data_wrangling directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
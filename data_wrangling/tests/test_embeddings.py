@@ -0,0 +1,39 @@
+# Chris Joakim, Microsoft, 2023
+
+import os
+
+from pysrc.aibundle import OpenAIClient
+from pysrc.embeddings import EmbeddingsLog, TokenBucket, text_hash
+
+# ==============================================================================
+
+def test_local_hash_log_is_not_reused_by_another_model(tmp_path):
+    logfile = os.path.join(tmp_path, 'embeddings_log.jsonl')
+    local = OpenAIClient({'type': 'local-hash', 'embedding_dimensions': 8})
+    text = 'a player embeddings_str'
+    log = EmbeddingsLog(logfile, local.embedding_model).open()
+    log.append('aaronha01', text_hash(text), local.create_embeddings([text])[0])
+    log.close()
+
+    assert list(EmbeddingsLog(logfile, local.embedding_model).read().keys()) == ['aaronha01']
+    assert EmbeddingsLog(logfile, 'text-embedding-ada-002').read() == dict()
+
+def test_log_resumes_after_a_partial_write(tmp_path):
+    logfile = os.path.join(tmp_path, 'embeddings_log.jsonl')
+    log = EmbeddingsLog(logfile, 'local-hash').open()
+    log.append('a', 'h1', [1.0, 2.0])
+    log.append('b', 'h2', [3.0, 4.0])
+    log.close()
+    os.truncate(log.vectors_file, 14)  # the vector of b is partially written
+
+    log = EmbeddingsLog(logfile, 'local-hash')
+    assert log.read() == {'a': ('h1', [1.0, 2.0])}
+    log.open()
+    log.append('c', 'h3', [5.0, 6.0])
+    log.close()
+    assert log.read() == {'a': ('h1', [1.0, 2.0]), 'c': ('h3', [5.0, 6.0])}
+
+def test_token_bucket_charges_requests_larger_than_its_capacity():
+    bucket = TokenBucket(6000)  # 100 tokens per second, capacity 1000
+    assert bucket.reserve(8191) > 71.0
+    assert bucket.reserve(1) > 71.0
@@ -0,0 +1,20 @@
+# Chris Joakim, Microsoft, 2023
+
+import numpy as np
+import pytest
+
+from pysrc.knn_graph import KnnGraph
+
+# ==============================================================================
+
+@pytest.mark.parametrize('rows,k', [(0, 5), (1, 5), (10, 0), (10, -1)])
+def test_build_rejects_too_few_rows_or_k(rows, k):
+    matrix = np.random.default_rng(42).random((rows, 8), dtype=np.float32)
+    with pytest.raises(ValueError):
+        KnnGraph.build(matrix, k)
+
+def test_build_with_two_rows():
+    matrix = np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+    graph = KnnGraph.build(matrix, 5)
+    assert graph.k() == 1
+    assert graph.neighbors[:, 0].tolist() == [1, 0]
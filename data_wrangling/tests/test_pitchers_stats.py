@@ -0,0 +1,40 @@
+# Chris Joakim, Microsoft, 2023
+
+import json
+
+import pandas as pd
+
+from bb_wrangle import PITCHING_COLS, calc_pitchers_stats_rowwise, calc_pitchers_stats_vectorized, pitchers_totals_df
+
+# ==============================================================================
+
+def pitching_frame() -> pd.DataFrame:
+    """ Return a grouped Pitching frame with the zero IPouts, W+L, and GS cases. """
+    rows = {
+        'regular01': dict(W=94, L=46, G=186, GS=176, SV=1, CG=61, SHO=20, IPouts=3864, H=1075, ER=390, HR=78, BB=352,
+            SO=1289, BAOpp=0.223, ERA=2.72, IBB=21, WP=30, HBP=21, BK=4),
+        'noouts01':  dict(W=0, L=0, G=1, GS=0, SV=0, CG=0, SHO=0, IPouts=0, H=3, ER=3, HR=1, BB=2,
+            SO=0, BAOpp=None, ERA=None, IBB=0, WP=0, HBP=0, BK=0),
+        'nodecn01':  dict(W=0, L=0, G=4, GS=1, SV=0, CG=1, SHO=0, IPouts=21, H=9, ER=5, HR=0, BB=4,
+            SO=3, BAOpp=0.3, ERA=6.43, IBB=None, WP=1, HBP=1, BK=0),
+        'reliev01':  dict(W=3, L=5, G=60, GS=0, SV=12, CG=0, SHO=0, IPouts=210, H=61, ER=29, HR=7, BB=25,
+            SO=70, BAOpp=0.241, ERA=3.73, IBB=4, WP=2, HBP=None, BK=1),
+    }
+    frame = pd.DataFrame.from_dict(rows, orient='index')[PITCHING_COLS]
+    frame.index.name = 'playerID'
+    return frame
+
+def test_rowwise_and_vectorized_pitchers_stats_are_identical():
+    totals = pitchers_totals_df(pitching_frame())
+    # the tmp/pitchers.json records of the rowwise reference implementation
+    pitchers_list = json.loads(json.dumps(totals.reset_index().to_dict(orient='records')))
+    rowwise_dict, rowwise_count = calc_pitchers_stats_rowwise(pitchers_list)
+    vectorized_dict, vectorized_count = calc_pitchers_stats_vectorized(totals)
+
+    assert rowwise_count == vectorized_count == 3
+    assert sorted(rowwise_dict.keys()) == sorted(vectorized_dict.keys())
+    for pid in rowwise_dict.keys():
+        assert rowwise_dict[pid]['calculated'] == vectorized_dict[pid]['calculated'], pid
+    assert vectorized_dict['noouts01']['calculated'] == {}
+    assert vectorized_dict['nodecn01']['calculated']['win_pct'] == 0.0
+    assert vectorized_dict['reliev01']['calculated']['cg_pct'] == 0.0
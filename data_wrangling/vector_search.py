@@ -0,0 +1,398 @@
+"""
+Usage:
+  python vector_search.py search_player_like <player_id> [cosine|ip|l2]
+  python vector_search.py search_player_like aaronha01
+  python vector_search.py search_player_like jeterde01 l2
+  python vector_search.py random_player_search
+  python vector_search.py benchmark_vector_index <query-count>
+  python vector_search.py benchmark_vector_index 1000
+  python vector_search.py build_knn_graph <k> [cosine|ip|l2]
+  python vector_search.py build_knn_graph 50
+  python vector_search.py knn_graph_neighbors <player_id> <k> [cosine|ip|l2]
+  python vector_search.py knn_graph_neighbors aaronha01 50
+  python vector_search.py build_hnsw_index <m> <ef-construction>
+  python vector_search.py build_hnsw_index 4 400
+  python vector_search.py hnsw_report <m> <ef-construction>
+  python vector_search.py hnsw_report 4 400
+  python vector_search.py ivf_sweep
+  python vector_search.py pq_report <subspaces>
+  python vector_search.py pq_report 32
+Options:
+  -h --help     Show this screen.
+  --version     Show version.
+"""
+
+# Local, in-memory vector searches of the wrangled embeddings sidecar,
+# for comparison with the Cosmos DB and Cognitive Search vector searches.
+# See 'python bb_wrangle.py write_embeddings_sidecar'.
+# Chris Joakim, Microsoft, 2023
+
+import json
+import os
+import random
+import sys
+import time
+import traceback
+
+import numpy as np
+
+from docopt import docopt
+
+from pysrc.aibundle import EmbeddingsSidecar, FS
+from pysrc.hnsw import HnswIndex
+from pysrc.ivf import IvfIndex
+from pysrc.knn_graph import KnnGraph
+from pysrc.pq import PqIndex
+from pysrc.vector_index import VectorIndex
+from pysrc.vectors import METRICS, recall_at_k, sample_rows
+
+EMBEDDINGS_SIDECAR_BASENAME = '../data/wrangled/documents_with_embeddings'
+SEARCH_K = 10
+RECALL_QUERY_COUNT = 500
+RECALL_TRUTH_K = 100  # the true neighbors considered for ties with the k-th
+HNSW_EF_SEARCH_SWEEP = [10, 20, 40, 80, 160, 320, 500]
+IVF_NPROBE_SWEEP = [1, 2, 4, 8, 16]
+IVF_TARGET_RECALL = 0.95
+VCORE_NUM_LISTS = 19  # per cosmos_vcore/mongo/baseball_players_create_indexes.txt
+PQ_RERANK_SWEEP = [0, 25, 50, 100, 200]
+
+def print_options(msg):
+    print(msg)
+    arguments = docopt(__doc__, version='1.0.0')
+    print(arguments)
+
+def read_sidecar():
+    return EmbeddingsSidecar(EMBEDDINGS_SIDECAR_BASENAME).load()
+
+def default_metric(sidecar, documents=None) -> str:
+    """
+    Return 'ip' if the sidecar embeddings were L2-normalized at ingest, per
+    the embeddings_normalized flag of their documents, so that the inner
+    product is the cosine similarity and the rows and queries are used as
+    they are, without normalize_rows; else 'cosine'.
+    """
+    if documents is None:
+        documents = sidecar.read_documents()
+    if all(documents.get(id, {}).get('embeddings_normalized', False) for id in sidecar.ids):
+        return 'ip'
+    return 'cosine'
+
+def search_player_like(pid, metric=None):
+    """
+    Search the local VectorIndex for the players like the given playerID,
+    and write the output doc in the shape of the vCore search_player_like.
+    """
+    outfile = f'tmp/local_search_player_like_{pid}.json'
+    sidecar = read_sidecar()
+    documents = sidecar.read_documents()
+    metric = metric or default_metric(sidecar, documents)
+    t1 = time.perf_counter()
+    index = VectorIndex.from_sidecar(sidecar, metric)
+    t2 = time.perf_counter()
+    output_doc = index.search_document_like(pid, documents, SEARCH_K)
+    t3 = time.perf_counter()
+
+    print('===')
+    print(f'searching for: {pid}, metric: {metric}')
+    if pid not in index.index:
+        print(f'player not found: {pid}')
+        return
+    player = output_doc['player']
+    print('found player: {} {} {} {}'.format(pid, player['nameFirst'], player['nameLast'], player['primary_position']))
+    for idx, result_doc in enumerate(output_doc['results']):
+        print('result {}: {} {} {} {} {:.6f}'.format(idx + 1, result_doc['playerID'],
+            result_doc.get('nameFirst'), result_doc.get('nameLast'), result_doc.get('primary_position'), result_doc['score']))
+    print('result_count: {}'.format(len(output_doc['results'])))
+    print(f'index build seconds: {t2 - t1:.4f}, search seconds: {t3 - t2:.6f}')
+    FS.write_json(output_doc, outfile)
+
+def random_player_search():
+    print('===')
+    print('random_player_search...')
+    random_pid = random.choice(read_sidecar().ids)
+    print('random_pid: {}'.format(random_pid))
+    search_player_like(random_pid)
+
+def benchmark_vector_index(query_count):
+    """
+    Time the VectorIndex construction and the top-10 searches of a sample
+    of the players, in one batch and one at a time, for each metric.
+    """
+    print(f'=== benchmark_vector_index, query_count: {query_count}')
+    sidecar = read_sidecar()
+    queries = np.asarray(sidecar.matrix[sample_rows(len(sidecar.ids), query_count)], dtype=np.float32)
+    results = list()
+    for metric in METRICS:
+        t1 = time.perf_counter()
+        index = VectorIndex.from_sidecar(sidecar, metric)
+        t2 = time.perf_counter()
+        index.search(queries, SEARCH_K)
+        t3 = time.perf_counter()
+        for query in queries:
+            index.search(query, SEARCH_K)
+        t4 = time.perf_counter()
+        result = dict(metric=metric, rows=index.size(), dimensions=index.dimensions(), queries=len(queries))
+        result['build_seconds'] = round(t2 - t1, 4)
+        result['batched_seconds'] = round(t3 - t2, 4)
+        result['batched_queries_per_sec'] = round(len(queries) / (t3 - t2), 1)
+        result['single_seconds'] = round(t4 - t3, 4)
+        result['single_queries_per_sec'] = round(len(queries) / (t4 - t3), 1)
+        print(json.dumps(result))
+        results.append(result)
+    FS.write_json(results, 'tmp/vector_index_benchmark.json')
+
+def knn_graph_file(k, metric):
+    return f'{EMBEDDINGS_SIDECAR_BASENAME}_knn{k}_{metric}.bin'
+
+def build_knn_graph(k, metric=None):
+    """
+    Build the all-pairs k nearest neighbors graph of the embeddings, write
+    its adjacency file, and check a sample of its rows against VectorIndex
+    searches.  The row numbers of the graph are those of the sidecar ids.
+    """
+    sidecar = read_sidecar()
+    metric = metric or default_metric(sidecar)
+    print(f'=== build_knn_graph, k: {k}, metric: {metric}')
+    t1 = time.perf_counter()
+    graph = KnnGraph.build(sidecar.matrix, k, metric)
+    t2 = time.perf_counter()
+    outfile = knn_graph_file(k, metric)
+    file_bytes = graph.save(outfile)
+    print(f'file written: {outfile}')
+
+    rows = sample_rows(len(sidecar.ids), RECALL_QUERY_COUNT)
+    index = VectorIndex.from_sidecar(sidecar, metric)
+    truth_rows, truth_scores = index.search(index.matrix[rows], RECALL_TRUTH_K + 1)
+    # drop each row's own result, which the graph excludes
+    order = np.argsort(truth_rows == rows[:, None], axis=1, kind='stable')[:, :RECALL_TRUTH_K]
+    truth_rows, truth_scores = np.take_along_axis(truth_rows, order, axis=1), np.take_along_axis(truth_scores, order, axis=1)
+    result = dict(metric=metric, k=graph.k(), rows=graph.row_count(), workers=os.cpu_count())
+    result['build_seconds'] = round(t2 - t1, 4)
+    result['file_bytes'] = file_bytes
+    result['bytes_per_row'] = round(file_bytes / max(1, graph.row_count()), 1)
+    result[f'recall_at_{graph.k()}'] = round(recall_at_k(truth_rows, graph.neighbors[rows], graph.k(), truth_scores), 4)
+    print(json.dumps(result))
+    FS.write_json(result, f'tmp/knn_graph_{k}_{metric}.json')
+
+def knn_graph_neighbors(pid, k, metric=None):
+    """ Print the neighbors of the given playerID from the memory-mapped adjacency file. """
+    sidecar = read_sidecar()
+    documents = sidecar.read_documents()
+    metric = metric or default_metric(sidecar, documents)
+    graph = KnnGraph.load(knn_graph_file(k, metric))
+    if pid not in sidecar.index:
+        print(f'player not found: {pid}')
+        return
+    t1 = time.perf_counter()
+    rows, scores = graph.lookup(sidecar.index[pid])
+    neighbors = [(sidecar.ids[row], float(score)) for row, score in zip(rows, scores)]
+    elapsed = time.perf_counter() - t1
+    print(f'=== knn_graph_neighbors: {pid}, k: {graph.k()}, metric: {graph.metric}')
+    for idx, (rid, score) in enumerate(neighbors):
+        doc = documents.get(rid, {})
+        print('neighbor {}: {} {} {} {} {:.4f}'.format(idx + 1, rid,
+            doc.get('nameFirst'), doc.get('nameLast'), doc.get('primary_position'), score))
+    print(f'lookup seconds: {elapsed:.6f}')
+
+def hnsw_index_file(m, ef_construction):
+    return f'{EMBEDDINGS_SIDECAR_BASENAME}_hnsw_m{m}_ef{ef_construction}.npz'
+
+def build_hnsw_index(m, ef_construction):
+    """
+    Build the HnswIndex of the embeddings, with the default_metric and the
+    given parameters, in parallel, and save it.
+    """
+    print(f'=== build_hnsw_index, m: {m}, ef_construction: {ef_construction}')
+    sidecar = read_sidecar()
+    index = HnswIndex(sidecar.matrix, default_metric(sidecar), m, ef_construction).build()
+    outfile = hnsw_index_file(m, ef_construction)
+    index.save(outfile)
+    print(f'file written: {outfile}')
+    print(f'rows: {len(index.matrix)}, levels: {index.max_level() + 1}, workers: {os.cpu_count()}, build seconds: {index.build_seconds:.3f}')
+
+def hnsw_report(m, ef_construction):
+    """
+    Build the HnswIndex of the embeddings, with the default_metric and the
+    given parameters, in a single thread and in parallel, and report the build seconds of each
+    side by side, and the recall@10 and per-query latency of each for a sweep
+    of ef_search values, against brute force VectorIndex searches.
+    """
+    print(f'=== hnsw_report, m: {m}, ef_construction: {ef_construction}')
+    sidecar = read_sidecar()
+    metric = default_metric(sidecar)
+    brute_force = VectorIndex.from_sidecar(sidecar, metric)
+    queries = brute_force.matrix[sample_rows(len(sidecar.ids), RECALL_QUERY_COUNT)]
+    truth_rows, truth_scores = brute_force.search(queries, RECALL_TRUTH_K)
+    workers = os.cpu_count() or 1
+    indexes = dict()
+    indexes['single_thread'] = HnswIndex(sidecar.matrix, metric, m, ef_construction).build(max_workers=1)
+    indexes['parallel'] = HnswIndex(sidecar.matrix, metric, m, ef_construction).build(max_workers=workers)
+    builds = {name: round(index.build_seconds, 3) for name, index in indexes.items()}
+    print(f'build seconds, single_thread: {builds["single_thread"]}, parallel: {builds["parallel"]}, workers: {workers}')
+
+    def timed_searches(search):
+        rows, latencies = list(), list()
+        for query in queries:
+            t1 = time.perf_counter()
+            rows.append(search(query)[0][0])
+            latencies.append((time.perf_counter() - t1) * 1000.0)
+        return np.asarray(rows), np.asarray(latencies)
+
+    searches = [('brute_force', None, lambda query, ef_search: brute_force.search(query, SEARCH_K))]
+    for name, index in indexes.items():
+        for ef_search in HNSW_EF_SEARCH_SWEEP:
+            searches.append((name, ef_search, lambda query, ef_search, index=index: index.search(query, SEARCH_K, ef_search)))
+    results = list()
+    for name, ef_search, search in searches:
+        rows, latencies = timed_searches(lambda query: search(query, ef_search))
+        result = dict(search='brute_force' if ef_search is None else 'hnsw', build=name, ef_search=ef_search)
+        result[f'recall_at_{SEARCH_K}'] = round(recall_at_k(truth_rows, rows, SEARCH_K, truth_scores), 4)
+        result['mean_ms'] = round(float(latencies.mean()), 4)
+        result['p50_ms'] = round(float(np.percentile(latencies, 50)), 4)
+        result['p99_ms'] = round(float(np.percentile(latencies, 99)), 4)
+        print(json.dumps(result))
+        results.append(result)
+    report = dict(m=m, ef_construction=ef_construction, metric=metric, rows=len(sidecar.ids), workers=workers,
+        build_seconds=builds, queries=len(queries), results=results)
+    FS.write_json(report, f'tmp/hnsw_report_m{m}_ef{ef_construction}.json')
+
+def ivf_sweep():
+    """
+    Build IvfIndexes, with the default_metric, for a sweep of numLists values, including the
+    rows / 1000 and sqrt(rows) rules of thumb and the current vCore index,
+    and report the recall@10 and query time of each nprobe.  Print the
+    cosmosSearchOptions of the fastest configuration with a recall@10 of at
+    least IVF_TARGET_RECALL, and save that index.
+    """
+    print(f'=== ivf_sweep')
+    sidecar = read_sidecar()
+    row_count = len(sidecar.ids)
+    metric = default_metric(sidecar)
+    brute_force = VectorIndex.from_sidecar(sidecar, metric)
+    queries = brute_force.matrix[sample_rows(row_count, RECALL_QUERY_COUNT)]
+    truth_rows, truth_scores = brute_force.search(queries, RECALL_TRUTH_K)
+    sqrt_rows = np.sqrt(row_count)
+    num_lists_sweep = [max(1, row_count // 1000), VCORE_NUM_LISTS, round(sqrt_rows / 2), round(sqrt_rows), round(sqrt_rows * 2)]
+    num_lists_sweep = sorted(set(n for n in num_lists_sweep if 0 < n <= row_count))
+
+    results, indexes = list(), dict()
+    for num_lists in num_lists_sweep:
+        t1 = time.perf_counter()
+        index = IvfIndex(sidecar.matrix, num_lists, metric).train()
+        build_seconds = time.perf_counter() - t1
+        indexes[num_lists] = index
+        sizes = index.list_sizes()
+        for nprobe in [n for n in IVF_NPROBE_SWEEP if n <= num_lists]:
+            t1 = time.perf_counter()
+            rows, _ = index.search(queries, SEARCH_K, nprobe)
+            elapsed = time.perf_counter() - t1
+            result = dict(num_lists=num_lists, nprobe=nprobe)
+            result[f'recall_at_{SEARCH_K}'] = round(recall_at_k(truth_rows, rows, SEARCH_K, truth_scores), 4)
+            result['query_ms'] = round(elapsed / len(queries) * 1000.0, 4)
+            result['build_seconds'] = round(build_seconds, 3)
+            result['list_size_min'], result['list_size_max'] = int(sizes.min()), int(sizes.max())
+            print(json.dumps(result))
+            results.append(result)
+    t1 = time.perf_counter()
+    brute_force.search(queries, SEARCH_K)
+    brute_force_ms = (time.perf_counter() - t1) / len(queries) * 1000.0
+    print(f'brute force query_ms: {brute_force_ms:.4f}')
+
+    recall_key = f'recall_at_{SEARCH_K}'
+    qualified = [r for r in results if r[recall_key] >= IVF_TARGET_RECALL]
+    if len(qualified) > 0:
+        best = sorted(qualified, key=lambda r: (r['query_ms'], -r[recall_key]))[0]
+    else:
+        best = sorted(results, key=lambda r: (-r[recall_key], r['query_ms']))[0]
+    outfile = f'{EMBEDDINGS_SIDECAR_BASENAME}_ivf{best["num_lists"]}.npz'
+    indexes[best['num_lists']].save(outfile)
+    print(f'file written: {outfile}')
+    # the IP similarity of normalized embeddings is the COS similarity, without the norms
+    similarity = 'IP' if metric == 'ip' else 'COS'
+    options = dict(kind='vector-ivf', numLists=best['num_lists'], similarity=similarity, dimensions=int(sidecar.matrix.shape[1]))
+    print(f'recommended, for a {recall_key} of {best[recall_key]} at nprobe {best["nprobe"]} ({best["query_ms"]} ms per local query):')
+    print(json.dumps(dict(cosmosSearchOptions=options), indent=2))
+    print(f'and cosmosSearch nProbes: {best["nprobe"]} in the $search stage')
+    report = dict(metric=metric, rows=row_count, queries=len(queries), brute_force_query_ms=round(brute_force_ms, 4),
+        target_recall=IVF_TARGET_RECALL, recommended=dict(cosmosSearchOptions=options, nProbes=best['nprobe']), results=results)
+    FS.write_json(report, 'tmp/ivf_sweep.json')
+
+def pq_report(subspaces):
+    """
+    Train a PqIndex of the embeddings, with the default_metric and the given
+    subspaces, save
+    it, and report the recall@10 and query time of its ADC searches against
+    brute force, without and with an exact re-rank of the top candidates
+    from the memory-mapped float32 sidecar matrix.
+    """
+    print(f'=== pq_report, subspaces: {subspaces}')
+    sidecar = read_sidecar()
+    metric = default_metric(sidecar)
+    brute_force = VectorIndex.from_sidecar(sidecar, metric)
+    queries = brute_force.matrix[sample_rows(len(sidecar.ids), RECALL_QUERY_COUNT)]
+    truth_rows, truth_scores = brute_force.search(queries, RECALL_TRUTH_K)
+    t1 = time.perf_counter()
+    index = PqIndex(subspaces, metric).train(sidecar.matrix)
+    train_seconds = time.perf_counter() - t1
+    outfile = f'{EMBEDDINGS_SIDECAR_BASENAME}_pq{subspaces}.npz'
+    index.save(outfile)
+    print(f'file written: {outfile}')
+    index.set_rerank_file(sidecar.matrix_file())
+
+    results = list()
+    for rerank in PQ_RERANK_SWEEP:
+        t1 = time.perf_counter()
+        rows, _ = index.search(queries, SEARCH_K, rerank)
+        elapsed = time.perf_counter() - t1
+        result = dict(rerank=rerank)
+        result[f'recall_at_{SEARCH_K}'] = round(recall_at_k(truth_rows, rows, SEARCH_K, truth_scores), 4)
+        result['query_ms'] = round(elapsed / len(queries) * 1000.0, 4)
+        print(json.dumps(result))
+        results.append(result)
+    report = dict(subspaces=subspaces, metric=metric, rows=len(index.codes), queries=len(queries), train_seconds=round(train_seconds, 3))
+    report['bytes_per_player'] = index.bytes_per_row()
+    report['float32_bytes_per_player'] = int(sidecar.matrix.shape[1] * 4)
+    report['results'] = results
+    print(f'bytes per player: {index.bytes_per_row()}, float32: {report["float32_bytes_per_player"]}, train seconds: {train_seconds:.3f}')
+    FS.write_json(report, f'tmp/pq_report_{subspaces}.json')
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        try:
+            func = sys.argv[1].lower()
+            if func == 'search_player_like':
+                pid = sys.argv[2]
+                metric = sys.argv[3].lower() if len(sys.argv) > 3 else None
+                search_player_like(pid, metric)
+            elif func == 'random_player_search':
+                random_player_search()
+            elif func == 'benchmark_vector_index':
+                query_count = int(sys.argv[2])
+                benchmark_vector_index(query_count)
+            elif func == 'build_knn_graph':
+                k = int(sys.argv[2])
+                metric = sys.argv[3].lower() if len(sys.argv) > 3 else None
+                build_knn_graph(k, metric)
+            elif func == 'knn_graph_neighbors':
+                pid, k = sys.argv[2], int(sys.argv[3])
+                metric = sys.argv[4].lower() if len(sys.argv) > 4 else None
+                knn_graph_neighbors(pid, k, metric)
+            elif func == 'build_hnsw_index':
+                m, ef_construction = int(sys.argv[2]), int(sys.argv[3])
+                build_hnsw_index(m, ef_construction)
+            elif func == 'hnsw_report':
+                m, ef_construction = int(sys.argv[2]), int(sys.argv[3])
+                hnsw_report(m, ef_construction)
+            elif func == 'ivf_sweep':
+                ivf_sweep()
+            elif func == 'pq_report':
+                subspaces = int(sys.argv[2])
+                pq_report(subspaces)
+            else:
+                print_options('Error: invalid function: {}'.format(func))
+        except Exception as e:
+            print(str(e))
+            print(traceback.format_exc())
+    else:
+        print_options('Error: no command-line function specified')